@@ -1,5 +1,6 @@
 import arcpy, os
 import pandas as pd
+from deliverables.ingest import clean_field_names, dataframe_to_table
 
 arcpy.env.overwriteOutput = True
 
@@ -26,34 +27,23 @@ coordsys = "PROJCS[\"NAD_1983_CSRS_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_19
 
 # Path to Biomonitoring Excel file
 inputExcelFile = r"C:\gis\_collab\DATA\BioMonitoringData.xlsx" # change path here
-# csv file path
+# Name of the output feature class
 csvname = os.path.basename(inputExcelFile).split(".")[0]
-csvfile = os.path.join(csvname + '.csv')
-csvfilepath = os.path.join(workspace+'/' + csvfile)
 
 def BioModel():
     print(">> Processing the Biomonitoring data...")
 
 
     # Reading an excel file
-    excelFile = pd.read_excel (inputExcelFile, sheet_name="Biomonitoring")
+    df = pd.read_excel(inputExcelFile, sheet_name="Biomonitoring")
 
+    # Remove spaces and non-word characters from the field names
+    clean_field_names(df)
 
-    # Converting excel file into CSV file
-    excelFile.to_csv (csvfilepath, index = None, header=True)
-
-    # Reading and Converting the output csv file into a dataframe object
-    df = pd.DataFrame(pd.read_csv(csvfilepath))
-
-    # Displaying the dataframe object
-    df.columns=df.columns.str.replace(' ', '_') # replace space with underscore
-    df.columns = df.columns.str.replace(r'\W+', '', regex=True) # delete non-word character
-    df.to_csv(csvfilepath, encoding='utf-8-sig')
-
-    # copy the csv file to geodatabase
-    arcpy.conversion.ExportTable(csvfilepath, ws + "/" + csvname)
-    # convert the csv table into point feature class
-    arcpy.management.XYTableToPoint(csvfilepath, csvname, "Easting", "Northing", "", coordsys)
+    # copy the dataframe to an in-memory table (no intermediate .csv file)
+    bm_table = dataframe_to_table(df, "memory/" + csvname)
+    # convert the table into point feature class
+    arcpy.management.XYTableToPoint(bm_table, csvname, "Easting", "Northing", "", coordsys)
 
 
     # Create coded domain
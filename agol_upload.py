@@ -5,6 +5,8 @@
 # Purpose: Automate the upload of ArcGIS Pro layers to ArcGIS Online (AGOL)
 
 import arcpy, os
+from deliverables.delta import clear_snapshots, delta_publish, snapshot_folder
+from deliverables.portal import arcpy_token, configure_session
 
 # Source: 
 # https://pro.arcgis.com/en/pro-app/latest/arcpy/sharing/featuresharingdraft-class.htm
@@ -22,6 +24,15 @@ sddraft_output_filename = os.path.join(outdir, sddraft_filename)
 sd_filename = service_name + ".sd"
 sd_output_filename = os.path.join(outdir, sd_filename)
 
+# How the feature layer is updated: "overwrite" (stage and upload the whole service again)
+# or "delta" (only send the rows that changed since the last upload - see deliverables/delta.py)
+publish_mode = "overwrite"
+# URL of the existing feature service (for "delta"), e.g. "https://services.arcgis.com/<org id>/arcgis/rest/services/<service name>/FeatureServer"
+service_url = ""
+# Fields that identify a row of each layer/table (for "delta"), e.g. {"Stations": ["SiteCode"], "Data": ["SiteCode", "Date"]}
+# Layers that are not listed are compared on all their fields
+DeltaKeys = {}
+
 # Delete existing files
 print("Deleting existing files...")
 if os.path.exists(sddraft_output_filename):
@@ -42,38 +53,51 @@ for x in range(count_lyrs):
 for x in range(count_tables):
     lyr_list.append(tables[x])
 
-# Create FeatureSharingDraft and enable overwriting
-server_type = "HOSTING_SERVER"
-# Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
-sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
-sddraft.summary = "My Summary"
-sddraft.tags = "My Tags"
-sddraft.description = "My Description"
-sddraft.credits = "My Credits"
-sddraft.useLimitations = "My Use Limitations"
-sddraft.overwriteExistingService = True
+# Only send the rows that changed since the last upload
+# The service is overwritten instead the first time, or when the fields of a layer have changed
+snapshots = snapshot_folder(outdir, service_name)
+published = False
+if publish_mode == "delta" and service_url:
+    print("Comparing to the published data")
+    # Shared connection to ArcGIS Online (kept-alive connections, cached sign-in token - see deliverables/portal.py)
+    configure_session(arcpy_token)
+    published = delta_publish(service_url, {lyr.name: lyr.dataSource for lyr in lyr_list}, DeltaKeys, snapshots)
+
+if not published:
+    # Create FeatureSharingDraft and enable overwriting
+    server_type = "HOSTING_SERVER"
+    # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
+    sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
+    sddraft.summary = "My Summary"
+    sddraft.tags = "My Tags"
+    sddraft.description = "My Description"
+    sddraft.credits = "My Credits"
+    sddraft.useLimitations = "My Use Limitations"
+    sddraft.overwriteExistingService = True
 
-# Create Service Definition Draft file
-# Parameters: exportToSDDraft(out_sddraft)
-sddraft.exportToSDDraft(sddraft_output_filename)
+    # Create Service Definition Draft file
+    # Parameters: exportToSDDraft(out_sddraft)
+    sddraft.exportToSDDraft(sddraft_output_filename)
 
-# Stage Service
-print("Start Staging")
-# Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
-arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+    # Stage Service
+    print("Start Staging")
+    # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
+    arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
 
-# Share to portal
-# Documentation: https://pro.arcgis.com/en/pro-app/latest/tool-reference/server/upload-service-definition.htm
-inOverride = "OVERRIDE_DEFINITION"
-# Sharing options
-inSharePublic = "PRIVATE"                 # Enter "PUBLIC" or "PRIVATE"
-inShareOrg = "NO_SHARE_ORGANIZATION"      # Enter "SHARE_ORGANIZATION" or "NO_SHARE_ORGANIZATION"
-inShareGroup = ""                         # Enter the name of the group(s): in_groups or [in_groups,...]
-# AGOL folder name
-inFolderType = ""                         # Enter "Existing" to specify an existing folder
-inFolderName = ""                         # Enter the existing AGOL folder name
-print("Start Uploading")
-# Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
-arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # Share to portal
+    # Documentation: https://pro.arcgis.com/en/pro-app/latest/tool-reference/server/upload-service-definition.htm
+    inOverride = "OVERRIDE_DEFINITION"
+    # Sharing options
+    inSharePublic = "PRIVATE"                 # Enter "PUBLIC" or "PRIVATE"
+    inShareOrg = "NO_SHARE_ORGANIZATION"      # Enter "SHARE_ORGANIZATION" or "NO_SHARE_ORGANIZATION"
+    inShareGroup = ""                         # Enter the name of the group(s): in_groups or [in_groups,...]
+    # AGOL folder name
+    inFolderType = ""                         # Enter "Existing" to specify an existing folder
+    inFolderName = ""                         # Enter the existing AGOL folder name
+    print("Start Uploading")
+    # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
+    arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # The object ids of the service are new - the next delta upload reads them from the service again
+    clear_snapshots(snapshots)
 
 print("Finish Publishing")
@@ -1,7 +1,11 @@
-import arcpy
 import os
 import re
-import pandas as pd
+from deliverables.ingest import convert_workbooks, print_sheet_report  # reads each worksheet of an .xlsx file into its own .csv file (see deliverables/ingest.py)
+from deliverables.ingest import MANIFEST_NAME, combine_hashes, load_manifest, record_table, save_manifest, table_is_current
+from deliverables.ingest import intermediate_to_table, is_intermediate_file, read_intermediate, validate_field_name
+from deliverables.categories import FBI_CATEGORIES, categorize, categorize_field
+from deliverables.sitecodes import reconcile_dataframe_site_codes, reconcile_table_site_codes
+from deliverables.points import gpkg_layers, read_gpkg_table, write_gpkg_table, xy_to_points_file
 
 ###########################################################################################
 ##### Edit this depending on the user's computer and where they are keeping the files #####
@@ -10,86 +14,142 @@ xlsx_folder_path = r"C:\Winter2023\COLLAB\Data"
 data_folder_path = r"C:\Winter2023\COLLAB\test"
 ws = r"C:\Winter2023\COLLAB\test\test_fgdb.gdb"
 
-
-def xlsx_sheets_to_csv(xlsx_folder_path, data_folder_path):
-    '''
-    This function reads the .xlsx file located at 'xlsx_folder_path' and saves each individual worksheet from that file as separate .csv files in the folder located at 'data_folder_path'
-    It also does some renaming because we don't want spaces in any field names.
-
-    # Documentation: 
-    # Read Excel file - https://pandas.pydata.org/docs/reference/api/pandas.read_excel.html
-    # Convert to .csv - https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_csv.html
-
-    # https://stackoverflow.com/questions/71605777/how-to-convert-multiple-sheets-in-an-excel-workbook-to-csv-files-in-python
-
-    '''
-    for sheet_name, df in pd.read_excel(xlsx_folder_path, index_col=0, sheet_name=None).items():
-        csv_file = os.path.join(data_folder_path, f"{sheet_name}.csv")
-        df.index.name = df.index.name.replace(" ", "")  # don't let there be a space in the field name (this only does the first column of the table but that's all we need for now - for the 'Site Code' that we use for a join)
-        df.to_csv(csv_file, encoding='utf-8')
-
-
-##### Set up the workspace #####
-arcpy.env.workspace = ws
-arcpy.env.overwriteOutput = True
-
-
-
-
-##### Extract .csv files from all the .xlsx files #####
-files_in_xlsx_folder = os.listdir(xlsx_folder_path)
-for filename in files_in_xlsx_folder:
-    # skip anything in the folder that isn't a .xlsx
-    if not filename.endswith(".xlsx"):
-        continue  # skips to the next file in the loop
-    xlsx_sheets_to_csv(xlsx_folder_path + "/" + filename, data_folder_path)
-
-
-##### Load all the .csv files into arcpy tables #####
-files_in_data_folder = os.listdir(data_folder_path)
-for filename in files_in_data_folder:
-    # skip anything in the folder that isn't a .csv
-    if not filename.endswith(".csv"):
-        continue  # skips to the next file in the loop
-
-    # take the ".csv" off the filename, and then "clean" the name by removing any non-word characters
-    out_table_name = os.path.splitext(filename)[0]
-    clean_out_table_name = re.sub(r"[^\w]", "", out_table_name) # re = regular expression - replace any "non-word" character with "" to remove them. 
-    # https://docs.python.org/3/library/re.html 
-
-    arcpy.conversion.ExportTable(data_folder_path + "/" + filename, clean_out_table_name)  # https://pro.arcgis.com/en/pro-app/latest/tool-reference/conversion/export-table.htm
-
-
-##### Special Processing for Biomonitoring Data - add Family Biotic Index Category field #####
-
-# Replace "Family_Biotic_Index__Value_" with the name of the input field
-expression = "calcCategory(float(!Family_Biotic_Index__Value_!))"
-codeblock = """
-def calcCategory(value):
-    if value <= 3.75:
-        return "Excellent"
-    if value > 3.75 and value <= 4.25:
-        return "Very Good"
-    if value > 4.25 and value <= 5:
-        return "Good"
-    if value > 5 and value <= 5.75:
-        return "Fair"
-    if value > 5.75 and value <= 6.5:
-        return "Fairly Poor"
-    if value > 6.5 and value <= 7.25:
-        return "Poor"
-    if value > 7.25 and value <= 10:
-        return "Very Poor"
-    else:
-        return "N/A"
-"""
-# Replace "Family_Biotic_Index__Category_" with the name of the output field, if necessary
-arcpy.management.CalculateField("Biomonitoring", "Family_Biotic_Index__Category_", expression, code_block = codeblock)  # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/calculate-field.htm
-
-
-##### Special Processing  for Coldwater Data - join with Coldwater Streams Metadata to get the location of every site #####
-arcpy.management.JoinField("ColdwaterStreams", "SiteCode", "ColdwaterStreamsmetadata", "SiteCode", ["Easting", "Northing", "Watercourse"])
-
-##### Turn the tables into feature classes #####
-arcpy.management.XYTableToPoint("ColdwaterStreams", "ColdwaterStreams_points", "Easting", "Northing", coordinate_system="NAD 1983 UTM Zone 17N")
-arcpy.management.XYTableToPoint("Biomonitoring", "Biomonitoring_points", "Easting", "Northing", coordinate_system="NAD 1983 UTM Zone 17N")
\ No newline at end of file
+# Set streaming_ingest to True for very large workbooks - the sheets are then read ingest_chunk_rows rows at a time instead of all at once
+streaming_ingest = False
+ingest_chunk_rows = 50000
+# Format of the files the sheets are converted to: "csv" (text) or "parquet" (compressed, keeps the column types - needs pyarrow)
+intermediate_format = "csv"
+# Number of worker processes used to convert the workbooks (1 = one workbook at a time, None = one process per CPU)
+ingest_workers = 1
+# Sheets that have not changed since the last run are not converted or loaded again (see the manifest file in data_folder_path)
+# Set force_rebuild to True to process everything again anyway
+force_rebuild = False
+# Site codes in ColdwaterStreams are matched to the metadata codes ignoring case, spaces and punctuation (see deliverables/sitecodes.py)
+# Set site_code_fuzzy_matching to True to also match codes that are only similar (at least site_code_min_similarity, from 0 to 1)
+site_code_fuzzy_matching = False
+site_code_min_similarity = 0.8
+# Where the tables and points are written: "gdb" (the geodatabase ws, needs ArcGIS Pro) or "gpkg" (the GeoPackage gpkg_path, without arcpy - see deliverables/points.py)
+output_format = "gdb"
+gpkg_path = r"C:\Winter2023\COLLAB\test\test.gpkg"
+# Spatial reference of the Easting/Northing fields, used for the points of both outputs
+# (no outputCoordinateSystem is set here, so XYTableToPoint keeps it too)
+coordinate_system = "NAD 1983 UTM Zone 17N"
+
+if output_format == "gdb":
+    import arcpy
+
+
+# True if the table is in the output (geodatabase or GeoPackage)
+def output_exists(name):
+    if output_format == "gpkg":
+        return name in gpkg_layers(gpkg_path)
+    return arcpy.Exists(name)
+
+
+# The processing only runs when this file is run as a script.
+# The worker processes started by convert_workbooks import this file again, and must not run it a second time.
+if __name__ == '__main__':
+    ##### Set up the workspace #####
+    if output_format == "gdb":
+        arcpy.env.workspace = ws
+        arcpy.env.overwriteOutput = True
+
+
+
+
+    # Content hashes of the sheets and tables from the last run
+    manifest_path = os.path.join(data_folder_path, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+
+    ##### Extract .csv files from all the .xlsx files #####
+    xlsx_paths = []
+    files_in_xlsx_folder = sorted(os.listdir(xlsx_folder_path))  # sorted() so the files are always processed in the same order
+    for filename in files_in_xlsx_folder:
+        # skip anything in the folder that isn't a .xlsx
+        if not filename.endswith(".xlsx"):
+            continue  # skips to the next file in the loop
+        xlsx_paths.append(xlsx_folder_path + "/" + filename)
+    # A workbook that can't be read is reported and skipped - the rest of the workbooks are still converted
+    sheet_report = convert_workbooks(xlsx_paths, data_folder_path, workers=ingest_workers, streaming=streaming_ingest, chunk_rows=ingest_chunk_rows, manifest=manifest, force_rebuild=force_rebuild, file_format=intermediate_format)
+    save_manifest(manifest_path, manifest)
+    print_sheet_report(sheet_report)
+
+    # Hash of the data each table is built from (the table names are the sheet names without the non-word characters)
+    source_hashes = {}
+    for entry in sheet_report:
+        if entry["status"] in ("converted", "unchanged"):
+            source_hashes[re.sub(r"[^\w]", "", entry["sheet"])] = entry["hash"]
+    # The ColdwaterStreams table is joined with the metadata table below, so it also has to be rebuilt when the metadata changes
+    if "ColdwaterStreams" in source_hashes:
+        source_hashes["ColdwaterStreams"] = combine_hashes(source_hashes["ColdwaterStreams"], source_hashes.get("ColdwaterStreamsmetadata"))
+
+
+    ##### Load all the .csv (or .parquet) files into arcpy tables #####
+    # A table is reused if its data has not changed since the table was built
+    rebuilt_tables = []
+    files_in_data_folder = os.listdir(data_folder_path)
+    for filename in files_in_data_folder:
+        # skip anything in the folder that isn't a .csv (or .parquet, depending on intermediate_format)
+        if not is_intermediate_file(filename, intermediate_format):
+            continue  # skips to the next file in the loop
+
+        # take the ".csv" off the filename, and then "clean" the name by removing any non-word characters
+        out_table_name = os.path.splitext(filename)[0]
+        clean_out_table_name = re.sub(r"[^\w]", "", out_table_name) # re = regular expression - replace any "non-word" character with "" to remove them. 
+        # https://docs.python.org/3/library/re.html 
+
+        if not force_rebuild and table_is_current(manifest, clean_out_table_name, source_hashes.get(clean_out_table_name)) and output_exists(clean_out_table_name):
+            print("Reusing table " + clean_out_table_name + " (its data has not changed)")
+            continue
+        if output_format == "gpkg":
+            # Same field names as ExportTable, e.g. "Family Biotic Index (Value)" >> "Family_Biotic_Index__Value_"
+            df = read_intermediate(data_folder_path + "/" + filename)
+            df.columns = [validate_field_name(column) for column in df.columns]
+            write_gpkg_table(df, gpkg_path, clean_out_table_name)
+        else:
+            intermediate_to_table(data_folder_path + "/" + filename, clean_out_table_name)  # .csv files are loaded with https://pro.arcgis.com/en/pro-app/latest/tool-reference/conversion/export-table.htm
+        rebuilt_tables.append(clean_out_table_name)
+
+
+    ##### Special Processing for Biomonitoring Data - add Family Biotic Index Category field #####
+    # (only when the table was rebuilt - the tables that were reused already have it)
+    if "Biomonitoring" in rebuilt_tables:
+        # Replace "Family_Biotic_Index__Value_" with the name of the input field
+        # and "Family_Biotic_Index__Category_" with the name of the output field, if necessary
+        # The breakpoints and labels are in FBI_CATEGORIES (see deliverables/categories.py); values such as "N/A" get the category "N/A"
+        if output_format == "gpkg":
+            biomonitoring = read_gpkg_table(gpkg_path, "Biomonitoring")
+            biomonitoring["Family_Biotic_Index__Category_"] = categorize(biomonitoring["Family_Biotic_Index__Value_"], **FBI_CATEGORIES)
+            write_gpkg_table(biomonitoring, gpkg_path, "Biomonitoring")
+        else:
+            categorize_field("Biomonitoring", "Family_Biotic_Index__Value_", "Family_Biotic_Index__Category_", FBI_CATEGORIES)
+
+
+    ##### Special Processing  for Coldwater Data - join with Coldwater Streams Metadata to get the location of every site #####
+    if "ColdwaterStreams" in rebuilt_tables:
+        # Fix the site codes that don't exactly match the metadata first - the matches are listed in SiteCode_report.csv
+        report_path = os.path.join(data_folder_path, "SiteCode_report.csv")
+        if output_format == "gpkg":
+            coldwater = read_gpkg_table(gpkg_path, "ColdwaterStreams")
+            metadata = read_gpkg_table(gpkg_path, "ColdwaterStreamsmetadata")
+            reconcile_dataframe_site_codes(coldwater, "SiteCode", metadata, "SiteCode", report_path, fuzzy=site_code_fuzzy_matching, min_similarity=site_code_min_similarity)
+            # Like JoinField: every row gets the fields of the first metadata row with the same site code
+            locations = metadata.drop_duplicates("SiteCode")[["SiteCode", "Easting", "Northing", "Watercourse"]]
+            write_gpkg_table(coldwater.merge(locations, how="left", on="SiteCode"), gpkg_path, "ColdwaterStreams")
+        else:
+            reconcile_table_site_codes("ColdwaterStreams", "SiteCode", "ColdwaterStreamsmetadata", "SiteCode", report_path, fuzzy=site_code_fuzzy_matching, min_similarity=site_code_min_similarity)
+            arcpy.management.JoinField("ColdwaterStreams", "SiteCode", "ColdwaterStreamsmetadata", "SiteCode", ["Easting", "Northing", "Watercourse"])
+
+    ##### Turn the tables into feature classes #####
+    for table_name in ["ColdwaterStreams", "Biomonitoring"]:
+        if table_name in rebuilt_tables or not output_exists(table_name + "_points"):
+            if output_format == "gpkg":
+                xy_to_points_file(read_gpkg_table(gpkg_path, table_name), gpkg_path, "Easting", "Northing", coordinate_system, layer=table_name + "_points")
+            else:
+                arcpy.management.XYTableToPoint(table_name, table_name + "_points", "Easting", "Northing", coordinate_system=coordinate_system)
+
+    # Remember which data the tables were built from, so they can be reused on the next run
+    for table_name in rebuilt_tables:
+        record_table(manifest, table_name, source_hashes.get(table_name))
+    save_manifest(manifest_path, manifest)
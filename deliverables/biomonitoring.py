@@ -50,6 +50,34 @@ sharegroup = ""                         # Enter the name of the group(s): "My Gr
 foldertype = ""                         # Enter "Existing" to specify an existing folder
 foldername = ""                         # Enter the existing AGOL folder name
 
+# >>> Choose how the feature layer is updated on AGOL
+#   "overwrite" >> stage and upload the whole service again
+#   "delta"     >> only send the rows that were added, changed or deleted since the last upload (see delta.py)
+#                  the service stays online; it is overwritten anyway the first time or when the fields change
+publish_mode = "overwrite"
+# URL of the existing feature service (for "delta"), e.g. "https://services.arcgis.com/<org id>/arcgis/rest/services/<service name>/FeatureServer"
+service_url = ""
+# Fields that identify a row of each layer/table (for "delta") - layers that are not listed are compared on all their fields
+DeltaKeys = {"Biomonitoring_Stations": ["Site_Code"]}
+
+# >>> Upload the .sd file in parts of upload_chunk_mb, trying again when the connection fails (see uploads.py)
+# For slow or unreliable connections: if the upload stops, running the script again continues where it stopped
+chunked_upload = False
+upload_chunk_mb = 8
+# Maximum number of requests sent to ArcGIS Online at the same time (the connections and the sign-in token are reused - see portal.py)
+max_portal_requests = 4
+
+# >>> Set to True to process the data again even if the Excel file and the settings have not changed
+force_rebuild = False
+
+# >>> Choose where the layers and tables are written
+#   "gdb"  >> the geodatabase (ws), then added to the map and uploaded to AGOL (needs ArcGIS Pro)
+#   "gpkg" >> a GeoPackage file (gpkg_path), built without arcpy (see points.py), e.g. on a Linux computer
+#             the domains and attribute rules are not created and nothing is uploaded
+output_format = "gdb"
+# Path to the GeoPackage (for "gpkg")
+gpkg_path = r"C:\Output\Biomonitoring.gpkg"
+
 # >>> Enter the URLS for the site photos {Site_Code : URL}
 StationList = {"ASD01" : "https://fleming.maps.arcgis.com/sharing/rest/content/items/fd7803f0164a4a7aa3d32a249dadd2d6/data",
               "BMI_PR-001" : "https://fleming.maps.arcgis.com/sharing/rest/content/items/2956d805298349d6a60634ba0b5f6047/data",
@@ -74,155 +102,177 @@ StationList = {"ASD01" : "https://fleming.maps.arcgis.com/sharing/rest/content/i
 ########################################################################################
 
 
-import arcpy, os, pandas as pd
+import os, pandas as pd
+from categories import FBI_CATEGORIES, SENSITIVE_ORGANISMS_CATEGORIES, arcade_category_expression
+from delta import clear_snapshots, delta_publish, snapshot_folder
+from ingest import MANIFEST_NAME, add_photos, clean_field_names, combine_hashes, dataframe_to_table, hash_table, hash_workbook, load_manifest, print_photo_report, record_service, record_table, save_manifest, service_is_current, station_photos, stations_to_points, table_is_current, unique_stations
+from points import gpkg_layers, write_gpkg_table, xy_to_points_file
+from portal import arcpy_token, configure_session
+from uploads import upload_service_definition
 
 # Coordinate system
 coordsys = "PROJCS[\"NAD_1983_CSRS_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_1983_CSRS\",DATUM[\"D_North_American_1983_CSRS\",SPHEROID[\"GRS_1980\",6378137.0,298.257222101]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",-81.0],PARAMETER[\"Scale_Factor\",0.9996],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]"
 
-arcpy.env.overwriteOutput = True
+if output_format not in ("gdb", "gpkg"):
+    raise ValueError("Unknown output_format '" + str(output_format) + "' - use \"gdb\" or \"gpkg\"")
+
+# arcpy and the .aprx file are only needed for the geodatabase
+if output_format == "gdb":
+    import arcpy
+    arcpy.env.overwriteOutput = True
+
+    # Remove layers and tables from map view
+    print(">> Removing existing layers from map view...")
+    aprx = arcpy.mp.ArcGISProject(aprx_path)
+    m = aprx.listMaps()[0] 
+    table_list = m.listTables()
+    for tbl in table_list:
+        m.removeTable(tbl)
+    fc_list = m.listLayers()
+    for fc in fc_list:
+        m.removeLayer(fc)
+    aprx.save()
 
-# Remove layers and tables from map view
-print(">> Removing existing layers from map view...")
-aprx = arcpy.mp.ArcGISProject(aprx_path)
-m = aprx.listMaps()[0] 
-table_list = m.listTables()
-for tbl in table_list:
-    m.removeTable(tbl)
-fc_list = m.listLayers()
-for fc in fc_list:
-    m.removeLayer(fc)
-aprx.save()
+# True if the layer or table is in the output (geodatabase or GeoPackage)
+def outputExists(name):
+    if output_format == "gpkg":
+        return name in gpkg_layers(gpkg_path)
+    return arcpy.Exists(name)
 
 def BioModel():
     print(">> Processing the Biomonitoring data...")
 
-    # Importing data(xlsx to csv):
-    print("\tConverting the Excel file to .csv")
-    # csv file path
+    # Name of the data table in the geodatabase
     csvname = "Biomonitoring_Data"
-    csvname_ext = csvname + ".csv"
-    csvfilepath = os.path.join(outdir, csvname_ext)
+    BM_Stations = "Biomonitoring_Stations"
+
+    # Skip the processing if the Biomonitoring sheet and the station photos have not changed since the last run
+    # (the content hashes from the last run are stored in a manifest file in the output folder)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    source_hash = combine_hashes(hash_workbook(input_BM_table)["sheets"].get("Biomonitoring"), StationList)
+    if not force_rebuild and all(table_is_current(manifest, table, source_hash) and outputExists(table) for table in [csvname, BM_Stations]):
+        print("\tThe Excel file has not changed - reusing the existing tables")
+        return
+
+    # Importing data (xlsx to table):
+    print("\tLoading the Excel file")
     # Reading an excel file
-    excelFile = pd.read_excel (input_BM_table, sheet_name="Biomonitoring")
-    # Converting excel file into CSV file
-    excelFile.to_csv(csvfilepath, index = None, header=True)
-    # Reading and Converting the output csv file into a dataframe object
-    df = pd.DataFrame(pd.read_csv(csvfilepath))
-    # Displaying the dataframe object
-    df.columns=df.columns.str.replace(' ', '_') # replace space with underscore
-    df.columns = df.columns.str.replace(r'\W+', '', regex = True) # delete non-word character
-    df.to_csv(csvfilepath, encoding = 'utf-8-sig')
-    # copy the csv file to geodatabase
-    arcpy.conversion.ExportTable(csvfilepath, csvname)
+    df = pd.read_excel(input_BM_table, sheet_name="Biomonitoring")
+    # Remove spaces and non-word characters from the field names
+    clean_field_names(df)
+    # The Family Biotic Index Value field is text in the Excel file - store it as a number (DOUBLE) instead
+    # Values that are not numbers (e.g. "N/A") become null; the field is renamed in place so it keeps its position
+    df.rename(columns={"Family_Biotic_Index_Value": "FamilyBioticIndex_Value"}, inplace=True)
+    df["FamilyBioticIndex_Value"] = pd.to_numeric(df["FamilyBioticIndex_Value"], errors="coerce").astype(float)
+    # Write the dataframe straight to the geodatabase or GeoPackage (no intermediate .csv file)
+    if output_format == "gpkg":
+        write_gpkg_table(df, gpkg_path, csvname)
+    else:
+        dataframe_to_table(df, csvname)
 
 
     # Biomonitoring stations:
     print("\tCreating station points")
-    # Convert the table to a point feature class
-    BM_Stations = "Biomonitoring_Stations"
-    arcpy.management.XYTableToPoint(csvname, BM_Stations, "Easting", "Northing", "", coordsys)
-    # Delete duplicate site codes
-    arcpy.management.DeleteIdentical(BM_Stations, "Site_Code")
+    # Create one point per site code
     # Only keep the fields that contain the basic station information
-    field_list = arcpy.ListFields(BM_Stations)
-    field_list_delete = []
-    for field in field_list:
-        if field.baseName != "OBJECTID" and field.baseName != "Shape" and field.baseName != "Watercourse" and field.baseName != "Site_Code" and field.baseName != "Site_Type" and field.baseName != "Habitat_Type":
-            field_list_delete.append(field.baseName)
-    arcpy.management.DeleteField(BM_Stations, drop_field=field_list_delete)
-
-    # Add photos to station points
-    print("\tAdding photos")
-    # Create a new text field
-    arcpy.management.AddField(BM_Stations, "Photo", "TEXT")
-    for station in StationList:
-        station_where = "Site_Code = " + "'" + station + "'"
-        BM_SelectStation = arcpy.management.SelectLayerByAttribute(BM_Stations, where_clause=station_where)
-        station_calc = "'" + StationList.get(station) + "'"
-        arcpy.management.CalculateField(BM_SelectStation, "Photo", station_calc)
+    if output_format == "gpkg":
+        # The photos are added before the points are written (look up every station's photo in StationList in a single pass)
+        stations = unique_stations(df, "Site_Code", ["Watercourse", "Site_Type", "Habitat_Type", "Easting", "Northing"])
+        unmatched = station_photos(stations, "Site_Code", StationList)
+        xy_to_points_file(stations, gpkg_path, "Easting", "Northing", coordsys, layer=BM_Stations, drop_xy=True)
+    else:
+        stations_to_points(df, BM_Stations, "Site_Code", ["Watercourse", "Site_Type", "Habitat_Type"], "Easting", "Northing", coordsys)
+
+        # Add photos to station points
+        print("\tAdding photos")
+        # Look up every station's photo in StationList in a single pass
+        unmatched = add_photos(BM_Stations, "Site_Code", StationList)
+    print_photo_report(unmatched)
 
     
-    # Domains:
-    print("\tCreating domains")
-    # Create coded domain
-    desc_ws = arcpy.Describe(ws)
-    desc_domains = desc_ws.domains
-    # Assign domain name
-    domainname_FBI = "FBIndex_domain"
-    domainname_SO="Sensitiveorganism_domain"
-    infield_SO="Sensitive_Organisms_Category"
-    infield_FBI="Family_Biotic_Index_Category"
-    # coded value dictionary
-    domDict_SO={"A":"Above Average", "B":"Below Average", "AVG":"Average"}
-    domDict_FBI={"E":"Excellent", "VG":"Very Good", "G":"Good","F":"Fair","FP":"Fairly Poor","P":"Poor","VP":"Very Poor"}
-    # Check if the domain exists
-    if domainname_SO not in desc_domains:
-        # Create Domain
-        arcpy.management.CreateDomain(ws, domainname_SO, "Sensitive Organism Category", "TEXT", "CODED")[0]
-    for code in domDict_SO:
-        # Assign coded value to domain
-        arcpy.management.AddCodedValueToDomain(ws, domainname_SO, code, domDict_SO[code])[0]
-    # Assign domain to field    
-    arcpy.AssignDomainToField_management(csvname, infield_SO, domainname_SO)[0]
-    # Repeat for the second coded domain
-    if domainname_FBI not in desc_domains:
-        arcpy.management.CreateDomain(ws, domainname_FBI, "FamilyBioticIndex Category", "TEXT", "CODED")[0]
-        for code2 in domDict_FBI:
-            arcpy.management.AddCodedValueToDomain(ws, domainname_FBI, code2, domDict_FBI[code2])[0]
-    arcpy.AssignDomainToField_management(csvname, infield_FBI, domainname_FBI)[0]
-
-    # Add new field(Family Biotic Index Value), type DOUBLE. The original field is TEXT. 
-    arcpy.AddField_management(csvname, "FamilyBioticIndex_Value", "DOUBLE", field_length = 20)
-    arcpy.management.CalculateField(csvname, "FamilyBioticIndex_Value", "!Family_Biotic_Index_Value!")
-    # delete field **
-    arcpy.management.DeleteField(csvname, ["Family_Biotic_Index_Value", "Field1"])
-  
-    ###Calculation rules, automate category based on value
-    #** In Arcade, Null returns 0. When inserting a new row, and when FamilyBioticIndex Value field is Null, it will return 'Excellent' in the category field. 
-    #** An option to solve this is excluding 0 in the following calculation rule. eg. if ($feature.FamilyBioticIndex_Value > 0)
-    #** Or change the wrong field back to Null manually
+    # The domains and attribute rules are only created in the geodatabase
+    if output_format == "gdb":
+        # Domains:
+        print("\tCreating domains")
+        # Create coded domain
+        desc_ws = arcpy.Describe(ws)
+        desc_domains = desc_ws.domains
+        # Assign domain name
+        domainname_FBI = "FBIndex_domain"
+        domainname_SO="Sensitiveorganism_domain"
+        infield_SO="Sensitive_Organisms_Category"
+        infield_FBI="Family_Biotic_Index_Category"
+        # coded value dictionary
+        domDict_SO={"A":"Above Average", "B":"Below Average", "AVG":"Average"}
+        domDict_FBI={"E":"Excellent", "VG":"Very Good", "G":"Good","F":"Fair","FP":"Fairly Poor","P":"Poor","VP":"Very Poor"}
+        # Check if the domain exists
+        if domainname_SO not in desc_domains:
+            # Create Domain
+            arcpy.management.CreateDomain(ws, domainname_SO, "Sensitive Organism Category", "TEXT", "CODED")[0]
+        for code in domDict_SO:
+            # Assign coded value to domain
+            arcpy.management.AddCodedValueToDomain(ws, domainname_SO, code, domDict_SO[code])[0]
+        # Assign domain to field    
+        arcpy.AssignDomainToField_management(csvname, infield_SO, domainname_SO)[0]
+        # Repeat for the second coded domain
+        if domainname_FBI not in desc_domains:
+            arcpy.management.CreateDomain(ws, domainname_FBI, "FamilyBioticIndex Category", "TEXT", "CODED")[0]
+            for code2 in domDict_FBI:
+                arcpy.management.AddCodedValueToDomain(ws, domainname_FBI, code2, domDict_FBI[code2])[0]
+        arcpy.AssignDomainToField_management(csvname, infield_FBI, domainname_FBI)[0]
+
+        ###Calculation rules, automate category based on value
+        #** In Arcade, Null returns 0. When inserting a new row, and when FamilyBioticIndex Value field is Null, it would return 'Excellent' in the category field. 
+        #** The rule checks IsEmpty first, so these rows get a Null category instead (a value of 0 is still 'Excellent')
     
-    print("\tCreating attribute rules")
-    # Create Global ID for attribute rules
-    arcpy.management.AddGlobalIDs(csvname)
-    # Create attribute rule(CALCULATION) for Family Biotic Index
-    name = "FBI_calculateRuleCategory"
-    script_expression = 'if ($feature.FamilyBioticIndex_Value >= 0 && $feature.FamilyBioticIndex_Value <= 3.75) {return "Excellent"} else if ($feature.FamilyBioticIndex_Value > 3.75 && $feature.FamilyBioticIndex_Value <= 4.25) {return "Very Good"} else if ($feature.FamilyBioticIndex_Value > 4.25 && $feature.FamilyBioticIndex_Value <= 5) {return "Good"} else if ($feature.FamilyBioticIndex_Value > 5 && $feature.FamilyBioticIndex_Value <= 5.75) {return "Fair"} else if ($feature.FamilyBioticIndex_Value > 5.75 && $feature.FamilyBioticIndex_Value <= 6.5) {return "Fairly Poor"} else if ($feature.FamilyBioticIndex_Value > 6.5 && $feature.FamilyBioticIndex_Value <= 7.25) {return "Poor"} else if ($feature.FamilyBioticIndex_Value > 7.25 && $feature.FamilyBioticIndex_Value <= 10) {return "Very Poor"} else {return null}'
-    triggering_events = "INSERT;UPDATE"
-    description = "Populate Catogory Based on Value"
-    # Run the AddAttributeRule tool
-    arcpy.management.AddAttributeRule(csvname, name, "CALCULATION", script_expression, "EDITABLE", triggering_events, "", "", description, "", infield_FBI)
-
-    # Create attribute rule(CALCULATION) for Sensitive Organisms
-    name3 = "SO_calculateRuleCategory"
-    script_expression3 = 'if ($feature.Sensitive_Organisms_ > 20.9) {return "Above Average"} else if ($feature.Sensitive_Organisms_ > 0 && $feature.Sensitive_Organisms_ < 20.9 ) {return "Below Average"} else if ($feature.Sensitive_Organisms_ == 20.9 ) {return "Average"} else{return null}'
-    triggering_events = "INSERT;UPDATE"
-    description3 = "Populate Catogory Based on Value"
-    # Run the AddAttributeRule tool
-    arcpy.management.AddAttributeRule(csvname, name3, "CALCULATION", script_expression3, "EDITABLE", triggering_events, "", "", description3, "", infield_SO)
+        print("\tCreating attribute rules")
+        # Create Global ID for attribute rules
+        arcpy.management.AddGlobalIDs(csvname)
+        # Create attribute rule(CALCULATION) for Family Biotic Index
+        name = "FBI_calculateRuleCategory"
+        # The breakpoints and labels are in FBI_CATEGORIES (see categories.py)
+        script_expression = arcade_category_expression("FamilyBioticIndex_Value", **{**FBI_CATEGORIES, "missing": None})
+        triggering_events = "INSERT;UPDATE"
+        description = "Populate Catogory Based on Value"
+        # Run the AddAttributeRule tool
+        arcpy.management.AddAttributeRule(csvname, name, "CALCULATION", script_expression, "EDITABLE", triggering_events, "", "", description, "", infield_FBI)
+
+        # Create attribute rule(CALCULATION) for Sensitive Organisms
+        name3 = "SO_calculateRuleCategory"
+        script_expression3 = arcade_category_expression("Sensitive_Organisms_", **SENSITIVE_ORGANISMS_CATEGORIES)
+        triggering_events = "INSERT;UPDATE"
+        description3 = "Populate Catogory Based on Value"
+        # Run the AddAttributeRule tool
+        arcpy.management.AddAttributeRule(csvname, name3, "CALCULATION", script_expression3, "EDITABLE", triggering_events, "", "", description3, "", infield_SO)
     
-    ###Constraint rules, limit values to be entered
-    # Create attribute rule(CONSTRAINT) for Family Biotic Index
-    name2 = "FBConstraintRule"
-    script_expression2 = '$feature.FamilyBioticIndex_Value >= 0  && $feature.FamilyBioticIndex_Value <= 10'
-    triggering_events = "INSERT;UPDATE"
-    description2 = "Constraint rule, prevent value from out of range: Family Biotic Index Value range from 0 to 10"
-    subtype = "ALL"
-    error_number = 2001
-    error_message = "Invalid Family Biotic Index Value. Must be greater than or equal to 0; or less than or equal to 10."
-    # Run the AddAttributeRule tool
-    arcpy.management.AddAttributeRule(csvname, name2, "CONSTRAINT", script_expression2, "EDITABLE", triggering_events, error_number, error_message, description2, subtype)
-
-    # Create attribute rule(CONSTRAINT) for sensitive organism
-    name4 = "SOConstraintRule"
-    script_expression4 = '$feature.Sensitive_Organisms_ >= 0 && $feature.Sensitive_Organisms_ <= 100'
-    triggering_events = "INSERT;UPDATE"
-    description4 = "Constraint rule, prevent value from out of range: 0 - 100"
-    subtype = "ALL"
-    error_number2 = 2002
-    error_message2 = "Invalid Sensitive Organism Value. Must be greater than or equal to 0; or less than and equal to 100."
-    # Run the AddAttributeRule tool
-    arcpy.management.AddAttributeRule(csvname, name4, "CONSTRAINT", script_expression4, "EDITABLE", triggering_events, error_number2, error_message2, description4, subtype)
+        ###Constraint rules, limit values to be entered
+        # Create attribute rule(CONSTRAINT) for Family Biotic Index
+        name2 = "FBConstraintRule"
+        script_expression2 = '$feature.FamilyBioticIndex_Value >= 0  && $feature.FamilyBioticIndex_Value <= 10'
+        triggering_events = "INSERT;UPDATE"
+        description2 = "Constraint rule, prevent value from out of range: Family Biotic Index Value range from 0 to 10"
+        subtype = "ALL"
+        error_number = 2001
+        error_message = "Invalid Family Biotic Index Value. Must be greater than or equal to 0; or less than or equal to 10."
+        # Run the AddAttributeRule tool
+        arcpy.management.AddAttributeRule(csvname, name2, "CONSTRAINT", script_expression2, "EDITABLE", triggering_events, error_number, error_message, description2, subtype)
+
+        # Create attribute rule(CONSTRAINT) for sensitive organism
+        name4 = "SOConstraintRule"
+        script_expression4 = '$feature.Sensitive_Organisms_ >= 0 && $feature.Sensitive_Organisms_ <= 100'
+        triggering_events = "INSERT;UPDATE"
+        description4 = "Constraint rule, prevent value from out of range: 0 - 100"
+        subtype = "ALL"
+        error_number2 = 2002
+        error_message2 = "Invalid Sensitive Organism Value. Must be greater than or equal to 0; or less than and equal to 100."
+        # Run the AddAttributeRule tool
+        arcpy.management.AddAttributeRule(csvname, name4, "CONSTRAINT", script_expression4, "EDITABLE", triggering_events, error_number2, error_message2, description4, subtype)
+
+    # Remember which data the tables were built from, so they can be reused on the next run
+    record_table(manifest, csvname, source_hash)
+    record_table(manifest, BM_Stations, source_hash)
+    save_manifest(manifest_path, manifest)
 
 # Add all feature classes and tables to the map display
 def GDBToMap():
@@ -257,13 +307,6 @@ def AGOLUpload():
     sd_filename = service_name + ".sd"
     sd_output_filename = os.path.join(outdir, sd_filename)
 
-    # Delete existing files
-    print("\tDeleting existing files...")
-    if os.path.exists(sddraft_output_filename):
-        os.remove(sddraft_output_filename)
-    if os.path.exists(sd_output_filename):
-        os.remove(sd_output_filename)
-
     # Reference layers to publish
     # aprx = arcpy.mp.ArcGISProject(aprx_path)
     # m = aprx.listMaps()[0]      # Specify the name of the map if necessary
@@ -277,25 +320,67 @@ def AGOLUpload():
     for x in range(count_tables):
         lyr_list.append(tables[x])
 
-    # Create FeatureSharingDraft and enable overwriting
+    # Skip the upload if the layers, tables and settings have not changed since the last upload
+    # (the hashes of what the service was staged and published from are stored in the manifest - see ingest.py)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    staging_hash = combine_hashes(*[hash_table(lyr.dataSource) for lyr in lyr_list], [lyr.name for lyr in lyr_list], service_name, mysummary, mytags, mydescription, mycredits, myuselimitations)
+    publishing_hash = combine_hashes(staging_hash, sharepublic, shareorg, sharegroup, foldertype, foldername)
+    if not force_rebuild and service_is_current(manifest, service_name, "published", publishing_hash):
+        print("\tThe layers and tables have not changed since the last upload - skipping the upload")
+        removeMapLayers()
+        return
+
+    # Shared connection to ArcGIS Online for the requests below (kept-alive connections, cached sign-in token - see portal.py)
+    configure_session(arcpy_token, max_in_flight=max_portal_requests)
+
+    # Only send the rows that changed since the last upload (see delta.py)
+    # The service is overwritten instead the first time, or when the fields of a layer have changed
+    snapshots = snapshot_folder(outdir, service_name)
+    if publish_mode == "delta" and service_url:
+        print("\tComparing to the published data")
+        if delta_publish(service_url, {lyr.name: lyr.dataSource for lyr in lyr_list}, DeltaKeys, snapshots):
+            record_service(manifest, service_name, "published", publishing_hash)
+            save_manifest(manifest_path, manifest)
+            print("\tFinish Publishing (only the changes were sent)")
+            removeMapLayers()
+            return
+        print("\tOverwriting the service")
+
+    # Publish to ArcGIS Online (the hosting server)
     server_type = "HOSTING_SERVER"
-    # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
-    sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
-    sddraft.summary = mysummary
-    sddraft.tags = mytags
-    sddraft.description = mydescription
-    sddraft.credits = mycredits
-    sddraft.useLimitations = myuselimitations
-    sddraft.overwriteExistingService = True
-
-    # Create Service Definition Draft file
-    # Parameters: exportToSDDraft(out_sddraft)
-    sddraft.exportToSDDraft(sddraft_output_filename)
-
-    # Stage Service
-    print("\tStart Staging")
-    # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
-    arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+
+    # Reuse the .sd file if it was staged from the same layers, tables and settings (e.g. the last upload failed)
+    if not force_rebuild and service_is_current(manifest, service_name, "staged", staging_hash) and os.path.exists(sd_output_filename):
+        print("\tReusing the staged service definition " + sd_output_filename)
+    else:
+        # Delete existing files
+        print("\tDeleting existing files...")
+        if os.path.exists(sddraft_output_filename):
+            os.remove(sddraft_output_filename)
+        if os.path.exists(sd_output_filename):
+            os.remove(sd_output_filename)
+
+        # Create FeatureSharingDraft and enable overwriting
+        # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
+        sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
+        sddraft.summary = mysummary
+        sddraft.tags = mytags
+        sddraft.description = mydescription
+        sddraft.credits = mycredits
+        sddraft.useLimitations = myuselimitations
+        sddraft.overwriteExistingService = True
+
+        # Create Service Definition Draft file
+        # Parameters: exportToSDDraft(out_sddraft)
+        sddraft.exportToSDDraft(sddraft_output_filename)
+
+        # Stage Service
+        print("\tStart Staging")
+        # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
+        arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+        record_service(manifest, service_name, "staged", staging_hash)
+        save_manifest(manifest_path, manifest)
 
     # Share to portal
     # Documentation: https://pro.arcgis.com/en/pro-app/latest/tool-reference/server/upload-service-definition.htm
@@ -309,12 +394,26 @@ def AGOLUpload():
     inFolderName = foldername
     print("\tStart Uploading")
 
-    # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
-    arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # Upload the .sd file in parts that can be resumed (see uploads.py), or in one request
+    if chunked_upload:
+        # Same folder as UploadServiceDefinition: "Existing" or "New" (created if it does not exist yet), otherwise the root folder
+        upload_service_definition(arcpy.GetActivePortalURL(), sd_output_filename, service_name, None, inFolderName if inFolderType in ("Existing", "New") else "",
+                                  everyone=inSharePublic == "PUBLIC", org=inShareOrg == "SHARE_ORGANIZATION", groups=inShareGroup, chunk_mb=upload_chunk_mb,
+                                  create_folder=inFolderType == "New")
+    else:
+        # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
+        arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # The object ids of the service are new - the next delta upload reads them from the service again
+    clear_snapshots(snapshots)
+    record_service(manifest, service_name, "published", publishing_hash)
+    save_manifest(manifest_path, manifest)
 
     print("\tFinish Publishing")
 
-    # Delete tables and layers from the map view
+    removeMapLayers()
+
+# Delete tables and layers from the map view
+def removeMapLayers():
     table_list = m.listTables()
     for tbl in table_list:
         m.removeTable(tbl)
@@ -323,9 +422,18 @@ def AGOLUpload():
         m.removeLayer(fc)
     aprx.save()
 
-if __name__ == '__main__':
-    # Global Environment settings
-    with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
-        BioModel()
+# Process the data and add it to the map (everything before the upload) - also used by publish_all.py
+def ProcessData():
+    BioModel()
+    if output_format == "gdb":
         GDBToMap()
-        AGOLUpload()
+
+if __name__ == '__main__':
+    if output_format == "gpkg":
+        ProcessData()
+        print(">> Wrote the layers and tables to " + gpkg_path)
+    else:
+        # Global Environment settings
+        with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
+            ProcessData()
+            AGOLUpload()
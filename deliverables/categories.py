@@ -0,0 +1,132 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Turns numeric scores into text categories, e.g. a Family Biotic Index value of 4.5 >> "Good".
+# A category table lists the upper limit (breakpoint) of every category and its label.
+# The whole column is classified at once by looking up every value in the sorted breakpoints,
+# instead of running an if-chain on every row. The same tables are used to write the Arcade
+# attribute rules, so the rules and the processed data always use the same limits.
+#   from categories import FBI_CATEGORIES, categorize
+#   categorize(df["Family_Biotic_Index_Value"], **FBI_CATEGORIES)
+# arcpy is not imported at the top of this file, so the functions can also be used outside of ArcGIS Pro.
+
+import numpy as np
+import pandas as pd
+
+
+#############################################
+#####          CATEGORY TABLES          #####
+#############################################
+
+# Each table has:
+#   breakpoints >> upper limit of each category, in increasing order (the limit is part of the category)
+#   labels      >> name of each category, one per breakpoint
+#   lowest      >> values less than or equal to this are not in any category (None = no lower limit)
+#   lowest_inclusive >> True if a value equal to 'lowest' is in the first category (values below it are still not)
+#   exact       >> categories for single values, e.g. {20.9: "Average"} (checked before the breakpoints)
+#   missing     >> value used when a score is empty, not a number (e.g. "N/A") or outside every category
+
+# Family Biotic Index
+#   0 <= value <= 3.75 >> Excellent, 3.75 < value <= 4.25 >> Very Good, ... 7.25 < value <= 10 >> Very Poor
+#   Negative values get no category
+FBI_CATEGORIES = {"breakpoints": [3.75, 4.25, 5, 5.75, 6.5, 7.25, 10],
+                  "labels": ["Excellent", "Very Good", "Good", "Fair", "Fairly Poor", "Poor", "Very Poor"],
+                  "lowest": 0,
+                  "lowest_inclusive": True,
+                  "exact": {},
+                  "missing": "N/A"}
+
+# Sensitive Organisms (%)
+#   0 < value < 20.9 >> Below Average, value = 20.9 >> Average, value > 20.9 >> Above Average
+SENSITIVE_ORGANISMS_CATEGORIES = {"breakpoints": [20.9, np.inf],
+                                  "labels": ["Below Average", "Above Average"],
+                                  "lowest": 0,
+                                  "lowest_inclusive": False,
+                                  "exact": {20.9: "Average"},
+                                  "missing": None}
+
+
+#############################################
+#####            CATEGORIZE             #####
+#############################################
+
+# Category of every value in 'values' (a list, array or pandas Series), returned as a pandas Series of labels
+# Text that is not a number (e.g. "N/A") gets the 'missing' value instead of raising an error
+def categorize(values, breakpoints, labels, lowest=None, lowest_inclusive=False, exact=None, missing="N/A"):
+    if len(breakpoints) != len(labels):
+        raise ValueError("A category table needs one label per breakpoint (" + str(len(breakpoints)) + " breakpoints, " + str(len(labels)) + " labels)")
+    if list(breakpoints) != sorted(breakpoints):
+        raise ValueError("The breakpoints of a category table must be in increasing order: " + str(list(breakpoints)))
+
+    values = pd.Series(values)
+    numbers = pd.to_numeric(values, errors="coerce").astype(float)
+    # Position of the first breakpoint that is >= the value (len(breakpoints) if the value is above the last one)
+    positions = np.searchsorted(np.asarray(breakpoints, dtype=float), numbers.to_numpy(), side="left")
+    choices = np.array(list(labels) + [missing], dtype=object)
+    categories = pd.Series(choices[positions], index=values.index, dtype=object)
+
+    categories[numbers.isna()] = missing
+    if lowest is not None and lowest_inclusive:
+        categories[numbers < lowest] = missing
+    elif lowest is not None:
+        categories[numbers <= lowest] = missing
+    for value, label in (exact or {}).items():
+        categories[numbers == value] = label
+    return categories
+
+
+# Calculate a category field from a score field of a geodatabase table (replaces CalculateField with an if-chain codeblock)
+# The scores are read in one pass, categorized at once and written back in a second pass
+#   in_field  >> field with the scores (numbers, or text such as "4.5" and "N/A")
+#   out_field >> text field for the categories (created if it does not exist)
+# Documentation:
+# https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/updatecursor-class.htm
+def categorize_field(table, in_field, out_field, category_table):
+    import arcpy
+
+    if out_field not in [field.name for field in arcpy.ListFields(table)]:
+        arcpy.management.AddField(table, out_field, "TEXT")
+
+    oids = []
+    scores = []
+    with arcpy.da.SearchCursor(table, ["OID@", in_field]) as cursor:
+        for oid, score in cursor:
+            oids.append(oid)
+            scores.append(score)
+    category_by_oid = dict(zip(oids, categorize(scores, **category_table)))
+
+    with arcpy.da.UpdateCursor(table, ["OID@", out_field]) as cursor:
+        for row in cursor:
+            row[1] = category_by_oid.get(row[0])
+            cursor.updateRow(row)
+
+
+# Arcade expression for a calculation attribute rule that returns the category of a field, e.g.
+#   if (IsEmpty($feature.Score)) {return null} else if ($feature.Score >= 0 && $feature.Score <= 3.75) {return "Excellent"} else if (...) {...} else {return null}
+# Empty values are checked first: Arcade reads an empty value as 0 in a comparison, so it would otherwise get the category of 0
+def arcade_category_expression(field, breakpoints, labels, lowest=None, lowest_inclusive=False, exact=None, missing=None):
+    score = "$feature." + field
+    branches = ["if (IsEmpty(" + score + ")) {return " + arcade_text(missing) + "}"]
+    for value, label in (exact or {}).items():
+        branches.append("if (" + score + " == " + arcade_number(value) + ") {return " + arcade_text(label) + "}")
+    lower = lowest
+    for i, (breakpoint, label) in enumerate(zip(breakpoints, labels)):
+        conditions = []
+        if lower is not None:
+            inclusive = lowest_inclusive and i == 0
+            conditions.append(score + (" >= " if inclusive else " > ") + arcade_number(lower))
+        if breakpoint != np.inf:
+            conditions.append(score + " <= " + arcade_number(breakpoint))
+        branches.append("if (" + " && ".join(conditions or ["true"]) + ") {return " + arcade_text(label) + "}")
+        lower = breakpoint
+    return " else ".join(branches) + " else {return " + arcade_text(missing) + "}"
+
+
+def arcade_number(value):
+    return "{:g}".format(value)
+
+
+def arcade_text(value):
+    if value is None:
+        return "null"
+    return '"' + str(value).replace('"', '\\"') + '"'
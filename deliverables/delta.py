@@ -0,0 +1,305 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Updates a feature layer on ArcGIS Online with only the rows that changed since the last upload,
+# instead of staging and uploading the whole service again (overwriting it).
+#   1. every layer/table is compared to a snapshot of what was last published (stored in the output folder),
+#      row by row, using key fields such as the station and the sample date
+#   2. the inserts, updates and deletes are sent to the feature service in batches (applyEdits)
+#   3. the snapshot is updated
+# The first time, the snapshot is read from the feature service itself. The service stays online during the update.
+# If the fields of a layer changed (or a layer is new), the changes can't be sent as edits and the service has to be
+# overwritten as before - delta_publish() then returns False without changing anything.
+#   from delta import delta_publish
+#   if not delta_publish(service_url, {lyr.name: lyr.dataSource for lyr in lyr_list}, DeltaKeys, snapshot_folder(outdir, service_name)):
+#       ... overwrite the service ...
+# The requests only use the ArcGIS REST API (Python standard library, see uploads.py and portal.py), so they can be sent to a local test server.
+# arcpy is only imported to read the geodatabase tables.
+# Documentation:
+# https://developers.arcgis.com/rest/services-reference/enterprise/apply-edits-feature-service-layer/
+# https://developers.arcgis.com/rest/services-reference/enterprise/query-feature-service-layer/
+
+import json, os, shutil
+import numpy as np
+import pandas as pd
+try:
+    from .uploads import request_json, with_retries      # imported as deliverables.delta (e.g. from agol_upload.py)
+except ImportError:
+    from uploads import request_json, with_retries
+
+# Number of features sent in one applyEdits request
+DEFAULT_BATCH_SIZE = 1000
+# Seconds to wait for an answer from the service
+DEFAULT_TIMEOUT = 300
+# Number of times a request is sent again if the connection fails (not for adds - an add that reached the
+# service before the connection failed would be added twice, so adds are sent as non-idempotent requests with no retries)
+DEFAULT_RETRIES = 5
+# Columns of a snapshot that are not fields of the layer
+OBJECT_ID = "__ObjectId"        # object id of the row in the feature service
+X, Y = "__x", "__y"             # point coordinates (in the spatial reference of the geodatabase)
+# Coordinates are compared to the millimetre, so a round trip through the service does not look like a change
+COORDINATE_DECIMALS = 3
+# Key value used for empty keys
+NULL_KEY = "<null>"
+# Field types that are not compared or sent (they are managed by the geodatabase/service)
+SKIPPED_FIELD_TYPES = ("OID", "Geometry", "GlobalID", "Blob", "Raster")
+SKIPPED_FIELDS = ("shape_length", "shape_area")
+
+
+#############################################
+#####           DELTA PUBLISH           #####
+#############################################
+
+# Send the changes of the geodatabase layers/tables to the feature service
+#   sources >> {name of the layer/table in the service: path of the gdb table/feature class}
+#   key_fields >> {name: [fields that identify a row]}, e.g. {"PWQMN_Data": ["Station__", "Sample_Date", "TEST_CODE"]}
+#                 layers that are not listed are compared on all their fields (a changed row is deleted and added again)
+#   snapshot_folder >> folder with the snapshots of the last published state (see snapshot_folder)
+#   token >> ArcGIS Online token to use instead of the token of the shared session (see portal.py)
+# Returns True if the service is up to date, False if it has to be overwritten instead
+def delta_publish(service_url, sources, key_fields, snapshot_folder, token=None, batch_size=DEFAULT_BATCH_SIZE):
+    frames = {name: read_table(source) for name, source in sources.items()}
+    return publish_changes(service_url, frames, key_fields, snapshot_folder, token, batch_size)
+
+
+# Same as delta_publish, for tables that are already DataFrames
+#   frames >> {name of the layer/table in the service: (DataFrame, wkid of the coordinates or None for a table)}
+#             a layer's DataFrame has its point coordinates in the X and Y columns
+def publish_changes(service_url, frames, key_fields, snapshot_folder, token=None, batch_size=DEFAULT_BATCH_SIZE):
+    service = rest_request(service_url, {}, token)
+    layer_ids = {layer["name"]: layer["id"] for layer in service.get("layers", []) + service.get("tables", [])}
+    missing = [name for name in frames if name not in layer_ids]
+    if missing:
+        print("\tNot in the feature service: " + ", ".join(missing))
+        return False
+
+    # Compare every layer before sending any edit, so the service is never left half updated by a schema change
+    changes = {}
+    for name, (df, wkid) in frames.items():
+        layer_url = service_url.rstrip("/") + "/" + str(layer_ids[name])
+        layer = rest_request(layer_url, {}, token)
+        oid_field = layer.get("objectIdField", "OBJECTID")
+        current = service_values(df)
+        snapshot_path = os.path.join(snapshot_folder, name + ".pkl")
+        if os.path.exists(snapshot_path):
+            snapshot = pd.read_pickle(snapshot_path)
+        else:
+            print("\tReading the published " + name + " from the feature service")
+            try:
+                snapshot = query_snapshot(layer_url, oid_field, [column for column in current.columns if column not in (X, Y)], wkid, token, layer.get("maxRecordCount"))
+            except RuntimeError as e:
+                print("\t" + str(e))
+                return False
+        if sorted(snapshot.columns.drop(OBJECT_ID)) != sorted(current.columns):
+            print("\tThe fields of " + name + " have changed")
+            return False
+        changes[name] = (layer_url, oid_field, wkid, snapshot_path) + diff_snapshot(snapshot, current, key_fields.get(name))
+
+    os.makedirs(snapshot_folder, exist_ok=True)
+    for name, (layer_url, oid_field, wkid, snapshot_path, adds, updates, deletes, unchanged) in changes.items():
+        print("\t" + name + ": " + str(len(adds)) + " added, " + str(len(updates)) + " updated, " + str(len(deletes)) + " deleted")
+        try:
+            added_ids = apply_edits(layer_url, adds, updates, deletes, oid_field, wkid, token, batch_size)
+        except Exception:
+            # Some batches may have been applied - read the snapshot from the service again next time
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+            raise
+        # The new snapshot: the unchanged and updated rows keep their object ids, the added rows get the new ones
+        # (empty parts are left out - e.g. the snapshot of an empty service would make every column an object column,
+        # and the keys of the next run would not match)
+        adds = adds.assign(**{OBJECT_ID: added_ids})
+        parts = [part for part in (unchanged, updates, adds) if len(part) > 0]
+        (pd.concat(parts, ignore_index=True) if parts else unchanged).to_pickle(snapshot_path)
+    return True
+
+
+# Folder of the snapshots of a service (next to the .sd file)
+def snapshot_folder(outdir, service_name):
+    return os.path.join(outdir, service_name + "_snapshot")
+
+
+# Delete the snapshots, e.g. after the service was overwritten (the object ids are new)
+def clear_snapshots(folder):
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+
+
+#############################################
+#####          COMPARING ROWS           #####
+#############################################
+
+# Compare the current rows of a layer to its snapshot
+#   key_fields >> fields that identify a row (None = all the fields); rows with the same key are matched in order
+# Returns (adds, updates, deletes, unchanged):
+#   adds >> new rows, updates >> changed rows with the OBJECT_ID of the published row,
+#   deletes >> object ids of the published rows that are gone, unchanged >> snapshot rows that did not change
+def diff_snapshot(snapshot, current, key_fields=None):
+    fields = list(current.columns)
+    keys = [field for field in (key_fields or fields) if field in fields]
+    if key_fields and len(keys) < len(key_fields):
+        print("\tWARNING: Key fields not found: " + ", ".join(field for field in key_fields if field not in fields) + " - comparing all fields")
+        keys = fields
+    old = snapshot.set_index(row_keys(snapshot, keys))
+    new = current.set_index(row_keys(current, keys))
+
+    is_new = ~new.index.isin(old.index)
+    is_deleted = ~old.index.isin(new.index)
+    common = new.index[~is_new]
+    old_common = old.loc[common]
+    new_common = new.loc[common]
+    changed = np.zeros(len(common), dtype=bool)
+    for field in fields:
+        changed |= ~same_values(old_common[field], new_common[field])
+
+    adds = new[is_new].reset_index(drop=True)
+    updates = new_common[changed].assign(**{OBJECT_ID: old_common[OBJECT_ID].to_numpy()[changed]}).reset_index(drop=True)
+    deletes = [int(oid) for oid in old.loc[is_deleted, OBJECT_ID]]
+    unchanged = old_common[~changed].reset_index(drop=True)
+    return adds, updates, deletes, unchanged
+
+
+# Key of every row as text: the key fields plus the number of earlier rows with the same fields (so duplicates stay apart)
+# Numbers are compared as floats, so 1 (from the service) and 1.0 (from the geodatabase) are the same key
+def row_keys(df, keys):
+    parts = [key_text(df[key]) for key in keys]
+    key = parts[0].str.cat(parts[1:], sep="|") if len(parts) > 1 else parts[0]
+    occurrence = key.groupby(key).cumcount().astype(str)
+    return pd.Index(key.str.cat(occurrence, sep="#"))
+
+
+def key_text(column):
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        numbers = pd.to_numeric(column, errors="coerce").astype(float)
+        return numbers.map(repr).where(numbers.notna(), NULL_KEY).reset_index(drop=True)
+    return column.astype(object).map(str).where(column.notna(), NULL_KEY).reset_index(drop=True)
+
+
+# True where two columns have the same value (empty values are the same, numbers are compared as floats)
+def same_values(a, b):
+    a = a.to_numpy()
+    b = b.to_numpy()
+    a_numbers = pd.to_numeric(pd.Series(a), errors="coerce").to_numpy(dtype=float)
+    b_numbers = pd.to_numeric(pd.Series(b), errors="coerce").to_numpy(dtype=float)
+    a_null = pd.isna(a)
+    b_null = pd.isna(b)
+    both_numbers = ~np.isnan(a_numbers) & ~np.isnan(b_numbers)
+    same = np.where(both_numbers, np.isclose(a_numbers, b_numbers, rtol=1e-9, atol=0), a == b)
+    return (same & ~a_null & ~b_null) | (a_null & b_null)
+
+
+# The values of a DataFrame as they are stored in a feature service: dates >> milliseconds since 1970 (UTC), coordinates rounded
+def service_values(df):
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object and values.notna().any() and values.dropna().map(lambda value: hasattr(value, "year")).all():
+            values = pd.to_datetime(values, errors="coerce")
+        if pd.api.types.is_datetime64_any_dtype(values):
+            if values.dt.tz is None:
+                values = values.dt.tz_localize("UTC")
+            df[column] = (values - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)
+    for column in (X, Y):
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").round(COORDINATE_DECIMALS)
+    return df
+
+
+#############################################
+#####        FEATURE SERVICE REST       #####
+#############################################
+
+# Send a request to the ArcGIS REST API and return the JSON answer (see uploads.py)
+# Requests that fail because of the connection or a busy server are sent again, unless retries=0
+#   idempotent=False >> the request is never sent again once it may have reached the service (see portal.py)
+def rest_request(url, params, token=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, idempotent=True):
+    return with_retries(lambda: request_json(url, params, token, timeout, idempotent=idempotent), retries)
+
+
+# Read the published rows of a layer (all the pages of the query) as a snapshot
+#   page_size >> rows per request (the maxRecordCount of the layer)
+def query_snapshot(layer_url, oid_field, fields, wkid=None, token=None, page_size=None):
+    page_size = page_size or DEFAULT_BATCH_SIZE
+    params = {"where": "1=1", "outFields": ",".join([oid_field] + fields), "orderByFields": oid_field,
+              "returnGeometry": "true" if wkid else "false", "resultRecordCount": page_size}
+    if wkid:
+        params["outSR"] = wkid
+    rows = []
+    while True:
+        result = rest_request(layer_url + "/query", dict(params, resultOffset=len(rows)), token)
+        for feature in result.get("features", []):
+            row = dict(feature["attributes"])
+            if wkid:
+                geometry = feature.get("geometry") or {}
+                row[X] = geometry.get("x")
+                row[Y] = geometry.get("y")
+            rows.append(row)
+        if not result.get("exceededTransferLimit") or not result.get("features"):
+            break
+    columns = [oid_field] + fields + ([X, Y] if wkid else [])
+    snapshot = pd.DataFrame(rows, columns=columns).rename(columns={oid_field: OBJECT_ID})
+    return service_values(snapshot)
+
+
+# Send the deletes, updates and adds of a layer in batches of 'batch_size' features
+# Returns the object ids of the added rows
+def apply_edits(layer_url, adds, updates, deletes, oid_field="OBJECTID", wkid=None, token=None, batch_size=DEFAULT_BATCH_SIZE):
+    for start in range(0, len(deletes), batch_size):
+        result = rest_request(layer_url + "/applyEdits", {"deletes": ",".join(str(oid) for oid in deletes[start:start + batch_size]), "rollbackOnFailure": "true"}, token)
+        check_edit_results(layer_url, result.get("deleteResults", []))
+    for start in range(0, len(updates), batch_size):
+        features = edit_features(updates.iloc[start:start + batch_size], oid_field, wkid)
+        result = rest_request(layer_url + "/applyEdits", {"updates": json.dumps(features), "rollbackOnFailure": "true"}, token)
+        check_edit_results(layer_url, result.get("updateResults", []))
+    added_ids = []
+    for start in range(0, len(adds), batch_size):
+        features = edit_features(adds.iloc[start:start + batch_size], oid_field, wkid)
+        result = rest_request(layer_url + "/applyEdits", {"adds": json.dumps(features), "rollbackOnFailure": "true"}, token, retries=0, idempotent=False)
+        added_ids += check_edit_results(layer_url, result.get("addResults", []))
+    return added_ids
+
+
+# Raise a RuntimeError if an edit failed, otherwise return the object ids of the edits
+def check_edit_results(layer_url, results):
+    errors = [result.get("error", {}).get("description", "unknown error") for result in results if not result.get("success")]
+    if errors:
+        raise RuntimeError(layer_url + ": " + str(len(errors)) + " edits failed, e.g. " + str(errors[0]))
+    return [result.get("objectId") for result in results]
+
+
+# Features of an applyEdits request ({"attributes": {...}, "geometry": {...}}) for the rows of a DataFrame
+def edit_features(df, oid_field="OBJECTID", wkid=None):
+    fields = [column for column in df.columns if column not in (OBJECT_ID, X, Y)]
+    values = df.astype(object).where(df.notna(), None)
+    features = []
+    for _, row in values.iterrows():
+        attributes = {field: plain_value(row[field]) for field in fields}
+        if OBJECT_ID in df.columns:
+            attributes[oid_field] = int(row[OBJECT_ID])
+        feature = {"attributes": attributes}
+        if wkid:
+            feature["geometry"] = None if row[X] is None or row[Y] is None else {"x": float(row[X]), "y": float(row[Y]), "spatialReference": {"wkid": wkid}}
+        features.append(feature)
+    return features
+
+
+def plain_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+#############################################
+#####        GEODATABASE TABLES         #####
+#############################################
+
+# Read a geodatabase table or feature class (e.g. lyr.dataSource) as a DataFrame with the fields that are published
+# Returns (DataFrame, wkid of the points or None for a table); the point coordinates are in the X and Y columns
+def read_table(source):
+    import arcpy
+
+    fields = [field.name for field in arcpy.ListFields(source) if field.type not in SKIPPED_FIELD_TYPES and field.name.lower() not in SKIPPED_FIELDS]
+    description = arcpy.Describe(source)
+    is_layer = getattr(description, "shapeType", None) == "Point"
+    cursor_fields = fields + (["SHAPE@X", "SHAPE@Y"] if is_layer else [])
+    with arcpy.da.SearchCursor(source, cursor_fields) as cursor:
+        df = pd.DataFrame([row for row in cursor], columns=fields + ([X, Y] if is_layer else []))
+    return df, (description.spatialReference.factoryCode if is_layer else None)
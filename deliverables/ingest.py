@@ -0,0 +1,911 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Helper functions for the "xlsx -> csv -> table" part of the pipeline (see dataLoading.md).
+# They are shared by the data processing scripts, e.g.
+#   from ingest import xlsx_sheets_to_csv
+# arcpy is not imported at the top of this file, so the functions can also be used outside of ArcGIS Pro.
+
+import hashlib, itertools, json, multiprocessing, os, posixpath, re, sys, time, zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# Number of rows that are held in memory at once when a sheet is streamed to .csv
+DEFAULT_CHUNK_ROWS = 50000
+
+# Intermediate file formats for the sheets (see intermediate_format in the scripts) and their file extensions
+#   "csv"     >> UTF-8 text; every value is read back as text and has to be parsed again
+#   "parquet" >> compressed columnar file that keeps the column types (dates stay dates, numbers stay numbers)
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+
+# Name of the file that stores the content hashes of the inputs (see INCREMENTAL INGEST below)
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+#############################################
+#####      EXCEL TO CSV CONVERSION      #####
+#############################################
+
+# Excel File Data Pre-Processing - makes .xslx file into .csvs and removes any spaces from field names.
+#   streaming=False >> pandas reads each sheet into memory, then writes the .csv file
+#   streaming=True  >> the rows are read in chunks of 'chunk_rows' and each sheet's .csv is written as it goes,
+#                      so the memory use stays the same no matter how large the workbook is
+#   sheet_names     >> list of the sheets to convert - any other sheet is never parsed or written (None = every sheet)
+#   file_format     >> "csv" or "parquet" (see FILE_EXTENSIONS) - the files are named after the sheets either way
+# Returns a report with one entry per sheet in the workbook (see print_sheet_report)
+# Documentation:
+# Read Excel file - https://pandas.pydata.org/docs/reference/api/pandas.read_excel.html
+# Read-only mode - https://openpyxl.readthedocs.io/en/stable/optimized.html
+def xlsx_sheets_to_csv(path_to_excel_file, output_folder, streaming=False, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_names=None, file_format="csv"):
+    if streaming:
+        return stream_xlsx_sheets_to_csv(path_to_excel_file, output_folder, chunk_rows, sheet_names, file_format)
+    report = []
+    # ExcelFile only lists the sheets - each sheet is parsed when it is asked for
+    with pd.ExcelFile(path_to_excel_file) as xl:
+        for sheet_name in xl.sheet_names:
+            if sheet_names is not None and sheet_name not in sheet_names:
+                report.append(sheet_report(path_to_excel_file, sheet_name, "skipped", book_row_count(xl, sheet_name)))
+                continue
+            start = time.perf_counter()
+            df = xl.parse(sheet_name, index_col=0)
+            # Remove spaces in field names
+            df.index.name = df.index.name.replace(" ", "")
+            write_sheet(df, output_file(output_folder, sheet_name, file_format), file_format)
+            report.append(sheet_report(path_to_excel_file, sheet_name, "converted", len(df), time.perf_counter() - start))
+    return report
+
+
+# Streaming version of xlsx_sheets_to_csv - only 'chunk_rows' rows of one sheet are in memory at a time
+def stream_xlsx_sheets_to_csv(path_to_excel_file, output_folder, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_names=None, file_format="csv"):
+    from openpyxl import load_workbook
+
+    report = []
+    # read_only=True parses the sheet xml lazily instead of building the whole workbook in memory
+    # data_only=True returns the cached value of formula cells (the same thing pandas reads)
+    wb = load_workbook(path_to_excel_file, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            if sheet_names is not None and ws.title not in sheet_names:
+                report.append(sheet_report(path_to_excel_file, ws.title, "skipped", sheet_row_count(ws)))
+                continue
+            start = time.perf_counter()
+            rows = stream_sheet_to_csv(ws, output_file(output_folder, ws.title, file_format), chunk_rows, file_format)
+            report.append(sheet_report(path_to_excel_file, ws.title, "converted", rows, time.perf_counter() - start))
+    finally:
+        # Read-only workbooks keep the file open until they are closed
+        wb.close()
+    return report
+
+
+# Write one openpyxl worksheet to a .csv (or .parquet) file, 'chunk_rows' rows at a time
+# Returns the number of data rows written
+def stream_sheet_to_csv(ws, csv_file, chunk_rows=DEFAULT_CHUNK_ROWS, file_format="csv"):
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be at least 1")
+    check_file_format(file_format)
+    rows = ws.iter_rows(values_only=True)
+
+    # The first non-empty row holds the field names
+    header = None
+    for row in rows:
+        if not is_blank_row(row):
+            header = row
+            break
+    if header is None:
+        # Empty sheet - write an empty file so every sheet still gets a .csv
+        if file_format == "parquet":
+            pd.DataFrame().to_parquet(csv_file)
+        else:
+            open(csv_file, "w", encoding='utf-8').close()
+        return 0
+    columns = clean_column_names(header)
+    # Remove spaces in field names (same as the pandas version - only the first column, which becomes the index)
+    index_name = columns[0].replace(" ", "")
+
+    parquet_writer = ParquetSheetWriter(csv_file) if file_format == "parquet" else None
+    chunk = []
+    first_chunk = True
+    row_count = 0
+    blank_rows = 0
+    try:
+        for row in rows:
+            # Blank rows are kept like pandas keeps them, except at the end of the sheet - so they are only
+            # written once a row with data comes after them
+            if is_blank_row(row):
+                blank_rows += 1
+                continue
+            for data_row in itertools.chain(itertools.repeat(None, blank_rows), [row]):
+                chunk.append([None] * len(columns) if data_row is None else fit_row(data_row, len(columns)))
+                row_count += 1
+                if len(chunk) >= chunk_rows:
+                    write_chunk(chunk, columns, index_name, csv_file, first_chunk, parquet_writer)
+                    chunk = []
+                    first_chunk = False
+            blank_rows = 0
+        # Write whatever is left over (or just the header if the sheet has no data rows)
+        if chunk or first_chunk:
+            write_chunk(chunk, columns, index_name, csv_file, first_chunk, parquet_writer)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    return row_count
+
+
+# Write one chunk of rows to the .csv file, or to the ParquetSheetWriter if there is one
+def write_chunk(chunk, columns, index_name, out_file, first_chunk, parquet_writer=None):
+    if parquet_writer is None:
+        write_csv_chunk(chunk, columns, index_name, out_file, first_chunk)
+        return
+    df = pd.DataFrame(chunk, columns=columns)
+    df = df.rename(columns={columns[0]: index_name})
+    parquet_writer.write(df)
+
+
+# Append one chunk of rows to the .csv file (the first chunk creates the file and writes the header)
+def write_csv_chunk(chunk, columns, index_name, csv_file, first_chunk):
+    df = pd.DataFrame(chunk, columns=columns)
+    df = df.set_index(columns[0])
+    df.index.name = index_name
+    if first_chunk:
+        df.to_csv(csv_file, encoding='utf-8')
+    else:
+        df.to_csv(csv_file, encoding='utf-8', mode="a", header=False)
+
+
+# Path of the file a sheet is written to, e.g. output_file(folder, "ColdwaterStreams", "parquet") >> folder/ColdwaterStreams.parquet
+def output_file(output_folder, sheet_name, file_format="csv"):
+    return os.path.join(output_folder, sheet_name + FILE_EXTENSIONS[file_format])
+
+
+# Raise an error for a file format that is not in FILE_EXTENSIONS
+def check_file_format(file_format):
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError("Unknown file format '{}' - use one of {}".format(file_format, list(FILE_EXTENSIONS)))
+
+
+# Write a whole sheet (read by pandas, with the first column as the index) to a .csv or .parquet file
+def write_sheet(df, out_file, file_format="csv"):
+    check_file_format(file_format)
+    if file_format == "parquet":
+        parquet_types(df.reset_index()).to_parquet(out_file, index=False)
+    else:
+        df.to_csv(out_file, encoding='utf-8')
+
+
+# Give every text (object) column one type so it can be stored in a .parquet file:
+#   only numbers >> numeric, only dates >> datetime, anything else (e.g. "<0.5" mixed with numbers) >> text
+def parquet_types(df):
+    df = df.copy()
+    for column_name in df.columns:
+        column = df[column_name]
+        if column.dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(column, skipna=True)
+        if kind in ("integer", "floating", "mixed-integer-float", "decimal"):
+            df[column_name] = pd.to_numeric(column)
+        elif kind in ("datetime", "datetime64", "date"):
+            df[column_name] = pd.to_datetime(column)
+        elif kind == "boolean":
+            continue
+        elif kind != "empty":
+            df[column_name] = column.where(column.isna(), column.astype(str))
+    return df
+
+
+# Writes the chunks of one sheet to a .parquet file (one row group per chunk)
+# The column types are taken from the first chunk. Whole numbers are stored as decimals, because a later chunk
+# can have empty cells in the same column. If a later chunk has text in a column that was numeric so far (or the
+# first values of a column that was empty so far), the column type is changed and the rows written so far are
+# copied to a new file one row group at a time.
+# Documentation: https://arrow.apache.org/docs/python/parquet.html
+class ParquetSheetWriter:
+    def __init__(self, out_file):
+        import_pyarrow()
+        self.out_file = out_file
+        self.schema = None
+        self.writer = None
+        self.empty_columns = set()  # columns that only had empty cells so far
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(parquet_types(df), preserve_index=False)
+        if self.schema is None:
+            self.empty_columns = {field.name for field in table.schema if pa.types.is_null(field.type)}
+            self.schema = pa.schema([self.file_field(field) for field in table.schema])
+            self.writer = pq.ParquetWriter(self.out_file, self.schema)
+
+        new_types = {}
+        for field, column in zip(self.schema, table.columns):
+            if pa.types.is_null(column.type):
+                continue
+            if field.name in self.empty_columns:
+                # First values in this column - use their type
+                new_types[field.name] = self.file_field(pa.field(field.name, column.type)).type
+                self.empty_columns.discard(field.name)
+            elif not self.fits(column, field.type):
+                # Values that don't fit the column's type (e.g. "<0.5" in a numeric column) - store the column as text
+                new_types[field.name] = pa.string()
+        if new_types:
+            self.change_types(new_types)
+        self.writer.write_table(table.cast(self.schema))
+
+    # Type used in the file for a column (empty columns are text until they get values)
+    def file_field(self, field):
+        import pyarrow as pa
+        if pa.types.is_null(field.type):
+            return field.with_type(pa.string())
+        if pa.types.is_integer(field.type):
+            return field.with_type(pa.float64())
+        return field
+
+    # True if the values of a column can be stored with the given type
+    def fits(self, column, field_type):
+        import pyarrow as pa
+        try:
+            column.cast(field_type)
+            return True
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return False
+
+    # Change the type of some columns ({column name: new type}) and rewrite the rows written so far
+    def change_types(self, new_types):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.writer.close()
+        self.schema = pa.schema([field.with_type(new_types[field.name]) if field.name in new_types else field for field in self.schema])
+        old_file = self.out_file + ".old"
+        os.replace(self.out_file, old_file)
+        self.writer = pq.ParquetWriter(self.out_file, self.schema)
+        old = pq.ParquetFile(old_file)
+        for i in range(old.num_row_groups):
+            self.writer.write_table(old.read_row_group(i).cast(self.schema))
+        old.close()
+        os.remove(old_file)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Import pyarrow, with a clear error message if it is not installed (it is only needed for the "parquet" format)
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("The 'parquet' format needs the pyarrow package. Install it in the ArcGIS Pro Python environment or use 'csv'.")
+    return pyarrow
+
+
+# Name the header cells the same way pandas.read_excel does:
+#   empty cells become "Unnamed: <position>" and repeated names get ".1", ".2", ... added to the end
+def clean_column_names(header):
+    columns = []
+    seen = {}
+    for position, name in enumerate(header):
+        if name is None or str(name).strip() == "":
+            name = f"Unnamed: {position}"
+        name = str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+# True if every cell in the row is empty
+def is_blank_row(row):
+    return all(value is None for value in row)
+
+
+# Make a row the same length as the header - read-only worksheets can return ragged rows
+def fit_row(row, length):
+    row = list(row[:length])
+    if len(row) < length:
+        row.extend([None] * (length - len(row)))
+    return row
+
+
+#############################################
+#####    PARALLEL WORKBOOK CONVERSION   #####
+#############################################
+
+# Convert several workbooks at once - every sheet of every workbook is converted by a pool of 'workers' processes
+#   workers=None uses one process per CPU, workers=1 converts the sheets one after another in this process
+#   The .csv files get the same names as with xlsx_sheets_to_csv. If two workbooks have a sheet with the same name,
+#   the workbook that comes last in 'xlsx_paths' wins: only its sheet is converted, the others are "replaced".
+#   A workbook or sheet that can't be read is reported with the status "error" - the other files are still converted.
+#   manifest        >> the dictionary returned by load_manifest. Sheets whose content hash is the same as in the manifest
+#                      (and whose .csv file is still there) are not converted again and are reported as "unchanged".
+#                      A sheet that is in several workbooks is converted again if any of them has changed.
+#                      The manifest is updated with the new hashes - save it with save_manifest.
+#   force_rebuild   >> convert every sheet, even if it has not changed
+# Note: worker processes import the script that calls this function again, so that script must not do its
+#   processing at the top level (put it under "if __name__ == '__main__':")
+# Documentation:
+# https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+# https://pro.arcgis.com/en/pro-app/latest/arcpy/get-started/multiprocessing-with-arcpy.htm
+def convert_workbooks(xlsx_paths, output_folder, workers=None, streaming=False, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_names=None, manifest=None, force_rebuild=False, file_format="csv"):
+    check_file_format(file_format)
+    extension = FILE_EXTENSIONS[file_format]
+    report = []
+    # List the sheets of every workbook (only the workbook index and the sheet sizes are read, not the rows)
+    # and group them by the file they are written to
+    outputs = {}
+    workbook_hashes = {}
+    for workbook_number, path in enumerate(xlsx_paths):
+        try:
+            workbook_sheets = list_sheets(path)
+            if manifest is not None:
+                previous = None if force_rebuild else manifest_workbook(manifest, path)
+                workbook_hashes[path] = hash_workbook(path, previous)
+        except Exception as e:
+            report.append(sheet_report(path, None, "error", error=str(e)))
+            continue
+        for sheet_name, rows in workbook_sheets:
+            if sheet_names is not None and sheet_name not in sheet_names:
+                report.append(sheet_report(path, sheet_name, "skipped", rows))
+                continue
+            sheet_hash = workbook_hashes[path]["sheets"].get(sheet_name) if manifest is not None else None
+            outputs.setdefault(output_file(output_folder, sheet_name, file_format), []).append((workbook_number, path, sheet_name, rows, sheet_hash))
+
+    # Only the last workbook with a sheet of that name is written (the others are reported as "replaced").
+    # The file is kept only if none of the workbooks with that sheet has changed - otherwise an edit in a workbook
+    # that comes earlier would leave the file of the last one out of date (or keep its own rows).
+    tasks = []
+    for csv_file, sheets in outputs.items():
+        unchanged = manifest is not None and not force_rebuild and os.path.exists(csv_file) and \
+            all(sheet_is_current(manifest, path, sheet_name, sheet_hash, "converted" if number == len(sheets) else "replaced")
+                for number, (workbook_number, path, sheet_name, rows, sheet_hash) in enumerate(sheets, 1))
+        for workbook_number, path, sheet_name, rows, sheet_hash in sheets[:-1]:
+            report.append(sheet_report(path, sheet_name, "replaced", rows, content_hash=sheet_hash))
+        workbook_number, path, sheet_name, rows, sheet_hash = sheets[-1]
+        if unchanged:
+            report.append(sheet_report(path, sheet_name, "unchanged", rows, content_hash=sheet_hash))
+            continue
+        # Each task writes to its own temporary file, which is renamed once every task is finished
+        tmp_csv = os.path.join(output_folder, f"{sheet_name}{extension}.{workbook_number}.tmp")
+        tasks.append((path, sheet_name, tmp_csv))
+
+    # Convert the sheets
+    results = []
+    if workers == 1 or len(tasks) <= 1:
+        for path, sheet_name, tmp_csv in tasks:
+            try:
+                results.append(sheet_to_csv(path, sheet_name, tmp_csv, streaming, chunk_rows, file_format))
+            except Exception as e:
+                results.append(sheet_report(path, sheet_name, "error", error=str(e)))
+    else:
+        use_python_executable()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(sheet_to_csv, path, sheet_name, tmp_csv, streaming, chunk_rows, file_format) for path, sheet_name, tmp_csv in tasks]
+            for (path, sheet_name, tmp_csv), future in zip(tasks, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(sheet_report(path, sheet_name, "error", error=str(e)))
+
+    # Give the .csv files their final names
+    for (path, sheet_name, tmp_csv), result in zip(tasks, results):
+        if result["status"] == "converted":
+            os.replace(tmp_csv, output_file(output_folder, sheet_name, file_format))
+            if manifest is not None:
+                result["hash"] = workbook_hashes[path]["sheets"].get(sheet_name)
+        elif os.path.exists(tmp_csv):
+            os.remove(tmp_csv)
+        report.append(result)
+
+    # Remember the hashes of the workbooks and of the sheets that now have an up-to-date .csv file
+    if manifest is not None:
+        for path, hashes in workbook_hashes.items():
+            entries = [entry for entry in report if entry["workbook"] == os.path.basename(path)]
+            converted = {entry["sheet"]: entry["hash"] for entry in entries if entry["status"] in ("converted", "unchanged")}
+            replaced = {entry["sheet"]: entry["hash"] for entry in entries if entry["status"] == "replaced"}
+            record_workbook(manifest, path, hashes, converted, replaced)
+    return report
+
+
+# Convert one sheet of a workbook to a .csv file (this is the job that runs in the worker processes)
+def sheet_to_csv(path_to_excel_file, sheet_name, csv_file, streaming=False, chunk_rows=DEFAULT_CHUNK_ROWS, file_format="csv"):
+    start = time.perf_counter()
+    if streaming:
+        from openpyxl import load_workbook
+        wb = load_workbook(path_to_excel_file, read_only=True, data_only=True)
+        try:
+            rows = stream_sheet_to_csv(wb[sheet_name], csv_file, chunk_rows, file_format)
+        finally:
+            wb.close()
+    else:
+        df = pd.read_excel(path_to_excel_file, sheet_name=sheet_name, index_col=0)
+        # Remove spaces in field names
+        df.index.name = df.index.name.replace(" ", "")
+        write_sheet(df, csv_file, file_format)
+        rows = len(df)
+    return sheet_report(path_to_excel_file, sheet_name, "converted", rows, time.perf_counter() - start)
+
+
+# (name, number of data rows) of each sheet in a workbook, in workbook order
+def list_sheets(path_to_excel_file):
+    from openpyxl import load_workbook
+    wb = load_workbook(path_to_excel_file, read_only=True)
+    try:
+        return [(ws.title, sheet_row_count(ws)) for ws in wb.worksheets]
+    finally:
+        wb.close()
+
+
+# Inside ArcGIS Pro, sys.executable is ArcGISPro.exe - worker processes have to be started with python.exe instead
+def use_python_executable():
+    if sys.platform == "win32" and os.path.basename(sys.executable).lower() != "python.exe":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+
+
+#############################################
+#####        INCREMENTAL INGEST         #####
+#############################################
+
+# The manifest is a .json file stored next to the output files. It remembers:
+#   "workbooks" >> for each input workbook, the hash of the file and of each of its sheets,
+#                  and which sheets have an up-to-date .csv file
+#   "tables"    >> for each output table, the hash of the input data it was built from
+#   "services"  >> for each AGOL service, the hash of the layers and settings it was last staged ("staged")
+#                  and uploaded ("published") from
+# On the next run, anything whose hash has not changed can be skipped and the existing .csv file/table reused.
+# Delete the manifest (or use force_rebuild) to process everything again.
+
+# Read the manifest from 'manifest_path' (an empty manifest if the file does not exist yet)
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {"workbooks": {}, "tables": {}, "services": {}}
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest.setdefault("workbooks", {})
+    manifest.setdefault("tables", {})
+    manifest.setdefault("services", {})
+    return manifest
+
+
+# Write the manifest to 'manifest_path' (to a temporary file first, so a crash can't leave a half-written manifest)
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+# sha256 hash of a file, read 1 MB at a time
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# sha256 hash of the fields and rows of a geodatabase table or feature class (e.g. lyr.dataSource)
+# The object ids are left out, so a table that was rebuilt with the same rows has the same hash
+def hash_table(source):
+    import arcpy
+
+    fields = [field for field in arcpy.ListFields(source) if field.type not in ("OID", "Blob", "Raster")]
+    h = hashlib.sha256()
+    h.update(json.dumps([[field.name, field.type, field.length, field.domain] for field in fields]).encode("utf-8"))
+    cursor_fields = [field.name if field.type != "Geometry" else "SHAPE@WKB" for field in fields]
+    with arcpy.da.SearchCursor(source, cursor_fields) as cursor:
+        for row in cursor:
+            h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()
+
+
+# Hash of several hashes/settings together, e.g. combine_hashes(sheet_hash, StationList)
+# Use it to include the settings a table depends on, so the table is rebuilt when the settings change
+def combine_hashes(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+# Hash of the file and of each sheet of a .xlsx workbook: {"hash": ..., "sheets": {sheet name: hash}}
+#   If 'previous' (the manifest entry from the last run) has the same file hash, its sheet hashes are reused.
+#   A .xlsx file is a zip archive with one xml file per sheet. A sheet's hash covers that xml file plus the shared
+#   strings and styles of the workbook (text cells and date formats are stored there), so editing text in one sheet
+#   marks every sheet of that workbook as changed - it never misses a change.
+def hash_workbook(path, previous=None):
+    file_hash = hash_file(path)
+    if previous is not None and previous.get("hash") == file_hash:
+        return {"hash": file_hash, "sheets": dict(previous.get("sheets", {}))}
+
+    main_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    rel_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    sheet_hashes = {}
+    with zipfile.ZipFile(path) as z:
+        names = set(z.namelist())
+        # Parts shared by every sheet
+        shared = hashlib.sha256()
+        for part in ("xl/sharedStrings.xml", "xl/styles.xml"):
+            if part in names:
+                hash_zip_member(z, part, shared)
+        shared_digest = shared.digest()
+        # Find the xml file of each sheet
+        workbook = ET.fromstring(z.read("xl/workbook.xml"))
+        rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+        for sheet in workbook.iter(main_ns + "sheet"):
+            target = targets[sheet.get(rel_ns + "id")]
+            part = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            h = hashlib.sha256(shared_digest)
+            hash_zip_member(z, part, h)
+            sheet_hashes[sheet.get("name")] = h.hexdigest()
+    return {"hash": file_hash, "sheets": sheet_hashes}
+
+
+# Add the contents of one file in a zip archive to the hash 'h', 1 MB at a time
+def hash_zip_member(z, name, h):
+    with z.open(name) as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+
+
+# Manifest entry of a workbook from the last run (None if it is not in the manifest)
+def manifest_workbook(manifest, path):
+    return manifest["workbooks"].get(os.path.basename(path))
+
+
+# Store the hashes of a workbook, the sheets that have an up-to-date .csv file ('converted') and the sheets that were
+# not used because a later workbook has a sheet with the same name ('replaced'), in the manifest
+def record_workbook(manifest, path, hashes, converted, replaced=None):
+    manifest["workbooks"][os.path.basename(path)] = {"hash": hashes["hash"], "sheets": hashes["sheets"], "converted": converted, "replaced": replaced or {}}
+
+
+# True if the sheet's .csv file was made from data with the same hash
+# (status="replaced": True if the sheet had the same hash the last time it was replaced by a later workbook)
+def sheet_is_current(manifest, path, sheet_name, sheet_hash, status="converted"):
+    previous = manifest_workbook(manifest, path)
+    if previous is None or sheet_hash is None:
+        return False
+    return previous.get(status, {}).get(sheet_name) == sheet_hash
+
+
+# True if the table was built from input data with the same hash (the caller still has to check that the table exists)
+def table_is_current(manifest, table_name, source_hash):
+    return source_hash is not None and manifest["tables"].get(table_name) == source_hash
+
+
+# Store the hash of the input data a table was built from
+def record_table(manifest, table_name, source_hash):
+    manifest["tables"][table_name] = source_hash
+
+
+# True if the service was staged/published ('step' = "staged" or "published") from layers and settings with the same hash
+def service_is_current(manifest, service_name, step, service_hash):
+    return service_hash is not None and manifest["services"].get(service_name, {}).get(step) == service_hash
+
+
+# Store the hash of the layers and settings a service was staged/published from
+def record_service(manifest, service_name, step, service_hash):
+    manifest["services"].setdefault(service_name, {})[step] = service_hash
+
+
+#############################################
+#####        SHEET TIMING REPORT        #####
+#############################################
+
+# One entry of the report returned by xlsx_sheets_to_csv and convert_workbooks
+#   status is "converted", "unchanged", "replaced", "skipped" or "error"; rows is None when the size of a sheet is not known
+#   ("replaced" = a workbook that comes later has a sheet with the same name, so this sheet is not used)
+#   hash is the content hash of the sheet (only when convert_workbooks is given a manifest)
+def sheet_report(workbook, sheet_name, status, rows=None, seconds=0.0, error=None, content_hash=None):
+    return {"workbook": os.path.basename(workbook), "sheet": sheet_name, "status": status, "rows": rows, "seconds": seconds, "error": error, "hash": content_hash}
+
+
+# Number of data rows in a read-only worksheet, taken from the size stored in the file (the sheet is not parsed)
+def sheet_row_count(ws):
+    try:
+        # max_row includes the header row
+        return max(ws.max_row - 1, 0)
+    except Exception:
+        return None
+
+
+# Number of rows in a sheet of a pandas ExcelFile, without parsing it (only works with the openpyxl engine)
+def book_row_count(xl, sheet_name):
+    try:
+        return sheet_row_count(xl.book[sheet_name])
+    except Exception:
+        return None
+
+
+# Print how long each converted sheet took, how many rows were not parsed because their sheet was skipped,
+# and the error message of any workbook or sheet that could not be converted
+def print_sheet_report(report):
+    converted = [entry for entry in report if entry["status"] == "converted"]
+    skipped = [entry for entry in report if entry["status"] == "skipped"]
+    unchanged = [entry for entry in report if entry["status"] == "unchanged"]
+    errors = [entry for entry in report if entry["status"] == "error"]
+    for entry in report:
+        rows = "?" if entry["rows"] is None else entry["rows"]
+        if entry["status"] == "converted":
+            print("       {}: {} - converted {} rows in {:.2f} s".format(entry["workbook"], entry["sheet"], rows, entry["seconds"]))
+        elif entry["status"] == "skipped":
+            print("       {}: {} - skipped ({} rows not parsed)".format(entry["workbook"], entry["sheet"], rows))
+        elif entry["status"] == "unchanged":
+            print("       {}: {} - unchanged since the last run, reusing the .csv file".format(entry["workbook"], entry["sheet"]))
+        elif entry["status"] == "replaced":
+            print("       {}: {} - not used, a later workbook has a sheet with the same name".format(entry["workbook"], entry["sheet"]))
+        else:
+            print("       ERROR {}: {} - {}".format(entry["workbook"], entry["sheet"] or "(whole workbook)", entry["error"]))
+    total_seconds = sum(entry["seconds"] for entry in converted)
+    skipped_rows = sum(entry["rows"] for entry in skipped if entry["rows"] is not None)
+    print("       Converted {} of {} sheets in {:.2f} s, skipped {} sheets ({} rows)".format(len(converted), len(report), total_seconds, len(skipped), skipped_rows))
+    if unchanged:
+        print("       {} sheets have not changed since the last run".format(len(unchanged)))
+    if errors:
+        print("       {} workbook(s)/sheet(s) could not be converted - see the errors above".format(len(errors)))
+
+
+#############################################
+#####        SHEET TO DATAFRAME         #####
+#############################################
+
+# Read one sheet into a DataFrame, 'chunk_rows' rows at a time, keeping only the rows that pass 'row_filter'
+#   sheet_name=None reads the first sheet (like pd.read_excel and ExcelToTable)
+#   row_filter >> function that takes a chunk (DataFrame) and returns the rows to keep, e.g.
+#                 lambda df: df[df["TEST_CODE"].isin(["PPUT", "DO"])]
+#   columns    >> the columns to keep: a list of names, or a function that takes a name and returns True to keep it
+#                 (None = every column). The other columns are never put into a DataFrame, typed or written.
+# The rows that are filtered out are never held in memory all at once, so the memory use and
+# everything done with the DataFrame afterwards scale with the rows that are kept
+# Returns the DataFrame and the number of rows that were read (before filtering)
+def read_sheet(path_to_excel_file, sheet_name=None, row_filter=None, columns=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    kept = []
+    rows_read = 0
+    for chunk in read_sheet_chunks(path_to_excel_file, sheet_name, columns, chunk_rows):
+        rows_read += len(chunk)
+        kept.append(chunk if row_filter is None else row_filter(chunk))
+    if not kept:
+        return pd.DataFrame(), 0
+    # Chunks with different types in a column (e.g. numbers, then "<0.5") are combined into one column of the wider type
+    return pd.concat(kept, ignore_index=True), rows_read
+
+
+# Yield the rows of one sheet as DataFrames of up to 'chunk_rows' rows (the first non-empty row holds the field names)
+#   columns >> see read_sheet
+def read_sheet_chunks(path_to_excel_file, sheet_name=None, columns=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    from openpyxl import load_workbook
+
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be at least 1")
+    wb = load_workbook(path_to_excel_file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0] if sheet_name is None else wb[sheet_name]
+        rows = ws.iter_rows(values_only=True)
+        header = None
+        for row in rows:
+            if not is_blank_row(row):
+                header = row
+                break
+        if header is None:
+            return
+        names = clean_column_names(header)
+        positions = projected_positions(names, columns)
+        kept_names = [names[position] for position in positions]
+        chunk = []
+        first_chunk = True
+        for row in rows:
+            if is_blank_row(row):
+                continue
+            row = fit_row(row, len(names))
+            chunk.append([row[position] for position in positions])
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=kept_names)
+                chunk = []
+                first_chunk = False
+        # Whatever is left over (or no rows at all, so the field names are still returned)
+        if chunk or first_chunk:
+            yield pd.DataFrame(chunk, columns=kept_names)
+    finally:
+        wb.close()
+
+
+# Positions of the columns to keep (see 'columns' in read_sheet)
+def projected_positions(names, columns=None):
+    if columns is None:
+        return list(range(len(names)))
+    if callable(columns):
+        return [position for position, name in enumerate(names) if columns(name)]
+    missing = [column for column in columns if column not in names]
+    if missing:
+        raise ValueError("Columns not found in the sheet: " + ", ".join(missing))
+    return [names.index(column) for column in columns]
+
+
+#############################################
+#####      DATAFRAME TO GDB TABLE       #####
+#############################################
+
+# Rename the columns of a DataFrame in place so they can be used as field names:
+# spaces become underscores and any other non-word character is deleted, e.g. "Site Code" >> "Site_Code"
+def clean_field_names(df):
+    df.columns = df.columns.str.replace(' ', '_')                # replace space with underscore
+    df.columns = df.columns.str.replace(r'\W+', '', regex=True)  # delete non-word character
+    return df
+
+
+# Field name for a column without arcpy, for the outputs that are not written to a geodatabase (e.g. a GeoPackage)
+# Same rules as arcpy.ValidateFieldName in a file geodatabase for the usual names: every character that is not a
+# letter, a digit or an underscore becomes an underscore, e.g. "Station #" >> "Station__", a name that does not start
+# with a letter gets an underscore in front, and the name is cut to 64 characters
+def validate_field_name(name):
+    name = re.sub(r"[^A-Za-z0-9_]", "_", str(name))
+    if not name[:1].isalpha():
+        name = "_" + name
+    return name[:64]
+
+
+# Field type to use in the geodatabase for a pandas column
+def field_type_for_column(column):
+    if pd.api.types.is_bool_dtype(column):
+        return "SHORT"
+    if pd.api.types.is_integer_dtype(column):
+        # LONG is a 32-bit integer - anything bigger is stored as a DOUBLE
+        if column.empty or (column.min() >= -2**31 and column.max() < 2**31):
+            return "LONG"
+        return "DOUBLE"
+    if pd.api.types.is_float_dtype(column):
+        return "DOUBLE"
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return "DATE"
+    return "TEXT"
+
+
+# Write a DataFrame straight to a geodatabase table (replaces writing a .csv file and running ExportTable on it)
+#   out_table can be a table name in the current workspace or a full path, e.g. "memory/Biomonitoring"
+#   Empty cells (NaN/NaT/None) are stored as null, like ExportTable does for empty .csv cells
+#   field_types can override the field type picked for a column, e.g. {"Year": "SHORT"}
+# Documentation:
+# https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/insertcursor-class.htm
+def dataframe_to_table(df, out_table, field_types=None):
+    import arcpy
+
+    out_path = os.path.dirname(out_table) or arcpy.env.workspace
+    out_name = os.path.basename(out_table)
+    if arcpy.Exists(os.path.join(out_path, out_name)):
+        arcpy.management.Delete(os.path.join(out_path, out_name))
+    arcpy.management.CreateTable(out_path, out_name)
+    out_table = os.path.join(out_path, out_name)
+
+    # Add the fields
+    field_names = []
+    values = pd.DataFrame(index=df.index)
+    for position, column_name in enumerate(df.columns):
+        column = df.iloc[:, position]
+        field_name = arcpy.ValidateFieldName(str(column_name), out_path)
+        field_type = (field_types or {}).get(field_name) or field_type_for_column(column)
+        if field_type == "TEXT":
+            # Mixed columns (e.g. numbers and "N/A") are stored as text
+            column = column.where(column.isna(), column.astype(str))
+            longest = column.dropna().str.len().max()
+            field_length = max(255, 0 if pd.isna(longest) else int(longest))
+            arcpy.management.AddField(out_table, field_name, field_type, field_length=field_length)
+        else:
+            if pd.api.types.is_bool_dtype(column):
+                column = column.astype(int)
+            arcpy.management.AddField(out_table, field_name, field_type)
+        field_names.append(field_name)
+        # Convert to Python objects and replace NaN/NaT with None so they become nulls
+        values[position] = column.astype(object).where(column.notna(), None)
+
+    # Insert the rows
+    with arcpy.da.InsertCursor(out_table, field_names) as cursor:
+        for row in values.itertuples(index=False, name=None):
+            cursor.insertRow(row)
+    return out_table
+
+
+# Load a .csv or .parquet file made by convert_workbooks into a geodatabase table
+#   .csv     >> ExportTable parses the text file
+#   .parquet >> the typed columns are read directly and written with dataframe_to_table (no text parsing)
+def intermediate_to_table(path, out_table):
+    import arcpy
+
+    if path.endswith(FILE_EXTENSIONS["parquet"]):
+        import_pyarrow()
+        return dataframe_to_table(pd.read_parquet(path), out_table)
+    arcpy.conversion.ExportTable(path, out_table)
+    return out_table
+
+
+# Read a .csv or .parquet file made by convert_workbooks into a DataFrame (e.g. to process it before it is written
+# with dataframe_to_table). The first column (the sheet's index column) is read as a normal column, like ExportTable does.
+def read_intermediate(path):
+    if path.endswith(FILE_EXTENSIONS["parquet"]):
+        import_pyarrow()
+        return pd.read_parquet(path)
+    return pd.read_csv(path, encoding="utf-8")
+
+
+# True if 'filename' is a file made by convert_workbooks in the given format
+def is_intermediate_file(filename, file_format="csv"):
+    return filename.endswith(FILE_EXTENSIONS[file_format])
+
+
+#############################################
+#####          STATION POINTS           #####
+#############################################
+
+# One row per station: the first row of each station key, with only the station fields
+# (drop_duplicates hashes the keys, so the whole table is only read once)
+def unique_stations(df, key_field, station_fields):
+    fields = [key_field] + [field for field in station_fields if field != key_field]
+    return df.drop_duplicates(subset=key_field, keep="first")[fields].reset_index(drop=True)
+
+
+# Create a station point feature class from a DataFrame of measurements
+# The table is reduced to its unique stations first, so only one point is built per station
+# (instead of one point per measurement followed by DeleteIdentical)
+#   station_fields >> the fields to keep on the points, e.g. ["Site_Code", "Watercourse"]
+def stations_to_points(df, out_fc, key_field, station_fields, x_field, y_field, coordsys):
+    import arcpy
+
+    stations = unique_stations(df, key_field, station_fields + [x_field, y_field])
+    station_table = dataframe_to_table(stations, "memory/" + os.path.basename(out_fc) + "_XY")
+    # Convert the table to a point feature class
+    arcpy.management.XYTableToPoint(station_table, out_fc, x_field, y_field, "", coordsys)
+    arcpy.management.DeleteField(out_fc, drop_field=[x_field, y_field])
+    arcpy.management.Delete(station_table)
+    return len(stations)
+
+
+# Fill the photo field of every station in one pass, by looking up each station's key in a {key: photo URL} dictionary
+# (replaces selecting and calculating each station one at a time)
+#   key_field >> the field that holds the keys of 'photos', e.g. "Site_Code"
+# Returns the keys that could not be matched:
+#   "no_station" >> keys in 'photos' that are not in the station layer (e.g. a misspelled station name)
+#   "no_photo"   >> stations that have no photo
+# Documentation:
+# https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/updatecursor-class.htm
+def add_photos(stations, key_field, photos, photo_field="Photo"):
+    import arcpy
+
+    # Create a new text field
+    if photo_field not in [field.name for field in arcpy.ListFields(stations)]:
+        longest = max([len(url) for url in photos.values()], default=0)
+        arcpy.management.AddField(stations, photo_field, "TEXT", field_length=max(255, longest))
+
+    matched = set()
+    no_photo = []
+    with arcpy.da.UpdateCursor(stations, [key_field, photo_field]) as cursor:
+        for row in cursor:
+            photo = photos.get(row[0])
+            if photo is None:
+                if row[0] not in no_photo:
+                    no_photo.append(row[0])
+            else:
+                matched.add(row[0])
+            row[1] = photo
+            cursor.updateRow(row)
+    return {"no_station": [key for key in photos if key not in matched], "no_photo": no_photo}
+
+
+# Same as add_photos for a DataFrame of stations (e.g. from unique_stations), without arcpy:
+# the photo column is filled in place by mapping each station's key in one pass
+# Returns the keys that could not be matched, like add_photos
+def station_photos(stations, key_field, photos, photo_field="Photo"):
+    stations[photo_field] = stations[key_field].map(photos)
+    keys = set(stations[key_field])
+    no_photo = stations.loc[stations[photo_field].isna(), key_field].drop_duplicates().tolist()
+    return {"no_station": [key for key in photos if key not in keys], "no_photo": no_photo}
+
+
+# Print the stations that add_photos could not match
+def print_photo_report(unmatched):
+    if unmatched["no_station"]:
+        print("\t\tPhotos with no matching station: " + ", ".join(str(key) for key in unmatched["no_station"]))
+    if unmatched["no_photo"]:
+        print("\t\tStations with no photo: " + ", ".join(str(key) for key in unmatched["no_photo"]))
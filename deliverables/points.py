@@ -0,0 +1,239 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Builds point features from the coordinate columns of a table (e.g. Easting/Northing) without ArcGIS Pro,
+# and writes them to a GeoPackage (.gpkg) or GeoJSON (.geojson) file in the same spatial reference as the gdb layers.
+# The geometries of all the rows are built at once with numpy arrays and inserted in one batch,
+# so this can run on computers without an ArcGIS Pro license (e.g. Linux batch jobs).
+# The data tables can be written to the same GeoPackage (see write_gpkg_table), so a whole deliverable can be
+# processed without arcpy (output_format = "gpkg" in the scripts).
+#   from points import xy_to_points_file
+#   xy_to_points_file(df, r"C:\Output\PWQMN_Stations.gpkg", "East", "North", coordsys)
+# Only the Python standard library, numpy and pandas are used.
+
+import json, os, sqlite3
+import numpy as np
+import pandas as pd
+
+# Spatial references used by the scripts, looked up by the name in the WKT string or by the name given to arcpy
+#   srs_id/organization_coordsys_id >> EPSG code
+SPATIAL_REFERENCES = {
+    "NAD_1983_CSRS_UTM_Zone_17N": {
+        "srs_name": "NAD83(CSRS) / UTM zone 17N",
+        "srs_id": 2958,
+        "organization": "EPSG",
+        "organization_coordsys_id": 2958,
+        "definition": "PROJCS[\"NAD_1983_CSRS_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_1983_CSRS\",DATUM[\"D_North_American_1983_CSRS\",SPHEROID[\"GRS_1980\",6378137.0,298.257222101]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",-81.0],PARAMETER[\"Scale_Factor\",0.9996],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]",
+    },
+    "NAD_1983_UTM_Zone_17N": {
+        "srs_name": "NAD83 / UTM zone 17N",
+        "srs_id": 26917,
+        "organization": "EPSG",
+        "organization_coordsys_id": 26917,
+        "definition": "PROJCS[\"NAD_1983_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_1983\",DATUM[\"D_North_American_1983\",SPHEROID[\"GRS_1980\",6378137.0,298.257222101]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",-81.0],PARAMETER[\"Scale_Factor\",0.9996],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]",
+    },
+}
+
+# File extensions of the output formats
+POINT_FILE_EXTENSIONS = (".gpkg", ".geojson")
+
+# Layout of a GeoPackage point geometry: GeoPackage header (magic "GP", version, flags, srs_id) + little-endian WKB point
+GPKG_POINT_DTYPE = np.dtype([("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srs_id", "<i4"),
+                             ("byte_order", "u1"), ("wkb_type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+#############################################
+#####        SPATIAL REFERENCES         #####
+#############################################
+
+# Spatial reference for a WKT string (e.g. coordsys in the scripts) or a name (e.g. "NAD 1983 UTM Zone 17N")
+# Unknown WKT strings are kept as they are, with srs_id 100000 (a user-defined code in the GeoPackage)
+def spatial_reference(coordsys):
+    for name, reference in SPATIAL_REFERENCES.items():
+        if name in coordsys or name == coordsys.replace(" ", "_"):
+            return reference
+    if not coordsys.startswith(("PROJCS", "GEOGCS")):
+        raise ValueError("Unknown spatial reference '" + coordsys + "' - use a WKT string or one of " + str(list(SPATIAL_REFERENCES)))
+    return {"srs_name": coordsys.split('"')[1], "srs_id": 100000, "organization": "NONE",
+            "organization_coordsys_id": 100000, "definition": coordsys}
+
+
+#############################################
+#####           POINT BUILDER           #####
+#############################################
+
+# Write the rows of a DataFrame as points to a .gpkg or .geojson file
+#   x_field, y_field >> coordinate columns (in the units of coordsys, e.g. metres for UTM)
+#   coordsys >> WKT string or name of the spatial reference (see spatial_reference)
+#   layer >> name of the layer in a GeoPackage (default: the file name) - other layers in the file are kept
+#   drop_xy=True >> the coordinate columns are not written as fields (like DeleteField after XYTableToPoint)
+# Rows with an empty or non-numeric coordinate get an empty (null) geometry, like XYTableToPoint
+# Returns the path of the file
+def xy_to_points_file(df, out_path, x_field, y_field, coordsys, layer=None, drop_xy=False):
+    extension = os.path.splitext(out_path)[1].lower()
+    if extension not in POINT_FILE_EXTENSIONS:
+        raise ValueError("Unknown point file format '" + extension + "' - use one of " + str(list(POINT_FILE_EXTENSIONS)))
+    reference = spatial_reference(coordsys)
+    x = pd.to_numeric(df[x_field], errors="coerce").to_numpy(dtype=float)
+    y = pd.to_numeric(df[y_field], errors="coerce").to_numpy(dtype=float)
+    if drop_xy:
+        df = df.drop(columns=[x_field, y_field])
+    if extension == ".gpkg":
+        write_geopackage(df, out_path, layer or os.path.splitext(os.path.basename(out_path))[0], x, y, reference)
+    else:
+        write_geojson(df, out_path, x, y, reference)
+    return out_path
+
+
+# GeoPackage geometry blobs of all the points, built at once in one numpy array (None where a coordinate is missing)
+def gpkg_point_blobs(x, y, srs_id):
+    points = np.zeros(len(x), dtype=GPKG_POINT_DTYPE)
+    points["magic"] = b"GP"
+    # flags: no envelope, little-endian
+    points["flags"] = 0b00000001
+    points["srs_id"] = srs_id
+    points["byte_order"] = 1
+    points["wkb_type"] = 1
+    points["x"] = x
+    points["y"] = y
+    data = points.tobytes()
+    size = GPKG_POINT_DTYPE.itemsize
+    valid = ~(np.isnan(x) | np.isnan(y))
+    return [data[i * size:(i + 1) * size] if valid[i] else None for i in range(len(x))]
+
+
+# SQLite column type of a pandas column
+def gpkg_column_type(column):
+    if pd.api.types.is_bool_dtype(column):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(column):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(column):
+        return "DOUBLE"
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return "DATETIME"
+    return "TEXT"
+
+
+# Python values of a column that can be stored in a GeoPackage or GeoJSON file (NaN/NaT/pd.NA >> None, dates >> ISO 8601 text)
+# Dates without a time zone (the local dates of the Excel files) are written as they are, without a "Z" (UTC) suffix;
+# dates with a time zone are converted to UTC and written with the "Z"
+def python_values(column):
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        column = column.dt.tz_convert("UTC").dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        column = column.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    values = column.astype(object).where(column.notna(), None)
+    return [value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+# Same as python_values, with True/False stored as 1/0 (SQLite has no boolean type)
+def sqlite_values(column):
+    return [int(value) if isinstance(value, bool) else value for value in python_values(column)]
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# Write the points to a layer of a GeoPackage (OGC GeoPackage 1.3)
+# Documentation: https://www.geopackage.org/spec130/
+def write_geopackage(df, out_path, layer, x, y, reference):
+    blobs = gpkg_point_blobs(x, y, reference["srs_id"])
+    valid = ~(np.isnan(x) | np.isnan(y))
+    bounds = [float(x[valid].min()), float(y[valid].min()), float(x[valid].max()), float(y[valid].max())] if valid.any() else [None] * 4
+    with sqlite3.connect(out_path) as db:
+        create_gpkg_tables(db, reference)
+        replace_gpkg_table(db, df, layer, "features", bounds + [reference["srs_id"]], geometry=blobs)
+        db.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'POINT', ?, 0, 0)", (layer, reference["srs_id"]))
+
+
+# Write a DataFrame to a table without geometry (an "attributes" table) of a GeoPackage, e.g. the data table of a deliverable
+# The table is replaced if it is already in the file - other layers and tables are kept
+# Returns the name of the table
+def write_gpkg_table(df, out_path, table):
+    with sqlite3.connect(out_path) as db:
+        create_gpkg_tables(db)
+        replace_gpkg_table(db, df, table, "attributes", [None] * 5)
+    return table
+
+
+# Names of the layers and tables in a GeoPackage (an empty list if the file does not exist yet)
+def gpkg_layers(path):
+    if not os.path.exists(path):
+        return []
+    with sqlite3.connect(path) as db:
+        try:
+            return [row[0] for row in db.execute("SELECT table_name FROM gpkg_contents")]
+        except sqlite3.OperationalError:
+            return []
+
+
+# Read a table or layer of a GeoPackage into a DataFrame (without the fid and geometry columns)
+# The DATETIME fields are read back as dates
+def read_gpkg_table(path, table):
+    with sqlite3.connect(path) as db:
+        types = {row[1]: row[2] for row in db.execute("PRAGMA table_info(" + quote(table) + ")")}
+        df = pd.read_sql_query("SELECT * FROM " + quote(table), db)
+    df = df.drop(columns=[column for column in ("fid", "geom") if column in df.columns])
+    for column, column_type in types.items():
+        if column_type == "DATETIME" and column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    return df
+
+
+# Create the metadata tables of a GeoPackage if they are not in the file yet
+#   reference >> spatial reference of the points to add (see spatial_reference)
+def create_gpkg_tables(db, reference=None):
+    db.execute("PRAGMA application_id = 1196444487")  # "GPKG"
+    db.execute("PRAGMA user_version = 10300")
+    db.execute("CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+    db.execute("CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))")
+    # The three spatial references every GeoPackage must have, plus the one of the points
+    spatial_refs = [("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+                    ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+                    ("WGS 84 geodetic", 4326, "EPSG", 4326, "GEOGCS[\"WGS 84\",DATUM[\"WGS_1984\",SPHEROID[\"WGS 84\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"degree\",0.0174532925199433]]", None)]
+    if reference:
+        spatial_refs.append((reference["srs_name"], reference["srs_id"], reference["organization"], reference["organization_coordsys_id"], reference["definition"], None))
+    db.executemany("INSERT OR REPLACE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", spatial_refs)
+
+
+# Replace a table of a GeoPackage with the rows of a DataFrame, inserted in one batch
+#   data_type >> "features" (with a POINT geometry column, 'geometry' holds the blobs) or "attributes"
+#   extent >> [min_x, min_y, max_x, max_y, srs_id] stored in gpkg_contents
+def replace_gpkg_table(db, df, table, data_type, extent, geometry=None):
+    db.execute("DROP TABLE IF EXISTS " + quote(table))
+    db.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (table,))
+    db.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (table,))
+
+    columns = [column for column in df.columns]
+    names = (["geom"] if geometry is not None else []) + columns
+    definitions = (["geom POINT"] if geometry is not None else []) + [quote(column) + " " + gpkg_column_type(df[column]) for column in columns]
+    db.execute("CREATE TABLE " + quote(table) + " (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL" + "".join(", " + definition for definition in definitions) + ")")
+    db.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [table, data_type, table] + extent)
+
+    # Insert all the rows in one batch
+    values = ([geometry] if geometry is not None else []) + [sqlite_values(df[column]) for column in columns]
+    if not names:
+        db.executemany("INSERT INTO " + quote(table) + " DEFAULT VALUES", [()] * len(df))
+        return
+    placeholders = ", ".join(["?"] * len(names))
+    db.executemany("INSERT INTO " + quote(table) + " (" + ", ".join(quote(name) for name in names) + ") VALUES (" + placeholders + ")", zip(*values))
+
+
+# Write the points to a GeoJSON FeatureCollection
+# The coordinates stay in the spatial reference of the data (e.g. UTM metres); it is named in the "crs" member
+# (GeoJSON readers that only accept WGS 84 longitude/latitude need the file to be projected first)
+def write_geojson(df, out_path, x, y, reference):
+    valid = ~(np.isnan(x) | np.isnan(y))
+    names = [str(column) for column in df.columns]
+    properties = zip(*[python_values(df[column]) for column in df.columns]) if names else [()] * len(df)
+    features = []
+    for position, row in enumerate(properties):
+        geometry = {"type": "Point", "coordinates": [float(x[position]), float(y[position])]} if valid[position] else None
+        features.append({"type": "Feature", "geometry": geometry, "properties": dict(zip(names, row))})
+    crs_name = "urn:ogc:def:crs:EPSG::" + str(reference["organization_coordsys_id"]) if reference["organization"] == "EPSG" else reference["srs_name"]
+    collection = {"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": crs_name}}, "features": features}
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(collection, f)
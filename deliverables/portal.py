@@ -0,0 +1,217 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# One shared connection to ArcGIS Online for all the publishing requests (uploads.py, delta.py):
+#   - the connections are kept open and reused (keep-alive), so each request does not open a new
+#     connection and redo the TLS handshake
+#   - the sign-in token is asked for once, kept, and renewed a few minutes before it expires
+#     (or when the portal answers that it is invalid)
+#   - at most 'max_in_flight' requests are sent at the same time, e.g. when photos are uploaded by several threads
+#     (uploads.add_attachments) - the other threads wait for their turn
+#   from portal import arcpy_token, configure_session
+#   configure_session(arcpy_token, max_in_flight=4)      # once, before the uploads
+# The requests of uploads.py and delta.py then use this session, with the token of ArcGIS Pro's signed-in user.
+# Only the Python standard library is used, so the session can also be used with a local test server.
+
+import http.client, json, threading, time, urllib.parse, uuid
+
+# Seconds to wait for an answer from the portal
+DEFAULT_TIMEOUT = 300
+# Maximum number of requests sent at the same time
+DEFAULT_MAX_IN_FLIGHT = 4
+# A token is renewed when it expires in less than this many seconds
+TOKEN_REFRESH_MARGIN = 300
+# HTTP status codes (and ArcGIS error codes) that mean "try again later"
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+# The ones that mean the request was refused without being run (the only ones for requests that must not run twice)
+REFUSED_STATUS = (429, 503)
+# ArcGIS error codes for an invalid or expired token
+TOKEN_ERRORS = (498, 499)
+
+
+# A request that failed for a reason that may go away (connection lost, server busy) - it can be sent again
+class TransientError(RuntimeError):
+    pass
+
+
+#############################################
+#####          PORTAL SESSION           #####
+#############################################
+
+# Connections, token and request limit shared by every request to the portal
+#   token_provider >> function that returns a new token: {"token": ..., "expires": seconds since 1970, "referer": ...}
+#                     (e.g. arcpy_token), or None to send the requests without a token
+#   max_in_flight  >> maximum number of requests sent at the same time (the other threads wait for their turn)
+class PortalSession:
+    def __init__(self, token_provider=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, timeout=DEFAULT_TIMEOUT, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.token_provider = token_provider
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.idle_connections = {}      # (scheme, host, port) >> open connections that are not in use
+        self.signin = None              # the cached token
+
+    # The cached token, renewed if it expires soon (None if there is no token_provider)
+    def token(self, renew=False):
+        if self.token_provider is None:
+            return None
+        with self.lock:
+            if renew or self.signin is None or time.time() > self.signin.get("expires", 0) - self.refresh_margin:
+                self.signin = self.token_provider()
+            return self.signin
+
+    # Send a request to the ArcGIS REST API and return the JSON answer
+    #   token >> a token to use instead of the session's token
+    #   files >> {field: (file name, bytes)} to send the request as multipart/form-data
+    #   idempotent=False >> for requests that must not run twice (e.g. addItem, publish, applyEdits adds):
+    #                       a TransientError is only raised when the portal can't have run the request
+    # An {"error": ...} answer raises a RuntimeError (a TransientError if it can be sent again)
+    def request_json(self, url, params, token=None, timeout=None, files=None, idempotent=True):
+        retry_status = RETRY_STATUS if idempotent else REFUSED_STATUS
+        signin = {"token": token} if token else self.token()
+        for attempt in (1, 2):
+            fields = dict(params, f="json")
+            headers = {}
+            if signin:
+                fields["token"] = signin["token"]
+                if signin.get("referer"):
+                    headers["Referer"] = signin["referer"]
+            if files:
+                body, headers["Content-Type"] = multipart_body(fields, files)
+            else:
+                body, headers["Content-Type"] = urllib.parse.urlencode(fields).encode("utf-8"), "application/x-www-form-urlencoded"
+            status, reason, data = self.send(url, body, headers, timeout or self.timeout, idempotent)
+            if status >= 400:
+                error = TransientError if status in retry_status else RuntimeError
+                raise error(url + ": HTTP " + str(status) + " " + reason)
+            try:
+                result = json.loads(data.decode("utf-8"))
+            except ValueError as e:
+                # The answer was cut off
+                raise (TransientError if idempotent else RuntimeError)(url + ": " + str(e))
+            error = result.get("error") if isinstance(result, dict) else None
+            if error and error.get("code") in TOKEN_ERRORS and attempt == 1 and not token and self.token_provider is not None:
+                signin = self.token(renew=True)
+                continue
+            if error:
+                message = url + ": " + str(error.get("message")) + " " + str(error.get("details") or "")
+                raise TransientError(message) if error.get("code") in retry_status else RuntimeError(message)
+            return result
+
+    # POST a body on a kept-alive connection, waiting for a free slot if max_in_flight requests are already being sent
+    # A kept-alive connection that the server has closed in the meantime is replaced by a new one:
+    #   - if the request could not be sent completely, the server can't have run it, so it is sent again
+    #   - if the connection is lost while waiting for the answer, the server may already have run the request, so it is
+    #     only sent again if it is idempotent. Requests that are not idempotent always get a new connection (a kept-alive
+    #     connection is the usual reason for a lost connection) and a lost connection raises a RuntimeError.
+    # Returns (status, reason, body of the answer)
+    def send(self, url, body, headers, timeout, idempotent=True):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        with self.in_flight:
+            for attempt in (1, 2):
+                connection, reused = self.take_connection(key, timeout, reuse=idempotent)
+                try:
+                    connection.request("POST", path, body=body, headers=headers)
+                except (http.client.HTTPException, OSError) as e:
+                    connection.close()
+                    if reused and attempt == 1:
+                        continue
+                    raise TransientError(url + ": " + str(e))
+                try:
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError) as e:
+                    connection.close()
+                    if not idempotent:
+                        raise RuntimeError(url + ": " + str(e) + " - the request may have been run, so it is not sent again")
+                    if reused and attempt == 1:
+                        continue
+                    raise TransientError(url + ": " + str(e))
+                except (http.client.HTTPException, OSError) as e:
+                    connection.close()
+                    if not idempotent:
+                        raise RuntimeError(url + ": " + str(e) + " - the request may have been run, so it is not sent again")
+                    raise TransientError(url + ": " + str(e))
+                if response.will_close:
+                    connection.close()
+                else:
+                    self.give_back_connection(key, connection)
+                return response.status, response.reason, data
+
+    # An idle connection to the host (if reuse=True), or a new one - returns (connection, True if it was used before)
+    def take_connection(self, key, timeout, reuse=True):
+        with self.lock:
+            idle = self.idle_connections.get(key, [])
+            if idle and reuse:
+                connection = idle.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, port, timeout=timeout), False
+
+    def give_back_connection(self, key, connection):
+        with self.lock:
+            idle = self.idle_connections.setdefault(key, [])
+            if len(idle) < self.max_in_flight:
+                idle.append(connection)
+                return
+        connection.close()
+
+    # Close every idle connection
+    def close(self):
+        with self.lock:
+            connections = [connection for idle in self.idle_connections.values() for connection in idle]
+            self.idle_connections = {}
+        for connection in connections:
+            connection.close()
+
+
+# Body and Content-Type of a multipart/form-data request
+def multipart_body(params, files):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in params.items():
+        lines.append(("--" + boundary + "\r\nContent-Disposition: form-data; name=\"" + name + "\"\r\n\r\n" + str(value) + "\r\n").encode("utf-8"))
+    for name, (filename, data) in files.items():
+        lines.append(("--" + boundary + "\r\nContent-Disposition: form-data; name=\"" + name + "\"; filename=\"" + filename + "\"\r\n"
+                      "Content-Type: application/octet-stream\r\n\r\n").encode("utf-8") + data + b"\r\n")
+    lines.append(("--" + boundary + "--\r\n").encode("utf-8"))
+    return b"".join(lines), "multipart/form-data; boundary=" + boundary
+
+
+#############################################
+#####          SHARED SESSION           #####
+#############################################
+
+# The session used by uploads.py and delta.py (one per process)
+session = PortalSession()
+
+
+# Replace the shared session, e.g. configure_session(arcpy_token, max_in_flight=4)
+def configure_session(token_provider=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, timeout=DEFAULT_TIMEOUT):
+    global session
+    session.close()
+    session = PortalSession(token_provider, max_in_flight, timeout)
+    return session
+
+
+def get_session():
+    return session
+
+
+# Token of the user signed in to ArcGIS Pro (the same account the arcpy sharing tools use)
+# Documentation: https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/getsignintoken.htm
+def arcpy_token():
+    import arcpy
+
+    signin = arcpy.GetSigninToken()
+    if signin is None:
+        raise RuntimeError("No token - sign in to ArcGIS Online in ArcGIS Pro first")
+    return {"token": signin["token"], "expires": signin.get("expires", time.time() + 3600), "referer": signin.get("referer")}
@@ -0,0 +1,148 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Runs the PWQMN, Biomonitoring and Temperature deliverables together: each data set is processed and added to
+# its map, then the three services are staged and uploaded to ArcGIS Online (AGOL) at the same time.
+# Uploading is mostly waiting for the network, so the whole run takes about as long as the slowest service
+# instead of the sum of the three.
+#   PublishAll() >> Process the data sets and upload the services, then print the status of every service
+# The processing steps (geoprocessing in the geodatabases) still run one at a time.
+# Deliverables that use the same .aprx file or output folder are run one after another, in the same worker.
+
+# Instructions:
+#   Set the inputs of each deliverable in its own script (pwqmn.py, biomonitoring.py, temperature.py).
+#   Under "Inputs", choose the deliverables to run and how many services can be uploaded at the same time.
+#   Run this script from the same folder as the deliverable scripts.
+
+#############################################
+#####               INPUTS              #####
+#############################################
+
+# >>> Deliverables to run (the names of the scripts, without .py)
+deliverables = ["pwqmn", "biomonitoring", "temperature"]
+
+# >>> Maximum number of services processed/uploaded at the same time (1 = one after another)
+max_concurrent_uploads = 3
+
+########################################################################################
+
+
+import ast, importlib, os, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+from ingest import use_python_executable
+
+
+#############################################
+#####          HELPER FUNCTIONS         #####
+#############################################
+
+# Value of a setting (e.g. aprx_path) in a deliverable script, read without running the script
+# Returns None if the setting is not a plain value
+def readSetting(deliverable, name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), deliverable + ".py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name for target in node.targets):
+            try:
+                return ast.literal_eval(node.value)
+            except ValueError:
+                return None
+    return None
+
+# Put the deliverables that share an .aprx file or an output folder in the same group, so they never run at the same time
+# (they would overwrite each other's map, .sd files and manifest)
+def groupDeliverables(deliverables):
+    groups = []
+    for deliverable in deliverables:
+        paths = {os.path.normcase(str(readSetting(deliverable, name))) for name in ("aprx_path", "outdir")}
+        overlapping = [group for group in groups if group["paths"] & paths]
+        merged = {"deliverables": [], "paths": paths}
+        for group in overlapping:
+            merged["deliverables"] += group["deliverables"]
+            merged["paths"] |= group["paths"]
+            groups.remove(group)
+        merged["deliverables"].append(deliverable)
+        groups.append(merged)
+    return [group["deliverables"] for group in groups]
+
+# Process and upload the deliverables of one group, one after another (this is the job that runs in the worker processes)
+#   processing_lock >> only one worker runs its geoprocessing at a time; the uploads run at the same time
+# Deliverables with output_format = "gpkg" are only processed (written to their GeoPackage, without arcpy) - status "written"
+# Returns the status of every deliverable: {"deliverable", "service", "status", "process_seconds", "publish_seconds", "error"}
+def runDeliverables(group, processing_lock):
+    results = []
+    for deliverable in group:
+        status = {"deliverable": deliverable, "service": readSetting(deliverable, "service_name"), "status": "failed",
+                  "process_seconds": 0.0, "publish_seconds": 0.0, "error": None}
+        try:
+            with processing_lock:
+                start = time.perf_counter()
+                module = importlib.import_module(deliverable)
+                if module.output_format == "gpkg":
+                    module.ProcessData()
+                else:
+                    with module.arcpy.EnvManager(outputCoordinateSystem = module.coordsys, scratchWorkspace = module.ws, workspace = module.ws):
+                        module.ProcessData()
+                status["process_seconds"] = time.perf_counter() - start
+            if module.output_format == "gpkg":
+                status["status"] = "written"
+                results.append(status)
+                continue
+            start = time.perf_counter()
+            with module.arcpy.EnvManager(outputCoordinateSystem = module.coordsys, scratchWorkspace = module.ws, workspace = module.ws):
+                module.AGOLUpload()
+            status["publish_seconds"] = time.perf_counter() - start
+            status["status"] = "published"
+        except Exception as e:
+            status["error"] = str(e) or type(e).__name__
+            traceback.print_exc()
+        results.append(status)
+    return results
+
+# Print one line per service, and the total time
+def printPublishReport(results, seconds):
+    print(">> Publishing report")
+    for entry in results:
+        if entry["status"] == "published":
+            print("       {}: {} - processed in {:.2f} s, uploaded in {:.2f} s".format(entry["deliverable"], entry["service"], entry["process_seconds"], entry["publish_seconds"]))
+        elif entry["status"] == "written":
+            print("       {}: written to {} in {:.2f} s (not uploaded)".format(entry["deliverable"], readSetting(entry["deliverable"], "gpkg_path"), entry["process_seconds"]))
+        else:
+            print("       ERROR {}: {} - {}".format(entry["deliverable"], entry["service"], entry["error"]))
+    published = [entry for entry in results if entry["status"] == "published"]
+    print("       Published {} of {} services in {:.2f} s".format(len(published), len(results), seconds))
+
+
+#############################################
+#####            PUBLISH ALL            #####
+#############################################
+
+# Process the data sets and upload the services, with at most max_concurrent_uploads workers
+# A deliverable that fails is reported with the status "failed" - the other services are still published
+def PublishAll():
+    print(">> Publishing " + ", ".join(deliverables) + "...")
+    start = time.perf_counter()
+    groups = groupDeliverables(deliverables)
+    results = []
+    use_python_executable()
+    with Manager() as manager, ProcessPoolExecutor(max_workers=max(1, min(max_concurrent_uploads, len(groups)))) as pool:
+        processing_lock = manager.Lock()
+        futures = {pool.submit(runDeliverables, group, processing_lock): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                group_results = future.result()
+            except Exception as e:
+                group_results = [{"deliverable": deliverable, "service": readSetting(deliverable, "service_name"), "status": "failed",
+                                  "process_seconds": 0.0, "publish_seconds": 0.0, "error": str(e)} for deliverable in futures[future]]
+            for entry in group_results:
+                print(">> {} {} ({})".format(entry["deliverable"], entry["status"], entry["service"]))
+            results += group_results
+    # Same order as 'deliverables'
+    results.sort(key=lambda entry: deliverables.index(entry["deliverable"]))
+    printPublishReport(results, time.perf_counter() - start)
+    return results
+
+if __name__ == '__main__':
+    PublishAll()
@@ -2,7 +2,8 @@
 
 ### Purpose
 # Processes the PWQMN data and uploads it to ArcGIS Online (AGOL) as a feature layer.
-# The feature layer will contain a station point layer and a data table.
+# The feature layer will contain a station point layer and a data table,
+# plus yearly and monthly summary tables for the dashboard (see summary_tables).
 #   PWQMNModel() >> PWQMN data processing model
 #   GDBToMap() >> Add all feature classes and tables to the map display
 #   GOLUpload() >> Upload all layers and tables to AGOL
@@ -67,6 +68,68 @@ sharegroup = ""                         # Enter the name of the group(s): "My Gr
 foldertype = "Existing"                         # Enter "Existing" to specify an existing folder
 foldername = "Collab"                         # Enter the existing AGOL folder name
 
+# >>> Choose how the feature layer is updated on AGOL
+#   "overwrite" >> stage and upload the whole service again
+#   "delta"     >> only send the rows that were added, changed or deleted since the last upload (see delta.py)
+#                  the service stays online; it is overwritten anyway the first time or when the fields change
+publish_mode = "overwrite"
+# URL of the existing feature service (for "delta"), e.g. "https://services.arcgis.com/<org id>/arcgis/rest/services/<service name>/FeatureServer"
+service_url = ""
+# Fields that identify a row of each layer/table (for "delta") - layers that are not listed are compared on all their fields
+DeltaKeys = {"PWQMN_Stations": ["Station__"],
+             "PWQMN_Data": ["Station__", "Sample_Date", "TEST_CODE"],
+             "PWQMN_Summary_Year": ["Station__", "TEST_CODE", "Year"],
+             "PWQMN_Summary_Month": ["Station__", "TEST_CODE", "Year", "Month"]}
+
+# >>> Upload the .sd file in parts of upload_chunk_mb, trying again when the connection fails (see uploads.py)
+# For slow or unreliable connections: if the upload stops, running the script again continues where it stopped
+chunked_upload = False
+upload_chunk_mb = 8
+# Maximum number of requests sent to ArcGIS Online at the same time (the connections and the sign-in token are reused - see portal.py)
+max_portal_requests = 4
+
+# >>> Enter the parameters to keep - TEST_CODE : description (shown through the TEST_CODE domain)
+# Rows with any other TEST_CODE are dropped while the Excel file is read
+Parameters = {"PPUT": "Total Phosphorus",
+              "CLIDUR": "Chloride",
+              "NNOTUR": "Nitrate",
+              "RSP ": "Suspended Solids",
+              "DO": "Dissolved Oxygen",
+              "FWTEMP": "Temperature",
+              "CONDAM": "Conductivity"}
+
+# >>> Enter the thresholds used for the pass/fail field (ThresholdPass)
+# One row per parameter - TEST_CODE : (comparator, limit)
+#   The result passes if "result <comparator> limit" is true, e.g. ("<=", 30) passes results of 30 or less
+#   Comparators: "<", "<=", ">", ">="
+# Add a row to check another parameter. Parameters without a row get no pass/fail value.
+Thresholds = {"PPUT": ("<=", 30),       # Total Phosphorus (µg/L)
+              "CLIDUR": ("<=", 120),    # Chloride (mg/L)
+              "DO": (">", 6),           # Dissolved Oxygen (mg/L)
+              "RSP ": ("<=", 30),       # Suspended Solids (mg/L)
+              "NNOTUR": ("<=", 3)}      # Nitrate (mg/L)
+
+# >>> Enter the unit conversions - (TEST_CODE, unit in the Excel file, unit to convert to, factor)
+# Result_ and Detection_Limit are multiplied by the factor and UNITS is set to the new unit
+# Results of a TEST_CODE in this table that are in any other unit are listed as unknown units (and are not converted);
+# add a row with a factor of 1, e.g. ("CLIDUR", "mg/L", "mg/L", 1), to check the units of another parameter
+UnitConversions = [("PPUT", "MILLIGRAM PER LITER", "MICROGRAM PER LITER", 1000),
+                   ("PPUT", "mg/L", "MICROGRAM PER LITER", 1000)]
+
+# >>> Choose how censored results are used for the thresholds and averages
+# Censored results are reported as a limit: "<0.5" (below the detection limit) or ">2000" (above the reporting limit)
+# The sign and the limit are kept in the Result_Flag and Detection_Limit fields; censored_policy sets Result_:
+#   "null"  >> Result_ is left empty
+#   "limit" >> Result_ is the limit (0.5)
+#   "half"  >> "<" results are half the detection limit (0.25), ">" results are the limit
+#   "zero"  >> "<" results are 0, ">" results are the limit
+censored_policy = "null"
+
+# >>> Summary tables for the dashboard (station x parameter x year, and station x parameter x year x month)
+# Each row holds the mean, minimum, maximum and number of results, and the percentage of results that failed the threshold
+# Set to False to only publish the full data table
+summary_tables = True
+
 # >>> Enter the URLS for the site photos
 StationList = {"Balsam Lake Outlet" : "https://www.kawarthaconservation.com/en/images/structure/news_avatar.jpg",
 "Blackstock Creek" : "https://www.kawarthaconservation.com/en/images/structure/news_avatar.jpg",
@@ -80,210 +143,308 @@ StationList = {"Balsam Lake Outlet" : "https://www.kawarthaconservation.com/en/i
 "Scugog River Up" : "https://www.kawarthaconservation.com/en/images/structure/news_avatar.jpg",
 "Sturgeon Lake Outlet" : "https://www.kawarthaconservation.com/en/images/structure/news_avatar.jpg"}
 
+# >>> Set to True to process the data again even if the Excel file and the settings have not changed
+force_rebuild = False
+
+# >>> Choose where the layers and tables are written
+#   "gdb"  >> the geodatabase (ws), then added to the map and uploaded to AGOL (needs ArcGIS Pro)
+#   "gpkg" >> a GeoPackage file (gpkg_path), built without arcpy (see points.py), e.g. on a Linux computer
+#             the domains are not created and nothing is uploaded
+output_format = "gdb"
+# Path to the GeoPackage (for "gpkg")
+gpkg_path = r"C:\Deliverables\Output\PWQMN.gpkg"
+
 ########################################################################################
 
 
-import arcpy, os
+import operator, os, numpy as np, pandas as pd
+from delta import clear_snapshots, delta_publish, snapshot_folder
+from ingest import MANIFEST_NAME, add_photos, combine_hashes, dataframe_to_table, hash_file, hash_table, load_manifest, print_photo_report, read_sheet, record_service, record_table, save_manifest, service_is_current, station_photos, stations_to_points, table_is_current, unique_stations, validate_field_name
+from points import gpkg_layers, write_gpkg_table, xy_to_points_file
+from portal import arcpy_token, configure_session
+from uploads import upload_service_definition
 
 # Coordinate system
 coordsys = "PROJCS[\"NAD_1983_CSRS_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_1983_CSRS\",DATUM[\"D_North_American_1983_CSRS\",SPHEROID[\"GRS_1980\",6378137.0,298.257222101]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",-81.0],PARAMETER[\"Scale_Factor\",0.9996],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]"
 
-arcpy.env.overwriteOutput = True
+if output_format not in ("gdb", "gpkg"):
+    raise ValueError("Unknown output_format '" + str(output_format) + "' - use \"gdb\" or \"gpkg\"")
 
-# Remove layers and tables from map view
-print(">> Removing existing layers from map view...")
-aprx = arcpy.mp.ArcGISProject(aprx_path)
-m = aprx.listMaps()[0] 
-table_list = m.listTables()
-for tbl in table_list:
-    m.removeTable(tbl)
-fc_list = m.listLayers()
-for fc in fc_list:
-    m.removeLayer(fc)
-aprx.save()
+# arcpy and the .aprx file are only needed for the geodatabase
+if output_format == "gdb":
+    import arcpy
+    arcpy.env.overwriteOutput = True
+
+    # Remove layers and tables from map view
+    print(">> Removing existing layers from map view...")
+    aprx = arcpy.mp.ArcGISProject(aprx_path)
+    m = aprx.listMaps()[0] 
+    table_list = m.listTables()
+    for tbl in table_list:
+        m.removeTable(tbl)
+    fc_list = m.listLayers()
+    for fc in fc_list:
+        m.removeLayer(fc)
+    aprx.save()
+
+# Field name of a column in the output (e.g. "Station #" >> "Station__", like ExcelToTable)
+def fieldName(column):
+    if output_format == "gpkg":
+        return validate_field_name(column)
+    return arcpy.ValidateFieldName(str(column), ws)
+
+# True if the layer or table is in the output (geodatabase or GeoPackage)
+def outputExists(name):
+    if output_format == "gpkg":
+        return name in gpkg_layers(gpkg_path)
+    return arcpy.Exists(name)
+
+# Write a DataFrame to a table of the output (geodatabase or GeoPackage)
+def writeTable(df, name, field_types=None):
+    if output_format == "gpkg":
+        return write_gpkg_table(df, gpkg_path, name)
+    return dataframe_to_table(df, os.path.join(ws, name), field_types=field_types)
+
+# Pass/fail value of each result, using the Thresholds table
+#   test_codes, results >> pandas Series of the same length
+#   Returns "Pass"/"Fail", "N/A" if the result is empty, or None if the parameter has no threshold
+# Every row is checked at once for each comparator, so adding a parameter to Thresholds does not add another pass over the data
+def calcThresholdPass(test_codes, results):
+    comparators = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+    threshold_comparator = test_codes.map({code: threshold[0] for code, threshold in Thresholds.items()})
+    threshold_limit = test_codes.map({code: threshold[1] for code, threshold in Thresholds.items()}).astype(float)
+    passed = pd.Series(False, index=test_codes.index)
+    for comparator in threshold_comparator.dropna().unique():
+        if comparator not in comparators:
+            raise ValueError("Unknown comparator '" + comparator + "' in Thresholds - use one of " + str(list(comparators)))
+        rows = threshold_comparator == comparator
+        passed[rows] = comparators[comparator](results[rows], threshold_limit[rows])
+    conditions = [threshold_limit.isna(), results.isna(), passed]
+    return pd.Series(np.select(conditions, [None, "N/A", "Pass"], default="Fail"), index=test_codes.index, dtype=object)
+
+# Keep only the rows of the parameters in Parameters (used as the row filter while the Excel file is read)
+# The Nitrate records that have no TEST_CODE are given 'NNOTUR' first, so they are kept
+def selectParameters(df):
+    # Populate the TEST_CODE records that contain null values
+    nitrate = df["TEST_CODE"].isna() & df["DESCRIPTION"].astype("string").str.contains("Nitrate", case=False, na=False)
+    df.loc[nitrate, "TEST_CODE"] = "NNOTUR"
+    return df[df["TEST_CODE"].isin(Parameters)]
+
+# Row filter for read_sheet: adds the unique stations of a chunk to 'station_chunks', then keeps the rows of the parameters
+# in Parameters (selectParameters). The stations come from every row of the Excel file, like XYTableToPoint and
+# DeleteIdentical on the whole table, so a station that only has other parameters still gets a point.
+def selectStationsAndParameters(chunk, station_chunks, station_fields):
+    stations = chunk.set_axis([fieldName(column) for column in chunk.columns], axis=1)
+    station_chunks.append(unique_stations(stations, "Station__", station_fields))
+    return selectParameters(chunk)
+
+# Split the results into a number, a censoring flag ("<", ">" or null) and a detection limit, e.g.
+#   "12" >> 12, null, null      "<0.5" >> null, "<", 0.5      "> 2000" >> null, ">", 2000
+# Anything else (e.g. "N/A") gets null in all three columns
+# The whole column is parsed at once with one regular expression
+def parseCensoredResults(results):
+    parts = results.astype("string").str.extract(r"^\s*([<>])?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+    flag = parts[0].astype(object).where(parts[0].notna(), None)
+    number = pd.to_numeric(parts[1]).astype(float)
+    return pd.DataFrame({"Value": number.where(flag.isna()),
+                         "Flag": flag,
+                         "Limit": number.where(flag.notna())}, index=results.index)
+
+# Result to use for each parsed result, following censored_policy (see the inputs)
+def substituteCensored(censored, policy):
+    policies = {"null": {"<": np.nan, ">": np.nan},
+                "limit": {"<": 1.0, ">": 1.0},
+                "half": {"<": 0.5, ">": 1.0},
+                "zero": {"<": 0.0, ">": 1.0}}
+    if policy not in policies:
+        raise ValueError("Unknown censored_policy '" + str(policy) + "' - use one of " + str(list(policies)))
+    # Fraction of the limit used for each flag
+    factor = censored["Flag"].map(policies[policy]).astype(float)
+    return censored["Value"].fillna(censored["Limit"] * factor)
+
+# Calculate all the derived fields of the PWQMN data in one pass over the DataFrame:
+#   BOW_SITE_DESC >> site descriptions in proper case
+#   Year, Month >> from Sample_Date
+#   Result_Flag, Detection_Limit >> sign and limit of the censored results ("<0.5", ">2000")
+#   Result_ >> Result as a number (-9999 values become null, censored results follow censored_policy)
+def calcDerivedFields(df):
+    df["BOW_SITE_DESC"] = df["BOW_SITE_DESC"].str.title()
+
+    sample_date = pd.to_datetime(df["Sample_Date"], errors="coerce")
+    df["Sample_Date"] = sample_date
+    df["Year"] = sample_date.dt.year.astype("Int16")
+    df["Month"] = sample_date.dt.month.astype("Int16")
+
+    # Some of the Result records contain "<" signs, which causes the field to be interpreted as a text field
+    # This causes issues when calculating averages in the ArcGIS Online Dashboard
+    censored = parseCensoredResults(df["Result"])
+    df["Result_Flag"] = censored["Flag"]
+    df["Detection_Limit"] = censored["Limit"]
+    result = substituteCensored(censored, censored_policy)
+    # Some of the Result records are equal to -9999, which skews the averages in ArcGIS Online
+    df["Result_"] = result.mask(result == -9999)
+    return df
+
+# Summary of the results of every station and parameter per period (e.g. ["Year"] or ["Year", "Month"])
+#   Result_Mean, Result_Min, Result_Max, Result_Count >> of the results that are not null
+#   Exceedance_Percent >> percentage of the results with a pass/fail value that failed (null for parameters without a threshold)
+# Rows with an empty group field (e.g. a Sample_Date that could not be read, so no Year) are summarized in a group with
+# an empty value, so the summaries cover the same rows as PWQMN_Data
+def summarizeResults(df, period_fields):
+    group_fields = ["Station__", "BOW_SITE_DESC", "TEST_CODE"] + period_fields
+    summary = df.assign(Failed=(df["ThresholdPass"] == "Fail").astype(float).where(df["ThresholdPass"].isin(["Pass", "Fail"])))
+    summary = summary.groupby(group_fields, dropna=False).agg(Result_Mean=("Result_", "mean"),
+                                                Result_Min=("Result_", "min"),
+                                                Result_Max=("Result_", "max"),
+                                                Result_Count=("Result_", "count"),
+                                                Exceedance_Percent=("Failed", "mean"))
+    summary["Exceedance_Percent"] = summary["Exceedance_Percent"] * 100
+    return summary.reset_index()
+
+# Convert the results to the units in UnitConversions, e.g. Total Phosphorus from milligram/L to microgram/L
+# Every conversion is applied in one pass by joining the (TEST_CODE, UNITS) of each row to the conversion table
+# Returns the number of rows of every (TEST_CODE, UNITS) pair that has no conversion and is not a target unit
+def normalizeUnits(df):
+    keys = ["TEST_CODE", "UNITS"]
+    conversions = pd.DataFrame(UnitConversions, columns=keys + ["Target_Units", "Factor"])
+    if conversions.duplicated(keys).any():
+        raise ValueError("UnitConversions has more than one row for: " + str(conversions[conversions.duplicated(keys)][keys].values.tolist()))
+    conversions[keys] = conversions[keys].astype("string")
+    rows = df[keys].astype("string")
+
+    matched = rows.merge(conversions, how="left", on=keys)
+    matched.index = df.index
+    converted = matched["Factor"].notna()
+    for field in ["Result_", "Detection_Limit"]:
+        df.loc[converted, field] = df.loc[converted, field] * matched.loc[converted, "Factor"].astype(float)
+    df.loc[converted, "UNITS"] = matched.loc[converted, "Target_Units"]
+
+    # Rows that are already in a target unit do not need a conversion
+    targets = conversions[["TEST_CODE", "Target_Units"]].drop_duplicates().rename(columns={"Target_Units": "UNITS"})
+    targets[keys] = targets[keys].astype("string")
+    in_target = rows.merge(targets.assign(Target=True), how="left", on=keys)["Target"].notna().to_numpy()
+    unknown = rows[rows["TEST_CODE"].isin(conversions["TEST_CODE"]).to_numpy() & ~converted.to_numpy() & ~in_target]
+    return unknown.groupby(keys, dropna=False).size()
 
 # PWQMN Data Processing
 def PWQMNModel():
     print(">> Processing the PWQMN data...")
 
-    # Import the Excel file to the gdb with the name PWQMN
-    # Parameters: arcpy.conversion.ExcelToTable(Input_Excel_File, Output_Table, {Sheet}, {field_names_row}, {cell_range})
-    arcpy.conversion.ExcelToTable(input_PWQMN_table, "PWQMN")
+    # Skip the processing if the Excel file and the station photos have not changed since the last run
+    # (the content hashes from the last run are stored in a manifest file in the output folder)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    source_hash = combine_hashes(hash_file(input_PWQMN_table), StationList, Parameters, Thresholds, UnitConversions, censored_policy, summary_tables)
+    output_tables = ["PWQMN_Data", "PWQMN_Stations"]
+    if summary_tables:
+        output_tables += ["PWQMN_Summary_Year", "PWQMN_Summary_Month"]
+    if not force_rebuild and all(table_is_current(manifest, table, source_hash) and outputExists(table) for table in output_tables):
+        print("\tThe Excel file has not changed - reusing the existing tables")
+        return
+
+    # Read the Excel file (first sheet, like ExcelToTable)
+    # Only the rows of the required parameters (chloride, etc.) are kept, so every step below only works on those rows
+    print("\tReading the Excel file")
+    # The repetitive/empty fields are not read at all
+    unused_fields = ["Conservation_Authority", "Watershed", "Active", "COL_G", "COL_H"]
+    # The unique stations are taken from every row, before the rows of the other parameters are dropped
+    station_fields = ["BOW_SITE_DESC", "SAMPLE_PT_DESC_1", "East", "North"]
+    station_chunks = []
+    PWQMN_df, rows_read = read_sheet(input_PWQMN_table, row_filter=lambda chunk: selectStationsAndParameters(chunk, station_chunks, station_fields),
+                                     columns=lambda column: fieldName(column) not in unused_fields)
+    print("\t\tKept " + str(len(PWQMN_df)) + " of " + str(rows_read) + " rows")
+    # Use the same field names that ExcelToTable would create (e.g. "Station #" >> "Station__")
+    PWQMN_df.columns = [fieldName(column) for column in PWQMN_df.columns]
 
-    # Convert all site descriptions to the same case (proper case)
-    PWQMN_raw = "PWQMN"
-    arcpy.management.CalculateField(PWQMN_raw, field="BOW_SITE_DESC", expression="!BOW_SITE_DESC!.title()")[0]
+    print("\tCalculating fields")
+    calcDerivedFields(PWQMN_df)
+    no_date = PWQMN_df["Sample_Date"].isna().sum()
+    if no_date:
+        print("\t\tWARNING: " + str(no_date) + " rows have a Sample_Date that can't be read (no Year or Month)")
+    unknown_units = normalizeUnits(PWQMN_df)
+    for (code, units), rows in unknown_units.items():
+        print("\t\tUnknown units for " + str(code) + ": " + str(units) + " (" + str(rows) + " rows, not converted)")
 
     print("\tCreating station points")
-    # Create a PWQMN_Stations feature class from the imported Excel file
-    PWQMN_Stations = "PWQMN_Stations"
-    # Convert the table to a point feature class
-    arcpy.management.XYTableToPoint(PWQMN_raw, PWQMN_Stations, "East", "North", "", coordsys)
-    # Delete duplicate site codes
-    arcpy.management.DeleteIdentical(PWQMN_Stations, "Station__")
+    # Create a PWQMN_Stations feature class with one point per station
     # Only keep the fields that contain the basic station information
-    field_list = arcpy.ListFields(PWQMN_Stations)
-    field_list_delete = []
-    for field in field_list:
-        if field.baseName != "OBJECTID" and field.baseName != "Shape" and field.baseName != "Station__" and field.baseName != "BOW_SITE_DESC" and field.baseName != "SAMPLE_PT_DESC_1":
-            field_list_delete.append(field.baseName)
-    arcpy.management.DeleteField(PWQMN_Stations, drop_field=field_list_delete)
-
-    # Add photos to station points
-    print("\tAdding photos")
-    # Create a new text field
-    arcpy.management.AddField(PWQMN_raw, "Photo", "TEXT")
-    for station in StationList:
-        station_where = "BOW_SITE_DESC = " + "'" + station + "'"
-        PWQMN_SelectStation = arcpy.management.SelectLayerByAttribute(PWQMN_Stations, where_clause=station_where)
-        station_calc = "'" + StationList.get(station) + "'"
-        arcpy.management.CalculateField(PWQMN_SelectStation, "Photo", station_calc)
-
-    # Create a TEST_CODE domain
-    print("\tAdding domains")
-    desc_ws = arcpy.Describe(ws)
-    desc_domains = desc_ws.domains
-    # Check if the domain exists
-    domainname = "TESTCODE_domain"
-    if domainname not in desc_domains:
-        # Create Domain
-        arcpy.management.CreateDomain(ws, domainname, field_type="TEXT")[0]
-        # Add Coded Values To Domain
-        coded_vals = {"PPUT":"Total Phosphorus", "CLIDUR":"Chloride", "NNOTUR":"Nitrate", "RSP ":"Suspended Solids",
-                      "DO": "Dissolved Oxygen", "FWTEMP":"Temperature", "CONDAM":"Conductivity"}
-        for code in coded_vals:
-            code_desc = coded_vals.get(code)
-            arcpy.management.AddCodedValueToDomain(ws, domainname, code=code, code_description=code_desc)
-
-    # Assign Domain To Field
-    arcpy.management.AssignDomainToField(PWQMN_raw, field_name="TEST_CODE", domain_name="TESTCODE_domain")[0]
-
-    print("\tCalculating fields")
-    # Populate the TEST_CODE records that contain null values
-    PWQMN_SelectNull = arcpy.management.SelectLayerByAttribute(PWQMN_raw, where_clause="TEST_CODE IS NULL And DESCRIPTION LIKE '%Nitrate%'")
-    arcpy.management.CalculateField(PWQMN_SelectNull, field="TEST_CODE", expression="'NNOTUR'")[0]
-
-    # Create a year field
-    # Create a new short integer field
-    arcpy.management.AddField(PWQMN_raw, "Year", "SHORT")
-    # Populate the new field
-    arcpy.management.CalculateField(PWQMN_raw, field="Year", expression="!Sample_Date!.year")
-
-    # Create a month field
-    # Create a new short integer field
-    arcpy.management.AddField(PWQMN_raw, "Month", "SHORT")
-    # Populate the new field
-    arcpy.management.CalculateField(PWQMN_raw, field="Month", expression="!Sample_Date!.month")
-
-    # Create Month_domain
-    # Check if the domain exists
-    domainname2 = "Month_domain"
-    if domainname2 not in desc_domains:
-        # Create Domain
-        arcpy.management.CreateDomain(ws, domainname2, field_type="SHORT")[0]
-        # Add Coded Values To Domain
-        coded_vals2 = {"1":"Jan", "2":"Feb", "3":"Mar", "4":"Apr", "5":"May", "6":"June",
-                      "7": "July", "8":"Aug", "9":"Sept", "10":"Oct", "11":"Nov", "12":"Dec"}
-        for code2 in coded_vals2:
-            code_desc2 = coded_vals2.get(code2)
-            arcpy.management.AddCodedValueToDomain(ws, domainname2, code=code2, code_description=code_desc2)
-
-    # Assign Domain To Field
-    arcpy.management.AssignDomainToField(PWQMN_raw, field_name="Month", domain_name=domainname2)[0]
+    PWQMN_Stations = "PWQMN_Stations"
+    stations = unique_stations(pd.concat(station_chunks, ignore_index=True), "Station__", station_fields)
+    # Convert all site descriptions to the same case (proper case), like the data
+    stations["BOW_SITE_DESC"] = stations["BOW_SITE_DESC"].str.title()
+    if output_format == "gpkg":
+        # The photos are added before the points are written (look up every station's photo in StationList in a single pass)
+        unmatched = station_photos(stations, "BOW_SITE_DESC", StationList)
+        xy_to_points_file(stations, gpkg_path, "East", "North", coordsys, layer=PWQMN_Stations, drop_xy=True)
+    else:
+        stations_to_points(stations, PWQMN_Stations, "Station__", ["BOW_SITE_DESC", "SAMPLE_PT_DESC_1"], "East", "North", coordsys)
 
-    # Some of the Result records contain "<" signs, which causes the field to be interpreted as a text field
-    # This causes issues when calculating averages in the ArcGIS Online Dashboard
-    # Create a new Double field
-    arcpy.management.AddField(PWQMN_raw, "Result_", "DOUBLE")
-    # Populate the new field
-    arcpy.management.CalculateField(PWQMN_raw, field="Result_", expression="!Result!")
+        # Add photos to station points
+        print("\tAdding photos")
+        # Look up every station's photo in StationList in a single pass
+        unmatched = add_photos(PWQMN_Stations, "BOW_SITE_DESC", StationList)
+    print_photo_report(unmatched)
 
-    # Some of the Result records are equal to -9999, which skews the averages in ArcGIS Online
-    # Convert -9999 values to null
-    PWQMN_where2 = "Result = '-9999'"
-    PWQMN_Select2 = arcpy.management.SelectLayerByAttribute(PWQMN_raw, where_clause = PWQMN_where2)
-    arcpy.management.CalculateField(PWQMN_Select2, field="Result_", expression="None")
-
-    # Export only the records that contain the required parameters (chloride, etc.) as PWQMN_Data
-    PWQMN_where = "TEST_CODE = 'PPUT' Or TEST_CODE = 'CLIDUR' Or TEST_CODE = 'NNOTUR' Or TEST_CODE = 'RSP ' Or TEST_CODE = 'DO' Or TEST_CODE = 'FWTEMP' Or TEST_CODE = 'CONDAM'"
-    PWQMN_Select = arcpy.management.SelectLayerByAttribute(PWQMN_raw, where_clause = PWQMN_where)
-    PWQMN_Data = os.path.join(ws, "PWQMN_Data")
-    arcpy.conversion.ExportTable(PWQMN_Select, PWQMN_Data)
-
-    # Convert all the Total Phosphorus values that are measured in milligram/L to microgram/L
-    PWQMN_SelectPhos = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'PPUT' And (UNITS = 'MILLIGRAM PER LITER' Or UNITS = 'mg/L')")
-    arcpy.management.CalculateField(PWQMN_SelectPhos, field="Result", expression="!Result! * 1000")[0]
-    arcpy.management.CalculateField(PWQMN_SelectPhos, field="UNITS", expression="'MICROGRAM PER LITER'")[0]
-
-    # Add a pass/fail field
-    arcpy.management.AddField(PWQMN_raw, "ThresholdPass", "TEXT")
-    # Total Phosphorus
-    PWQMN_SelectTP = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'PPUT'")
-    threshold_expression_TP = "calcThresholdTP(!Result_!)"
-    codeblock_TP = """
-def calcThresholdTP(value):
-    if value <= 30:
-        return "Pass"
-    if value > 30:
-        return "Fail"
-    else:
-        return "N/A" """
-    arcpy.management.CalculateField(PWQMN_SelectTP, "ThresholdPass", threshold_expression_TP, code_block = codeblock_TP)
-    # Chloride
-    PWQMN_SelectChlor = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'CLIDUR'")
-    threshold_expression_Chlor = "calcThresholdChlor(!Result_!)"
-    codeblock_Chlor = """
-def calcThresholdChlor(value):
-    if value <= 120:
-        return "Pass"
-    if value > 120:
-        return "Fail"
-    else:
-        return "N/A" """
-    arcpy.management.CalculateField(PWQMN_SelectChlor, "ThresholdPass", threshold_expression_Chlor, code_block = codeblock_Chlor)
-    # Dissolved Oxygen
-    PWQMN_SelectDO = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'DO'")
-    threshold_expression_DO = "calcThresholdDO(!Result_!)"
-    codeblock_DO = """
-def calcThresholdDO(value):
-    if value <= 6:
-        return "Fail"
-    if value > 6:
-        return "Pass"
-    else:
-        return "N/A" """
-    arcpy.management.CalculateField(PWQMN_SelectDO, "ThresholdPass", threshold_expression_DO, code_block = codeblock_DO)
-    # Suspended Solids
-    PWQMN_SelectSS = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'RSP '")
-    threshold_expression_SS = "calcThresholdSS(!Result_!)"
-    codeblock_SS = """
-def calcThresholdSS(value):
-    if value <= 30:
-        return "Pass"
-    if value > 30:
-        return "Fail"
-    else:
-        return "N/A" """
-    arcpy.management.CalculateField(PWQMN_SelectSS, "ThresholdPass", threshold_expression_SS, code_block = codeblock_SS)
-    # Nitrate
-    PWQMN_SelectNit = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="TEST_CODE = 'NNOTUR'")
-    threshold_expression_Nit = "calcThresholdNit(!Result_!)"
-    codeblock_Nit = """
-def calcThresholdNit(value):
-    if value <= 3:
-        return "Pass"
-    if value > 3:
-        return "Fail"
-    else:
-        return "N/A" """
-    arcpy.management.CalculateField(PWQMN_SelectNit, "ThresholdPass", threshold_expression_Nit, code_block = codeblock_Nit)
+    # Add a pass/fail field, using the Thresholds table
+    PWQMN_df["ThresholdPass"] = calcThresholdPass(PWQMN_df["TEST_CODE"], PWQMN_df["Result_"])
     # Delete null rows, excluding Conductivity
-    PWQMN_SelectNullRows = arcpy.management.SelectLayerByAttribute(PWQMN_Data, where_clause="(ThresholdPass is null) And (TEST_CODE <> 'CONDAM')")
-    arcpy.management.DeleteRows(PWQMN_SelectNullRows)
-
-    print("\tDeleting fields")
-    # Delete repetitive/empty fields
-    arcpy.management.DeleteField(PWQMN_Data, drop_field=["Conservation_Authority", "Watershed", "Active", "COL_G", "COL_H", "Photo", "Result"])[0]
+    PWQMN_df = PWQMN_df[PWQMN_df["ThresholdPass"].notna() | (PWQMN_df["TEST_CODE"] == "CONDAM")]
+
+    # Import the data to the gdb as PWQMN_Data
+    # The text Result field is only needed to calculate Result_, Result_Flag and Detection_Limit
+    PWQMN_Data = "PWQMN_Data"
+    writeTable(PWQMN_df.drop(columns=["Result"]), PWQMN_Data, field_types={"Year": "SHORT", "Month": "SHORT", "Result_": "DOUBLE", "Result_Flag": "TEXT", "Detection_Limit": "DOUBLE", "ThresholdPass": "TEXT"})
+
+    # Domains (geodatabase only - a GeoPackage keeps the codes as they are)
+    if output_format == "gdb":
+        # Create a TEST_CODE domain
+        print("\tAdding domains")
+        desc_ws = arcpy.Describe(ws)
+        desc_domains = desc_ws.domains
+        # Check if the domain exists
+        domainname = "TESTCODE_domain"
+        if domainname not in desc_domains:
+            # Create Domain
+            arcpy.management.CreateDomain(ws, domainname, field_type="TEXT")[0]
+            # Add Coded Values To Domain
+            for code in Parameters:
+                code_desc = Parameters.get(code)
+                arcpy.management.AddCodedValueToDomain(ws, domainname, code=code, code_description=code_desc)
+
+        # Assign Domain To Field
+        arcpy.management.AssignDomainToField(PWQMN_Data, field_name="TEST_CODE", domain_name="TESTCODE_domain")[0]
+
+        # Create Month_domain
+        # Check if the domain exists
+        domainname2 = "Month_domain"
+        if domainname2 not in desc_domains:
+            # Create Domain
+            arcpy.management.CreateDomain(ws, domainname2, field_type="SHORT")[0]
+            # Add Coded Values To Domain
+            coded_vals2 = {"1":"Jan", "2":"Feb", "3":"Mar", "4":"Apr", "5":"May", "6":"June",
+                          "7": "July", "8":"Aug", "9":"Sept", "10":"Oct", "11":"Nov", "12":"Dec"}
+            for code2 in coded_vals2:
+                code_desc2 = coded_vals2.get(code2)
+                arcpy.management.AddCodedValueToDomain(ws, domainname2, code=code2, code_description=code_desc2)
+
+        # Assign Domain To Field
+        arcpy.management.AssignDomainToField(PWQMN_Data, field_name="Month", domain_name=domainname2)[0]
+
+    if summary_tables:
+        print("\tCreating summary tables")
+        # Same records as PWQMN_Data
+        summary_field_types = {"Year": "SHORT", "Month": "SHORT", "Exceedance_Percent": "DOUBLE"}
+        writeTable(summarizeResults(PWQMN_df, ["Year"]), "PWQMN_Summary_Year", field_types=summary_field_types)
+        writeTable(summarizeResults(PWQMN_df, ["Year", "Month"]), "PWQMN_Summary_Month", field_types=summary_field_types)
+        if output_format == "gdb":
+            for table in ["PWQMN_Summary_Year", "PWQMN_Summary_Month"]:
+                arcpy.management.AssignDomainToField(table, field_name="TEST_CODE", domain_name="TESTCODE_domain")[0]
+            arcpy.management.AssignDomainToField("PWQMN_Summary_Month", field_name="Month", domain_name="Month_domain")[0]
+
+    # Remember which data the tables were built from, so they can be reused on the next run
+    for table in output_tables:
+        record_table(manifest, table, source_hash)
+    save_manifest(manifest_path, manifest)
 
 # Add all feature classes and tables to the map display
 def GDBToMap():
@@ -301,10 +462,13 @@ def GDBToMap():
     
     # Add data (table)
     print("\tAdding tables")
-    table = "PWQMN_Data"
-    table_path = os.path.join(ws, table)
-    addTab = arcpy.mp.Table(table_path)
-    m.addTable(addTab)
+    tables = ["PWQMN_Data"]
+    if summary_tables:
+        tables += ["PWQMN_Summary_Year", "PWQMN_Summary_Month"]
+    for table in tables:
+        table_path = os.path.join(ws, table)
+        addTab = arcpy.mp.Table(table_path)
+        m.addTable(addTab)
 
     aprx.save()
 
@@ -321,13 +485,6 @@ def AGOLUpload():
     sd_filename = service_name + ".sd"
     sd_output_filename = os.path.join(outdir, sd_filename)
 
-    # Delete existing files
-    print("\tDeleting existing files")
-    if os.path.exists(sddraft_output_filename):
-        os.remove(sddraft_output_filename)
-    if os.path.exists(sd_output_filename):
-        os.remove(sd_output_filename)
-
     # Reference layers to publish
     lyr_list = []               # List layers and tables
     lyrs = m.listLayers()       # List layers
@@ -339,25 +496,67 @@ def AGOLUpload():
     for x in range(count_tables):
         lyr_list.append(tables[x])
 
-    # Create FeatureSharingDraft and enable overwriting
+    # Skip the upload if the layers, tables and settings have not changed since the last upload
+    # (the hashes of what the service was staged and published from are stored in the manifest - see ingest.py)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    staging_hash = combine_hashes(*[hash_table(lyr.dataSource) for lyr in lyr_list], [lyr.name for lyr in lyr_list], service_name, mysummary, mytags, mydescription, mycredits, myuselimitations)
+    publishing_hash = combine_hashes(staging_hash, sharepublic, shareorg, sharegroup, foldertype, foldername)
+    if not force_rebuild and service_is_current(manifest, service_name, "published", publishing_hash):
+        print("\tThe layers and tables have not changed since the last upload - skipping the upload")
+        removeMapLayers()
+        return
+
+    # Shared connection to ArcGIS Online for the requests below (kept-alive connections, cached sign-in token - see portal.py)
+    configure_session(arcpy_token, max_in_flight=max_portal_requests)
+
+    # Only send the rows that changed since the last upload (see delta.py)
+    # The service is overwritten instead the first time, or when the fields of a layer have changed
+    snapshots = snapshot_folder(outdir, service_name)
+    if publish_mode == "delta" and service_url:
+        print("\tComparing to the published data")
+        if delta_publish(service_url, {lyr.name: lyr.dataSource for lyr in lyr_list}, DeltaKeys, snapshots):
+            record_service(manifest, service_name, "published", publishing_hash)
+            save_manifest(manifest_path, manifest)
+            print("\tFinish Publishing (only the changes were sent)")
+            removeMapLayers()
+            return
+        print("\tOverwriting the service")
+
+    # Publish to ArcGIS Online (the hosting server)
     server_type = "HOSTING_SERVER"
-    # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
-    sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
-    sddraft.summary = mysummary
-    sddraft.tags = mytags
-    sddraft.description = mydescription
-    sddraft.credits = mycredits
-    sddraft.useLimitations = myuselimitations
-    sddraft.overwriteExistingService = True
-
-    # Create Service Definition Draft file
-    # Parameters: exportToSDDraft(out_sddraft)
-    sddraft.exportToSDDraft(sddraft_output_filename)
-
-    # Stage Service
-    print("\tStart Staging")
-    # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
-    arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+
+    # Reuse the .sd file if it was staged from the same layers, tables and settings (e.g. the last upload failed)
+    if not force_rebuild and service_is_current(manifest, service_name, "staged", staging_hash) and os.path.exists(sd_output_filename):
+        print("\tReusing the staged service definition " + sd_output_filename)
+    else:
+        # Delete existing files
+        print("\tDeleting existing files")
+        if os.path.exists(sddraft_output_filename):
+            os.remove(sddraft_output_filename)
+        if os.path.exists(sd_output_filename):
+            os.remove(sd_output_filename)
+
+        # Create FeatureSharingDraft and enable overwriting
+        # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
+        sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
+        sddraft.summary = mysummary
+        sddraft.tags = mytags
+        sddraft.description = mydescription
+        sddraft.credits = mycredits
+        sddraft.useLimitations = myuselimitations
+        sddraft.overwriteExistingService = True
+
+        # Create Service Definition Draft file
+        # Parameters: exportToSDDraft(out_sddraft)
+        sddraft.exportToSDDraft(sddraft_output_filename)
+
+        # Stage Service
+        print("\tStart Staging")
+        # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
+        arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+        record_service(manifest, service_name, "staged", staging_hash)
+        save_manifest(manifest_path, manifest)
 
     # Share to portal
     # Documentation: https://pro.arcgis.com/en/pro-app/latest/tool-reference/server/upload-service-definition.htm
@@ -371,12 +570,26 @@ def AGOLUpload():
     inFolderName = foldername
     print("\tStart Uploading")
    
-    # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
-    arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # Upload the .sd file in parts that can be resumed (see uploads.py), or in one request
+    if chunked_upload:
+        # Same folder as UploadServiceDefinition: "Existing" or "New" (created if it does not exist yet), otherwise the root folder
+        upload_service_definition(arcpy.GetActivePortalURL(), sd_output_filename, service_name, None, inFolderName if inFolderType in ("Existing", "New") else "",
+                                  everyone=inSharePublic == "PUBLIC", org=inShareOrg == "SHARE_ORGANIZATION", groups=inShareGroup, chunk_mb=upload_chunk_mb,
+                                  create_folder=inFolderType == "New")
+    else:
+        # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
+        arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # The object ids of the service are new - the next delta upload reads them from the service again
+    clear_snapshots(snapshots)
+    record_service(manifest, service_name, "published", publishing_hash)
+    save_manifest(manifest_path, manifest)
 
     print("\tFinish Publishing")
 
-    # Delete tables and layers from the map view
+    removeMapLayers()
+
+# Delete tables and layers from the map view
+def removeMapLayers():
     table_list = m.listTables()
     for tbl in table_list:
         m.removeTable(tbl)
@@ -385,9 +598,19 @@ def AGOLUpload():
         m.removeLayer(fc)
     aprx.save()
 
-if __name__ == '__main__':
-    # Global Environment settings
-    with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
-        PWQMNModel()
+# Process the data and add it to the map (everything before the upload) - also used by publish_all.py
+# With output_format = "gpkg" the data is only written to the GeoPackage
+def ProcessData():
+    PWQMNModel()
+    if output_format == "gdb":
         GDBToMap()
-        AGOLUpload()
+
+if __name__ == '__main__':
+    if output_format == "gpkg":
+        ProcessData()
+        print(">> Wrote the layers and tables to " + gpkg_path)
+    else:
+        # Global Environment settings
+        with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
+            ProcessData()
+            AGOLUpload()
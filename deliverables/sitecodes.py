@@ -0,0 +1,174 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Matches the site codes of a data table to the site codes of its metadata table (the table with the site locations),
+# so the tables can be joined even when the codes are not typed exactly the same way, e.g. "CW-01 " and "cw01".
+#   1. exact      >> the codes are the same
+#   2. normalized >> the codes are the same once case, spaces and punctuation are ignored
+#   3. fuzzy      >> (optional) the most similar code, comparing groups of 'ngram' characters
+# Every code is looked up in a dictionary (hash join), so the matching does not slow down as the tables grow.
+# The matches are written to a report (.csv) so they can be checked.
+#   from sitecodes import reconcile_table_site_codes
+# arcpy is not imported at the top of this file, so the functions can also be used outside of ArcGIS Pro.
+
+import re
+from collections import Counter, defaultdict
+import pandas as pd
+
+# Default settings for the fuzzy matching
+DEFAULT_NGRAM = 3
+DEFAULT_MIN_SIMILARITY = 0.8
+
+
+#############################################
+#####          MATCHING CODES           #####
+#############################################
+
+# Key used to compare site codes: upper case, without spaces, punctuation or underscores, e.g. " cw-01 " >> "CW01"
+def normalize_site_code(code):
+    if code is None or (isinstance(code, float) and pd.isna(code)):
+        return ""
+    return re.sub(r"[\W_]+", "", str(code)).upper()
+
+
+# Match every data site code to a metadata site code
+#   fuzzy=True also matches codes that are only similar (see fuzzy_match)
+# Returns a DataFrame with one row per site code:
+#   SiteCode >> code in the data, Matched_SiteCode >> code in the metadata (empty if there is no match)
+#   Match >> "exact", "normalized", "fuzzy", "ambiguous" (more than one metadata code fits), "unmatched",
+#            or "no data" for metadata codes that are not used in the data
+#   Similarity >> 1 for exact and normalized matches, the n-gram similarity for fuzzy matches
+def reconcile_site_codes(data_codes, metadata_codes, fuzzy=False, ngram=DEFAULT_NGRAM, min_similarity=DEFAULT_MIN_SIMILARITY):
+    data_codes = unique_codes(data_codes)
+    metadata_codes = unique_codes(metadata_codes)
+
+    # Index of the metadata codes by their normalized key
+    metadata_set = set(metadata_codes)
+    metadata_by_key = defaultdict(list)
+    for code in metadata_codes:
+        metadata_by_key[normalize_site_code(code)].append(code)
+
+    rows = []
+    unmatched = []
+    for code in data_codes:
+        if code in metadata_set:
+            rows.append([code, code, "exact", 1.0])
+            continue
+        candidates = metadata_by_key.get(normalize_site_code(code), [])
+        if len(candidates) == 1:
+            rows.append([code, candidates[0], "normalized", 1.0])
+        elif len(candidates) > 1:
+            rows.append([code, None, "ambiguous", 1.0])
+        else:
+            unmatched.append(code)
+
+    fuzzy_matches = fuzzy_match(unmatched, metadata_codes, ngram, min_similarity) if fuzzy else {}
+    for code in unmatched:
+        match, similarity = fuzzy_matches.get(code, (None, None))
+        if match is None:
+            rows.append([code, None, "ambiguous" if similarity else "unmatched", similarity])
+        else:
+            rows.append([code, match, "fuzzy", similarity])
+
+    matched_codes = {row[1] for row in rows if row[1] is not None}
+    for code in metadata_codes:
+        if code not in matched_codes:
+            rows.append([None, code, "no data", None])
+    return pd.DataFrame(rows, columns=["SiteCode", "Matched_SiteCode", "Match", "Similarity"])
+
+
+# Most similar metadata code for each code, comparing the groups of 'ngram' characters of their normalized keys
+#   similarity = 2 x shared groups / (groups in code + groups in metadata code), from 0 (nothing shared) to 1
+# Only the metadata codes that share at least one group are compared (they are found through an index of the groups)
+# Returns {code: (metadata code, similarity)}; the metadata code is None when the best similarity is below
+# min_similarity or when several metadata codes are equally similar
+def fuzzy_match(codes, metadata_codes, ngram=DEFAULT_NGRAM, min_similarity=DEFAULT_MIN_SIMILARITY):
+    metadata_grams = {code: ngrams(normalize_site_code(code), ngram) for code in metadata_codes}
+    index = defaultdict(list)
+    for code, grams in metadata_grams.items():
+        for gram in grams:
+            index[gram].append(code)
+
+    matches = {}
+    for code in codes:
+        grams = ngrams(normalize_site_code(code), ngram)
+        shared = Counter(candidate for gram in grams for candidate in index.get(gram, []))
+        if not shared:
+            continue
+        scores = {candidate: 2 * count / (len(grams) + len(metadata_grams[candidate])) for candidate, count in shared.items()}
+        best = max(scores.values())
+        best_codes = [candidate for candidate, score in scores.items() if score == best]
+        if best < min_similarity:
+            continue
+        matches[code] = (best_codes[0] if len(best_codes) == 1 else None, best)
+    return matches
+
+
+# Set of the groups of n characters in a key, e.g. ngrams("CW01", 3) >> {"CW0", "W01"}
+def ngrams(key, n=DEFAULT_NGRAM):
+    if len(key) <= n:
+        return {key} if key else set()
+    return {key[i:i + n] for i in range(len(key) - n + 1)}
+
+
+# The distinct codes, in the order they first appear, without empty values
+def unique_codes(codes):
+    return [code for code in pd.unique(pd.Series(list(codes), dtype=object)) if normalize_site_code(code)]
+
+
+#############################################
+#####     RECONCILING GDB TABLES        #####
+#############################################
+
+# Replace the site codes of a data table with the matching codes of its metadata table, before the tables are joined
+# The codes are read once from each table, matched with reconcile_site_codes, and written back in one pass
+# The matches are saved to 'report_path' (.csv) and a summary is printed
+# Returns the report DataFrame
+def reconcile_table_site_codes(data_table, data_field, metadata_table, metadata_field, report_path, fuzzy=False, ngram=DEFAULT_NGRAM, min_similarity=DEFAULT_MIN_SIMILARITY):
+    import arcpy
+
+    with arcpy.da.SearchCursor(data_table, [data_field]) as cursor:
+        data_codes = [row[0] for row in cursor]
+    with arcpy.da.SearchCursor(metadata_table, [metadata_field]) as cursor:
+        metadata_codes = [row[0] for row in cursor]
+    report = reconcile_site_codes(data_codes, metadata_codes, fuzzy, ngram, min_similarity)
+
+    new_codes = site_code_changes(report)
+    if new_codes:
+        with arcpy.da.UpdateCursor(data_table, [data_field]) as cursor:
+            for row in cursor:
+                if row[0] in new_codes:
+                    row[0] = new_codes[row[0]]
+                    cursor.updateRow(row)
+
+    report.to_csv(report_path, index=False, encoding="utf-8")
+    print_site_code_report(report, report_path)
+    return report
+
+
+# Same as reconcile_table_site_codes for a DataFrame (e.g. a table that is written to a GeoPackage), without arcpy
+# The site codes in data[data_field] are replaced in place
+def reconcile_dataframe_site_codes(data, data_field, metadata, metadata_field, report_path, fuzzy=False, ngram=DEFAULT_NGRAM, min_similarity=DEFAULT_MIN_SIMILARITY):
+    report = reconcile_site_codes(data[data_field].tolist(), metadata[metadata_field].tolist(), fuzzy, ngram, min_similarity)
+    new_codes = site_code_changes(report)
+    if new_codes:
+        data[data_field] = data[data_field].replace(new_codes)
+
+    report.to_csv(report_path, index=False, encoding="utf-8")
+    print_site_code_report(report, report_path)
+    return report
+
+
+# {data code: metadata code} of the codes to change - only the codes that are not already exact matches are changed
+def site_code_changes(report):
+    changes = report[report["Match"].isin(["normalized", "fuzzy"])]
+    return dict(zip(changes["SiteCode"], changes["Matched_SiteCode"]))
+
+
+# Print how many site codes were matched in each way
+def print_site_code_report(report, report_path):
+    counts = report["Match"].value_counts()
+    print("       Site codes: " + ", ".join(str(count) + " " + match for match, count in counts.items()) + " (see " + report_path + ")")
+    problems = report[report["Match"].isin(["ambiguous", "unmatched"])]
+    if len(problems) > 0:
+        print("       WARNING: These site codes have no location: " + ", ".join(str(code) for code in problems["SiteCode"]))
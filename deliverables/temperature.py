@@ -59,42 +59,132 @@ sharegroup = ""                         # Enter the name of the group(s): "My Gr
 foldertype = ""                         # Enter "Existing" to specify an existing folder
 foldername = ""                         # Enter the existing AGOL folder name
 
+# >>> Choose how the feature layer is updated on AGOL
+#   "overwrite" >> stage and upload the whole service again
+#   "delta"     >> only send the rows that were added, changed or deleted since the last upload (see delta.py)
+#                  the service stays online; it is overwritten anyway the first time or when the fields change
+publish_mode = "overwrite"
+# URL of the existing feature service (for "delta"), e.g. "https://services.arcgis.com/<org id>/arcgis/rest/services/<service name>/FeatureServer"
+service_url = ""
+# Fields that identify a row of each layer/table (for "delta") - layers that are not listed are compared on all their fields
+DeltaKeys = {"TemperatureMonitoringPoints": ["SiteCode"],
+             "TemperatureMonitoringData": ["SiteCode", "Date"],
+             "TemperatureMonitoringDailyData": ["SiteCode", "Date"]}
+
+# >>> Upload the .sd file in parts of upload_chunk_mb, trying again when the connection fails (see uploads.py)
+# For slow or unreliable connections: if the upload stops, running the script again continues where it stopped
+chunked_upload = False
+upload_chunk_mb = 8
+# Maximum number of requests sent to ArcGIS Online at the same time (the connections and the sign-in token are reused - see portal.py)
+max_portal_requests = 4
+
+# >>> Excel conversion settings
+# Set to True for very large workbooks: the sheets are read in chunks instead of all at once
+streaming_ingest = False
+# Maximum number of rows held in memory at once when streaming_ingest = True
+ingest_chunk_rows = 50000
+# Format of the files the sheets are converted to: "csv" (text) or "parquet" (compressed, keeps the column types - needs pyarrow)
+intermediate_format = "csv"
+# Number of worker processes used to convert the workbooks (1 = one workbook at a time, None = one process per CPU)
+ingest_workers = 1
+# Sheets that have not changed since the last run are not processed again (their tables are reused)
+# Set to True to process every sheet again anyway
+force_rebuild = False
+
+# >>> Choose where the layers and tables are written
+#   "gdb"  >> the geodatabase (ws), then added to the map and uploaded to AGOL (needs ArcGIS Pro)
+#   "gpkg" >> a GeoPackage file (gpkg_path), built without arcpy (see points.py), e.g. on a Linux computer
+#             the relationship class is not created and nothing is uploaded
+output_format = "gdb"
+# Path to the GeoPackage (for "gpkg")
+gpkg_path = r"C:\Winter2023\COLLAB\TempDB\TemperatureMonitoring.gpkg"
+
+# >>> Site code matching
+# The site codes in TemperatureMonitoringData are matched to the codes in TemperatureMonitoringXYData ignoring case, spaces and punctuation
+# Set site_code_fuzzy_matching to True to also match codes that are only similar (at least site_code_min_similarity, from 0 to 1)
+site_code_fuzzy_matching = False
+site_code_min_similarity = 0.8
+
+# >>> Raw temperature logger files (optional)
+# Path to a folder of raw logger .csv files (one reading per row, e.g. every 15 minutes)
+# When it is set, TemperatureMonitoringData is calculated from the readings instead of the monthly ColdwaterStreams sheet,
+# and the daily values are added as TemperatureMonitoringDailyData. Leave it empty ("") to use the sheet.
+input_logger_folder = ""
+# Names of the site code, date/time and temperature columns in the logger files
+logger_fields = {"site": "SiteCode", "time": "DateTime", "temperature": "Temperature"}
+# Minutes between two readings (used for the degree-hours)
+logger_interval_minutes = 15
+# Degree-hours are the hours above this temperature (°C) multiplied by how many degrees above it the water was
+degree_hour_base = 20.0
+# Number of readings held in memory at once
+logger_chunk_rows = 1000000
+
 ########################################################################################
 
 
-import arcpy, os, pandas as pd
+import os, time, pandas as pd
+from sitecodes import reconcile_dataframe_site_codes, reconcile_table_site_codes
+from delta import clear_snapshots, delta_publish, snapshot_folder
+from ingest import MANIFEST_NAME, combine_hashes, convert_workbooks, dataframe_to_table, hash_file, hash_table, intermediate_to_table, is_intermediate_file, load_manifest, print_sheet_report, read_intermediate, record_service, record_table, save_manifest, service_is_current, table_is_current, validate_field_name
+from points import gpkg_layers, read_gpkg_table, write_gpkg_table, xy_to_points_file
+from portal import arcpy_token, configure_session
+from uploads import upload_service_definition
 
 # Coordinate system
 coordsys = "PROJCS[\"NAD_1983_CSRS_UTM_Zone_17N\",GEOGCS[\"GCS_North_American_1983_CSRS\",DATUM[\"D_North_American_1983_CSRS\",SPHEROID[\"GRS_1980\",6378137.0,298.257222101]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",-81.0],PARAMETER[\"Scale_Factor\",0.9996],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]"
 
-arcpy.env.overwriteOutput = True
+if output_format not in ("gdb", "gpkg"):
+    raise ValueError("Unknown output_format '" + str(output_format) + "' - use \"gdb\" or \"gpkg\"")
+
+# arcpy and the .aprx file are only needed for the geodatabase
+if output_format == "gdb":
+    import arcpy
+    arcpy.env.overwriteOutput = True
 
 # Remove layers and tables from map view
-aprx = arcpy.mp.ArcGISProject(aprx_path)
-maps = aprx.listMaps()
-if len(maps) == 0:
-    raise ValueError("       No map found!  Make sure the ArcGIS project has a map in it.")
-m = maps[0] 
-table_list = m.listTables()
-for tbl in table_list:
-    m.removeTable(tbl)
-fc_list = m.listLayers()
-for fc in fc_list:
-    m.removeLayer(fc)
-aprx.save()
+# (not in the worker processes of the parallel Excel conversion - they import this script again as '__mp_main__')
+if output_format == "gdb" and __name__ != '__mp_main__':
+    aprx = arcpy.mp.ArcGISProject(aprx_path)
+    maps = aprx.listMaps()
+    if len(maps) == 0:
+        raise ValueError("       No map found!  Make sure the ArcGIS project has a map in it.")
+    m = maps[0] 
+    table_list = m.listTables()
+    for tbl in table_list:
+        m.removeTable(tbl)
+    fc_list = m.listLayers()
+    for fc in fc_list:
+        m.removeLayer(fc)
+    aprx.save()
 
 #############################################
 #####        HELPER FUNCTIONS           #####
 #####   can be used for any data set    #####
 #############################################
 
-# Excel File Data Pre-Processing - makes .xslx file into .csvs and removes any spaces from field names.
-def xlsx_sheets_to_csv(path_to_excel_file, output_folder):
-    for sheet_name, df in pd.read_excel(path_to_excel_file, index_col=0, sheet_name=None).items():
-        csv_file = os.path.join(output_folder, f"{sheet_name}.csv")
-        # Remove spaces in field names
-        df.index.name = df.index.name.replace(" ", "")  
-        df.to_csv(csv_file, encoding='utf-8')
+# Excel File Data Pre-Processing - convert_workbooks() makes .xslx files into .csvs and removes any spaces from field names.
+# It is imported from ingest.py (in the same folder as this script).
+
+# True if the layer or table is in the output (geodatabase or GeoPackage)
+def outputExists(name):
+    if output_format == "gpkg":
+        return name in gpkg_layers(gpkg_path)
+    return arcpy.Exists(name)
+
+# Write a DataFrame to a table of the output (geodatabase or GeoPackage)
+def writeTable(df, name):
+    if output_format == "gpkg":
+        return write_gpkg_table(df, gpkg_path, name)
+    return dataframe_to_table(df, name)
+
+# Load a .csv or .parquet file made by convert_workbooks into a table of the output
+# The field names are made valid the same way in both outputs (e.g. "Site Code" >> "Site_Code")
+def loadTable(path, name):
+    if output_format == "gpkg":
+        df = read_intermediate(path)
+        df.columns = [validate_field_name(column) for column in df.columns]
+        return write_gpkg_table(df, gpkg_path, name)
+    return intermediate_to_table(path, name)
 
 # Add the specified feature classes and tables to the map display 
 # e.g. GDBToMap(["TemperatureMonitoringPoints"], ["TemperatureMonitoringData", "AnotherTable"])
@@ -118,7 +208,7 @@ def GDBToMap(fcs, tables):
         aprx.save()
 
 # Upload all layers and tables to ArcGIS Online
-def AGOLUpload(service_name):  # service_name is the name of the feature layer to be uploaded to AGOL
+def AGOLUpload(service_name=service_name):  # service_name is the name of the feature layer to be uploaded to AGOL
     print(">> Uploading to ArcGIS Online...")
     # Source: 
     # https://pro.arcgis.com/en/pro-app/latest/arcpy/sharing/featuresharingdraft-class.htm
@@ -130,13 +220,6 @@ def AGOLUpload(service_name):  # service_name is the name of the feature layer t
     sd_filename = service_name + ".sd"
     sd_output_filename = os.path.join(outdir, sd_filename)
 
-    # Delete existing files
-    print("       Deleting existing files...")
-    if os.path.exists(sddraft_output_filename):
-        os.remove(sddraft_output_filename)
-    if os.path.exists(sd_output_filename):
-        os.remove(sd_output_filename)
-
     # Reference layers to publish
     lyr_list = []               # List layers and tables
     lyrs = m.listLayers()       # List layers
@@ -148,25 +231,67 @@ def AGOLUpload(service_name):  # service_name is the name of the feature layer t
     for x in range(count_tables):
         lyr_list.append(tables[x])
 
-    # Create FeatureSharingDraft and enable overwriting
+    # Skip the upload if the layers, tables and settings have not changed since the last upload
+    # (the hashes of what the service was staged and published from are stored in the manifest - see ingest.py)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    staging_hash = combine_hashes(*[hash_table(lyr.dataSource) for lyr in lyr_list], [lyr.name for lyr in lyr_list], service_name, mysummary, mytags, mydescription, mycredits, myuselimitations)
+    publishing_hash = combine_hashes(staging_hash, sharepublic, shareorg, sharegroup, foldertype, foldername)
+    if not force_rebuild and service_is_current(manifest, service_name, "published", publishing_hash):
+        print("       The layers and tables have not changed since the last upload - skipping the upload")
+        removeMapLayers()
+        return
+
+    # Shared connection to ArcGIS Online for the requests below (kept-alive connections, cached sign-in token - see portal.py)
+    configure_session(arcpy_token, max_in_flight=max_portal_requests)
+
+    # Only send the rows that changed since the last upload (see delta.py)
+    # The service is overwritten instead the first time, or when the fields of a layer have changed
+    snapshots = snapshot_folder(outdir, service_name)
+    if publish_mode == "delta" and service_url:
+        print("       Comparing to the published data")
+        if delta_publish(service_url, {lyr.name: lyr.dataSource for lyr in lyr_list}, DeltaKeys, snapshots):
+            record_service(manifest, service_name, "published", publishing_hash)
+            save_manifest(manifest_path, manifest)
+            print(">> Finish Publishing (only the changes were sent)")
+            removeMapLayers()
+            return
+        print("       Overwriting the service")
+
+    # Publish to ArcGIS Online (the hosting server)
     server_type = "HOSTING_SERVER"
-    # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
-    sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
-    sddraft.summary = mysummary
-    sddraft.tags = mytags
-    sddraft.description = mydescription
-    sddraft.credits = mycredits
-    sddraft.useLimitations = myuselimitations
-    sddraft.overwriteExistingService = True
-
-    # Create Service Definition Draft file
-    # Parameters: exportToSDDraft(out_sddraft)
-    sddraft.exportToSDDraft(sddraft_output_filename)
-
-    # Stage Service
-    print("       Start Staging")
-    # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
-    arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+
+    # Reuse the .sd file if it was staged from the same layers, tables and settings (e.g. the last upload failed)
+    if not force_rebuild and service_is_current(manifest, service_name, "staged", staging_hash) and os.path.exists(sd_output_filename):
+        print("       Reusing the staged service definition " + sd_output_filename)
+    else:
+        # Delete existing files
+        print("       Deleting existing files...")
+        if os.path.exists(sddraft_output_filename):
+            os.remove(sddraft_output_filename)
+        if os.path.exists(sd_output_filename):
+            os.remove(sd_output_filename)
+
+        # Create FeatureSharingDraft and enable overwriting
+        # Parameters: getWebLayerSharingDraft(server_type, service_type, service_name, {layers_and_tables})
+        sddraft = m.getWebLayerSharingDraft(server_type, "FEATURE", service_name, lyr_list)
+        sddraft.summary = mysummary
+        sddraft.tags = mytags
+        sddraft.description = mydescription
+        sddraft.credits = mycredits
+        sddraft.useLimitations = myuselimitations
+        sddraft.overwriteExistingService = True
+
+        # Create Service Definition Draft file
+        # Parameters: exportToSDDraft(out_sddraft)
+        sddraft.exportToSDDraft(sddraft_output_filename)
+
+        # Stage Service
+        print("       Start Staging")
+        # Parameters: arcpy.server.StageService(in_service_definition_draft, out_service_definition, {staging_version})
+        arcpy.server.StageService(sddraft_output_filename, sd_output_filename)
+        record_service(manifest, service_name, "staged", staging_hash)
+        save_manifest(manifest_path, manifest)
 
     # Share to portal
     # Documentation: https://pro.arcgis.com/en/pro-app/latest/tool-reference/server/upload-service-definition.htm
@@ -180,12 +305,26 @@ def AGOLUpload(service_name):  # service_name is the name of the feature layer t
     inFolderName = foldername
 
     print(">> Start Uploading")
-    # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
-    arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # Upload the .sd file in parts that can be resumed (see uploads.py), or in one request
+    if chunked_upload:
+        # Same folder as UploadServiceDefinition: "Existing" or "New" (created if it does not exist yet), otherwise the root folder
+        upload_service_definition(arcpy.GetActivePortalURL(), sd_output_filename, service_name, None, inFolderName if inFolderType in ("Existing", "New") else "",
+                                  everyone=inSharePublic == "PUBLIC", org=inShareOrg == "SHARE_ORGANIZATION", groups=inShareGroup, chunk_mb=upload_chunk_mb,
+                                  create_folder=inFolderType == "New")
+    else:
+        # Parameters: arcpy.server.UploadServiceDefinition(in_sd_file, in_server, {in_service_name}, {in_cluster}, {in_folder_type}, {in_folder}, {in_startupType}, {in_override}, {in_my_contents}, {in_public}, {in_organization}, {in_groups})
+        arcpy.server.UploadServiceDefinition(sd_output_filename, server_type, "", "", inFolderType, inFolderName, "", inOverride, "", inSharePublic, inShareOrg, inShareGroup)
+    # The object ids of the service are new - the next delta upload reads them from the service again
+    clear_snapshots(snapshots)
+    record_service(manifest, service_name, "published", publishing_hash)
+    save_manifest(manifest_path, manifest)
 
     print(">> Finish Publishing")
 
-    # Delete tables and layers from the map view
+    removeMapLayers()
+
+# Delete tables and layers from the map view
+def removeMapLayers():
     table_list = m.listTables()
     for tbl in table_list:
         m.removeTable(tbl)
@@ -200,92 +339,228 @@ def AGOLUpload(service_name):  # service_name is the name of the feature layer t
 #####     for coldwater temp data       #####
 #############################################
 
+# Month labels used in the Row_Labels field
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+# Replace the Row_Labels (month) and Year fields with the Date (first day of the month at 12:00) and textDate ("Jul 2021") fields
+# Every row is converted at once - the dates are built directly from the numbers instead of from text
+# Rows with a month label that is not in MONTHS or a year that is not a whole number are not converted:
+# they are returned separately (the reject list) instead of stopping the processing
+def calcMonthDates(df, month_field="Row_Labels", year_field="Year"):
+    month_label = df[month_field].astype("string").str.strip()
+    month = month_label.map(MONTHS)
+    year = pd.to_numeric(df[year_field], errors="coerce")
+    valid = (month.notna() & year.notna() & (year == year.round())).to_numpy(dtype=bool)
+
+    rejects = df[~valid]
+    df = df[valid].copy()
+    year = year[valid].astype(int)
+    df["Date"] = pd.to_datetime(pd.DataFrame({"year": year, "month": month[valid].astype(int), "day": 1, "hour": 12}))
+    df["textDate"] = month_label[valid] + " " + year.astype(str)
+    return df.drop(columns=[month_field, year_field]), rejects
+
+# Daily and monthly temperatures of every site, calculated from raw logger .csv files
+# The files are read 'chunk_rows' readings at a time: each chunk is reduced to one row per site and day
+# (sum, count, min, max and degree-hours), so the memory use depends on the number of site-days, not on the number of readings
+# Returns the daily table, the monthly table and the number of readings that could not be read (no site, time or temperature)
+def aggregateLoggerFiles(paths, chunk_rows=logger_chunk_rows):
+    columns = [logger_fields["site"], logger_fields["time"], logger_fields["temperature"]]
+    partials = []
+    skipped = 0
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_rows, encoding="utf-8"):
+            readings = pd.DataFrame({"SiteCode": chunk[logger_fields["site"]].astype("string").str.strip().replace("", pd.NA),
+                                     "Time": pd.to_datetime(chunk[logger_fields["time"]], errors="coerce"),
+                                     "Temperature": pd.to_numeric(chunk[logger_fields["temperature"]], errors="coerce")}).dropna()
+            skipped += len(chunk) - len(readings)
+            readings["Day"] = readings["Time"].dt.normalize()
+            readings["Degree_Hours"] = (readings["Temperature"] - degree_hour_base).clip(lower=0) * (logger_interval_minutes / 60)
+            partials.append(readings.groupby(["SiteCode", "Day"]).agg(Temp_Sum=("Temperature", "sum"),
+                                                                       Readings=("Temperature", "count"),
+                                                                       Min_Temp=("Temperature", "min"),
+                                                                       Max_Temp=("Temperature", "max"),
+                                                                       Degree_Hours=("Degree_Hours", "sum")))
+            # Combine the partial results now and then, so they don't pile up
+            if len(partials) >= 20:
+                partials = [combineLoggerTotals(partials, ["SiteCode", "Day"])]
+
+    daily = combineLoggerTotals(partials, ["SiteCode", "Day"]).reset_index()
+    daily["Month"] = daily["Day"].dt.to_period("M").dt.to_timestamp()
+    monthly = combineLoggerTotals([daily.set_index(["SiteCode", "Month"])], ["SiteCode", "Month"]).reset_index()
+
+    # Same Date and textDate fields as the monthly sheet (first day of the month at 12:00, "Jul 2021")
+    month_labels = {number: label for label, number in MONTHS.items()}
+    monthly["Date"] = monthly["Month"] + pd.Timedelta(hours=12)
+    monthly["textDate"] = monthly["Month"].dt.month.map(month_labels) + " " + monthly["Month"].dt.year.astype(str)
+    daily = daily.rename(columns={"Day": "Date"})
+    return finishLoggerTotals(daily, ["SiteCode", "Date"]), finishLoggerTotals(monthly, ["SiteCode", "Date", "textDate"]), skipped
+
+# Add up per-site totals that were calculated separately (e.g. for different chunks of readings)
+def combineLoggerTotals(partials, group_fields):
+    if not partials:
+        # No readings - an empty table with the same types (site codes, dates and numbers)
+        index = pd.MultiIndex.from_arrays([pd.Series([], dtype="string"), pd.Series([], dtype="datetime64[ns]")], names=group_fields)
+        return pd.DataFrame({"Temp_Sum": [], "Readings": pd.Series([], dtype="int64"), "Min_Temp": [], "Max_Temp": [], "Degree_Hours": []}, index=index)
+    totals = pd.concat(partials)
+    return totals.groupby(level=[0, 1]).agg({"Temp_Sum": "sum", "Readings": "sum", "Min_Temp": "min", "Max_Temp": "max", "Degree_Hours": "sum"}).rename_axis(group_fields)
+
+# Turn the totals into the fields of the output table
+def finishLoggerTotals(totals, key_fields):
+    totals = totals.copy()
+    totals["Mean_Temp"] = totals["Temp_Sum"] / totals["Readings"]
+    return totals[key_fields + ["Mean_Temp", "Min_Temp", "Max_Temp", "Readings", "Degree_Hours"]]
+
 # Temperature Monitoring Data Processing
 #  data_names_for_sheet_names is a dictionary where the keys are the names of the .csv files (which are named the same as the sheets in the .xslx files) and the values are the names we assign to the data
 def TempModel(data_names_for_sheet_names):
     print(">> Processing the Temperature Monitoring data...")
     
+    # Content hashes of the sheets and tables from the last run - stored next to the .csv files
+    manifest_path = os.path.join(output_Temp_Table, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
     ##### Extract .csv files from all the .xlsx files #####
-    files_in_xlsx_folder = os.listdir(input_Temp_Table)
+    # Only the sheets listed in data_names_for_sheet_names are read - the other sheets (pivot tables, etc.) are skipped
+    sheet_names = list(data_names_for_sheet_names.keys())
+    if input_logger_folder:
+        # TemperatureMonitoringData is calculated from the logger files instead of its sheet
+        sheet_names = [sheet_name for sheet_name in sheet_names if data_names_for_sheet_names[sheet_name] != "TemperatureMonitoringData"]
+    xlsx_paths = []
+    # sorted() so the files are always processed in the same order
+    files_in_xlsx_folder = sorted(os.listdir(input_Temp_Table))
     print("       Processing the Excel table") 
     for filename in files_in_xlsx_folder:
         # skip anything in the folder that isn't a .xlsx
         if filename.endswith(".xlsx") == False:
             continue  # skips to the next file in the loop
-        xlsx_sheets_to_csv(input_Temp_Table + "/" + filename, output_Temp_Table)
-
-    print("       The .xlsx files have been converted to .csv files.")
+        xlsx_paths.append(input_Temp_Table + "/" + filename)
+    start = time.perf_counter()
+    sheet_report = convert_workbooks(xlsx_paths, output_Temp_Table, workers=ingest_workers, streaming=streaming_ingest, chunk_rows=ingest_chunk_rows, sheet_names=sheet_names, manifest=manifest, force_rebuild=force_rebuild, file_format=intermediate_format)
+    save_manifest(manifest_path, manifest)
+
+    print("       The .xlsx files have been converted to .{} files in {:.2f} s.".format(intermediate_format, time.perf_counter() - start))
+    print_sheet_report(sheet_report)
+    # Hash of the data in each sheet (if two workbooks have a sheet with the same name, the last one wins, like the .csv files)
+    sheet_hashes = {}
+    for entry in sheet_report:
+        if entry["status"] in ("converted", "unchanged"):
+            sheet_hashes[entry["sheet"]] = entry["hash"]
+    # Warn about sheets in data_names_for_sheet_names that were not found in any of the .xlsx files
+    for sheet_name in sheet_names:
+        if sheet_name not in sheet_hashes:
+            print("       WARNING: No sheet named '" + sheet_name + "' was found in " + input_Temp_Table)
     
-    ##### Load all the .csv files into arcpy tables #####
+    ##### Load all the .csv (or .parquet) files into arcpy tables #####
+    # A table is reused if its sheet has not changed since the table was built
+    rebuilt_tables = []
     files_in_data_folder = os.listdir(output_Temp_Table)
     for filename in files_in_data_folder:
         # take the ".csv" off the filename, and then get our name for that sheet's data
         sheet_name = os.path.splitext(filename)[0]
-        # skip anything in the folder that isn't a .csv
-        if (filename.endswith(".csv") == False) or (sheet_name not in list(data_names_for_sheet_names.keys())):
+        # skip anything in the folder that isn't a .csv (or .parquet, depending on intermediate_format)
+        if (is_intermediate_file(filename, intermediate_format) == False) or (sheet_name not in list(data_names_for_sheet_names.keys())):
             continue  # skips to the next file in the loop
         
         out_table_name = data_names_for_sheet_names[sheet_name]
-
-        arcpy.conversion.ExportTable(output_Temp_Table + "/" + filename, out_table_name)  
+        if input_logger_folder and out_table_name == "TemperatureMonitoringData":
+            continue  # calculated from the logger files below
+        if not force_rebuild and table_is_current(manifest, out_table_name, sheet_hashes.get(sheet_name)) and outputExists(out_table_name):
+            print("       Reusing table " + out_table_name + " (the sheet has not changed)")
+            continue
+
+        if out_table_name == "TemperatureMonitoringData":
+            # Add a Date field (and a textDate field) using the Row Labels and Year fields, before the table is written
+            temperature_data = read_intermediate(output_Temp_Table + "/" + filename)
+            temperature_data.columns = [validate_field_name(column) if output_format == "gpkg" else arcpy.ValidateFieldName(str(column), ws) for column in temperature_data.columns]
+            temperature_data, rejects = calcMonthDates(temperature_data)
+            if len(rejects) > 0:
+                rejects_path = os.path.join(output_Temp_Table, out_table_name + "_rejects.csv")
+                rejects.to_csv(rejects_path, index=False, encoding="utf-8")
+                print("       WARNING: " + str(len(rejects)) + " rows have a month or year that can't be read and were not loaded (see " + rejects_path + ")")
+            writeTable(temperature_data, out_table_name)
+        else:
+            loadTable(output_Temp_Table + "/" + filename, out_table_name)
         print("       Created table " + out_table_name)
-
-    #### Add a field for the date and calculate it using the Row Labels and Year Fields 
-    arcpy.management.AddField("TemperatureMonitoringData", "Date", "DATE")
-    arcpy.management.AddField("TemperatureMonitoringData", "textDate", "TEXT")
-
-    expression_coldwater_date = "calcDate(!Row_Labels!, !Year!)"
-    codeblock_coldwater_date = """
-def calcDate(month, year):
-    monthDictionary = {
-        "Jan": "01",
-        "Feb": "02",
-        "Mar": "03",
-        "Apr": "04",
-        "May": "05",
-        "Jun": "06",
-        "Jul": "07",
-        "Aug": "08",
-        "Sep": "09",
-        "Oct": "10",
-        "Nov": "11",
-        "Dec": "12"
-    }
-
-    dateString = str(int(year)) + "/" + monthDictionary[month] + "/01 12:00:00"
-    return dateString
-    """
-
-    expression_coldwater_textDate = "calcDate(!Row_Labels!, !Year!)"
-    codeblock_coldwater_textDate = """
-def calcDate(month, year):
-    dateString = month + " " + str(int(year))
-    return dateString
-"""
-
-    #### Calculate the new date field 
-    arcpy.management.CalculateField("TemperatureMonitoringData", "Date", expression_coldwater_date, code_block = codeblock_coldwater_date)
-    arcpy.management.CalculateField("TemperatureMonitoringData", "textDate", expression_coldwater_textDate, code_block = codeblock_coldwater_textDate)
-
-    #### Delete the unnecessary fields in TemperatureMonitoringData
-    arcpy.management.DeleteField("TemperatureMonitoringData", ["Year","Row_Labels"], "DELETE_FIELDS")
-
+        rebuilt_tables.append(out_table_name)
+
+    # Hash of the data each table is built from
+    table_hashes = {table_name: sheet_hashes.get(sheet_name) for sheet_name, table_name in data_names_for_sheet_names.items()}
+
+    #### Calculate the daily and monthly temperatures from the raw logger files
+    if input_logger_folder:
+        logger_tables = ["TemperatureMonitoringData", "TemperatureMonitoringDailyData"]
+        logger_paths = [os.path.join(input_logger_folder, filename) for filename in sorted(os.listdir(input_logger_folder)) if filename.endswith(".csv")]
+        if len(logger_paths) == 0:
+            raise ValueError("       No logger .csv files found in " + input_logger_folder + " - add the files, or set input_logger_folder = \"\" to use the ColdwaterStreams sheet")
+        logger_hash = combine_hashes(*[hash_file(path) for path in logger_paths], logger_fields, logger_interval_minutes, degree_hour_base)
+        for table_name in logger_tables:
+            table_hashes[table_name] = logger_hash
+        if not force_rebuild and all(table_is_current(manifest, table_name, logger_hash) and outputExists(table_name) for table_name in logger_tables):
+            print("       Reusing the logger tables (the logger files have not changed)")
+        else:
+            start = time.perf_counter()
+            daily, monthly, skipped = aggregateLoggerFiles(logger_paths)
+            writeTable(monthly, "TemperatureMonitoringData")
+            writeTable(daily, "TemperatureMonitoringDailyData")
+            rebuilt_tables += logger_tables
+            print("       Created tables TemperatureMonitoringData and TemperatureMonitoringDailyData from {} logger files in {:.2f} s.".format(len(logger_paths), time.perf_counter() - start))
+            if skipped:
+                print("       WARNING: " + str(skipped) + " readings have no site, time or temperature and were not used")
+
+    #### Match the site codes of the data to the site codes of the points (see sitecodes.py)
+    if "TemperatureMonitoringData" in rebuilt_tables or "TemperatureMonitoringXYData" in rebuilt_tables:
+        report_path = os.path.join(output_Temp_Table, "SiteCode_report.csv")
+        if output_format == "gpkg":
+            # The data table is read back from the GeoPackage, matched and written again
+            temperature_data = read_gpkg_table(gpkg_path, "TemperatureMonitoringData")
+            reconcile_dataframe_site_codes(temperature_data, "SiteCode", read_gpkg_table(gpkg_path, "TemperatureMonitoringXYData"), "SiteCode", report_path, fuzzy=site_code_fuzzy_matching, min_similarity=site_code_min_similarity)
+            writeTable(temperature_data, "TemperatureMonitoringData")
+        else:
+            reconcile_table_site_codes("TemperatureMonitoringData", "SiteCode", "TemperatureMonitoringXYData", "SiteCode", report_path, fuzzy=site_code_fuzzy_matching, min_similarity=site_code_min_similarity)
 
     #### Create the Point Class
-    arcpy.management.XYTableToPoint("TemperatureMonitoringXYData", "TemperatureMonitoringPoints", "Easting", "Northing", coordinate_system="NAD 1983 UTM Zone 17N")
-    print("       The feature class TemperatureMonitoringPoints has been updated.")
-
-
-    #### Create a Relationship Class 
-    # Parameters: arcpy.management.CreateRelationshipClass(point_table, data_table, name_of_relationshipClass, "Composite", data_table_name, points_name, "FORWARD", "ONE_TO_MANY", "NONE", "the_common_field_SiteCode", "the_common_field")
-    arcpy.management.CreateRelationshipClass("TemperatureMonitoringPoints", "TemperatureMonitoringData", "TemperatureMonitoringPoints_TemperatureMonitoringData", "Composite", "TemperatureMonitoringData", "TemperatureMonitoringPoints", "FORWARD", "ONE_TO_MANY", "NONE", "SiteCode", "SiteCode")
-
-    print("       The relationship class has been updated.")
-
+    if "TemperatureMonitoringXYData" in rebuilt_tables or not outputExists("TemperatureMonitoringPoints"):
+        if output_format == "gpkg":
+            # Stored in coordsys, like the points XYTableToPoint writes with the outputCoordinateSystem of the EnvManager below
+            xy_to_points_file(read_gpkg_table(gpkg_path, "TemperatureMonitoringXYData"), gpkg_path, "Easting", "Northing", coordsys, layer="TemperatureMonitoringPoints")
+        else:
+            arcpy.management.XYTableToPoint("TemperatureMonitoringXYData", "TemperatureMonitoringPoints", "Easting", "Northing", coordinate_system="NAD 1983 UTM Zone 17N")
+        print("       The feature class TemperatureMonitoringPoints has been updated.")
+    else:
+        print("       The feature class TemperatureMonitoringPoints has not changed.")
+
+
+    #### Create a Relationship Class (geodatabase only - in a GeoPackage the tables are joined on SiteCode when they are used)
+    relationship_class = "TemperatureMonitoringPoints_TemperatureMonitoringData"
+    if output_format == "gdb" and (rebuilt_tables or not arcpy.Exists(relationship_class)):
+        # Parameters: arcpy.management.CreateRelationshipClass(point_table, data_table, name_of_relationshipClass, "Composite", data_table_name, points_name, "FORWARD", "ONE_TO_MANY", "NONE", "the_common_field_SiteCode", "the_common_field")
+        arcpy.management.CreateRelationshipClass("TemperatureMonitoringPoints", "TemperatureMonitoringData", "TemperatureMonitoringPoints_TemperatureMonitoringData", "Composite", "TemperatureMonitoringData", "TemperatureMonitoringPoints", "FORWARD", "ONE_TO_MANY", "NONE", "SiteCode", "SiteCode")
+
+        print("       The relationship class has been updated.")
+
+    # Remember which data the tables were built from, so they can be reused on the next run
+    for table_name in rebuilt_tables:
+        record_table(manifest, table_name, table_hashes.get(table_name))
+    save_manifest(manifest_path, manifest)
+
+
+# Process the data and add it to the map (everything before the upload) - also used by publish_all.py
+def ProcessData():
+    TempModel(data_names_for_sheet_names)
+    if output_format == "gpkg":
+        return
+    if input_logger_folder:
+        GDBToMap(["TemperatureMonitoringPoints"], ["TemperatureMonitoringData", "TemperatureMonitoringDailyData"])
+    else:
+        GDBToMap(["TemperatureMonitoringPoints"], ["TemperatureMonitoringData"])
 
 if __name__ == '__main__':
-    # Global Environment settings
-    with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
-        TempModel(data_names_for_sheet_names)
-        GDBToMap(["TemperatureMonitoringPoints"], ["TemperatureMonitoringData"])
-        AGOLUpload(service_name)
+    if output_format == "gpkg":
+        ProcessData()
+        print(">> Wrote the layers and tables to " + gpkg_path)
+    else:
+        # Global Environment settings
+        with arcpy.EnvManager(outputCoordinateSystem = coordsys, scratchWorkspace = ws, workspace = ws):
+            ProcessData()
+            AGOLUpload()
@@ -0,0 +1,276 @@
+# Date last updated: October 18, 2026
+
+# Purpose:
+# Uploads a service definition (.sd) to ArcGIS Online in parts, instead of in one request
+# (arcpy.server.UploadServiceDefinition), and publishes it. It is meant for slow or unreliable connections:
+#   - the file is sent in parts of 'chunk_mb' (multipart upload), so a failure only sends one part again
+#   - a request that fails because of the connection or a busy server is retried, waiting longer every time
+#     (exponential backoff, with a random part - "jitter" - so several uploads don't all retry at the same moment)
+#   - the parts that were uploaded are saved to a progress file next to the .sd file, so running the script again
+#     continues the upload where it stopped (as long as the .sd file has not changed)
+#   from uploads import upload_service_definition
+#   upload_service_definition(portal_url, sd_output_filename, service_name, token, foldername, everyone=True)
+# update_item() changes the properties of an item and add_attachments() uploads photos to the features of a layer.
+# request_json() and with_retries() are also used for the edits sent by delta.py. The requests go through the shared
+# session of portal.py (kept-alive connections, cached token, limited number of requests at the same time).
+# Only the Python standard library is used (no arcpy), so the uploads can be tried against a local test server.
+# Documentation:
+# https://developers.arcgis.com/rest/users-groups-and-items/add-item/
+# https://developers.arcgis.com/rest/users-groups-and-items/add-part/
+# https://developers.arcgis.com/rest/users-groups-and-items/commit/
+# https://developers.arcgis.com/rest/users-groups-and-items/publish-item/
+
+import json, os, random, re, time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .portal import TransientError, get_session      # imported as deliverables.uploads
+except ImportError:
+    from portal import TransientError, get_session
+
+# Size of each part of the file (MB)
+DEFAULT_CHUNK_MB = 8
+# Number of times a failed request is sent again
+DEFAULT_RETRIES = 5
+# Seconds to wait before the first retry - doubled for every retry, up to MAX_RETRY_DELAY
+BASE_RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 120.0
+# Seconds between two checks of a job (commit, publish)
+STATUS_INTERVAL = 5
+# Seconds to wait for a job before giving up
+DEFAULT_JOB_TIMEOUT = 3600
+# Maximum number of threads that read and send photos at the same time (the shared session limits the requests themselves)
+MAX_ATTACHMENT_WORKERS = 16
+# Extension of the progress file (next to the .sd file)
+PROGRESS_SUFFIX = ".upload.json"
+
+
+#############################################
+#####        REQUESTS AND RETRIES       #####
+#############################################
+
+# Send a request to the ArcGIS REST API and return the JSON answer, through the shared session (see portal.py)
+#   token >> a token to use instead of the session's token
+#   files >> {field: (file name, bytes)} to send the request as multipart/form-data (e.g. a part of a file)
+#   idempotent=False >> for requests that must not run twice (e.g. addItem) - see PortalSession.request_json
+# An {"error": ...} answer raises a RuntimeError (a TransientError if the request can be sent again)
+def request_json(url, params, token=None, timeout=None, files=None, idempotent=True):
+    return get_session().request_json(url, params, token, timeout, files, idempotent)
+
+
+# Call send() until it works, at most 'retries' more times, for TransientErrors only
+# The wait before retry n is a random time between 0 and base_delay x 2^n seconds (at most max_delay) - "full jitter"
+# (None = BASE_RETRY_DELAY and MAX_RETRY_DELAY)
+def with_retries(send, retries=DEFAULT_RETRIES, base_delay=None, max_delay=None):
+    base_delay = BASE_RETRY_DELAY if base_delay is None else base_delay
+    max_delay = MAX_RETRY_DELAY if max_delay is None else max_delay
+    for attempt in range(retries + 1):
+        try:
+            return send()
+        except TransientError as e:
+            if attempt == retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print("\t\t" + str(e) + " - trying again in {:.1f} s ({} of {})".format(delay, attempt + 1, retries))
+            time.sleep(delay)
+
+
+#############################################
+#####         RESUMABLE UPLOAD          #####
+#############################################
+
+# Upload a .sd file to the portal, publish it (overwriting the feature layer if it was already published)
+# and share the service
+#   portal_url >> e.g. "https://www.arcgis.com" (arcpy.GetActivePortalURL())
+#   folder >> name of a folder of the user ("" = the root folder)
+#   create_folder >> create the folder if the user does not have it yet (folder type "New" of UploadServiceDefinition),
+#                    otherwise a missing folder raises a RuntimeError
+#   everyone/org >> share with everyone/the organization, groups >> group name or list of group names
+#   job_timeout >> seconds to wait for the portal to put the parts together and to publish the service
+# Returns the item id of the feature layer
+def upload_service_definition(portal_url, sd_path, service_name, token, folder="", everyone=False, org=False, groups=None,
+                              chunk_mb=DEFAULT_CHUNK_MB, retries=DEFAULT_RETRIES, job_timeout=DEFAULT_JOB_TIMEOUT, create_folder=False):
+    rest_url = portal_url.rstrip("/") + "/sharing/rest"
+    user = with_retries(lambda: request_json(rest_url + "/community/self", {}, token), retries)
+    user_url = rest_url + "/content/users/" + user["username"]
+    sd_item_id = find_item(rest_url, token, service_name, "Service Definition", user["username"], retries)
+    published = find_item(rest_url, token, service_name, "Feature Service", user["username"], retries) is not None
+    item_id = upload_item(user_url, sd_path, service_name, "Service Definition", token, sd_item_id,
+                          folder_id(user_url, token, folder, retries, create_folder), chunk_mb, retries, job_timeout)
+    service_item_id = publish_item(user_url, item_id, service_name, token, overwrite=published, retries=retries, job_timeout=job_timeout)
+    share_item(user_url, service_item_id, token, everyone, org, group_ids(user, groups), retries)
+    return service_item_id
+
+
+# Update the properties of an item, e.g. update_item(user_url, item_id, {"snippet": mysummary, "tags": mytags})
+# Documentation: https://developers.arcgis.com/rest/users-groups-and-items/update-item/
+def update_item(user_url, item_id, properties, token=None, retries=DEFAULT_RETRIES):
+    return with_retries(lambda: request_json(user_url + "/items/" + item_id + "/update", properties, token), retries)
+
+
+# Upload a file as a new item (or as the new data of the item 'item_id') in parts of 'chunk_mb'
+# The progress is saved in <file>.upload.json after every part: running it again with the same file
+# only sends the parts that are missing. The progress file is deleted once the item is complete.
+# Returns the item id
+def upload_item(user_url, path, title, item_type, token, item_id=None, folder=None, chunk_mb=DEFAULT_CHUNK_MB, retries=DEFAULT_RETRIES,
+                job_timeout=DEFAULT_JOB_TIMEOUT):
+    chunk_bytes = int(chunk_mb * 1024 * 1024)
+    progress_path = path + PROGRESS_SUFFIX
+    file_id = {"size": os.path.getsize(path), "modified": os.path.getmtime(path), "chunk_bytes": chunk_bytes}
+    progress = load_progress(progress_path)
+    if progress.get("file") != file_id or (item_id is not None and progress.get("item_id") != item_id):
+        progress = {"file": file_id, "item_id": None, "parts": []}
+
+    # Start the upload (a new item, or new data for the existing item)
+    if progress["item_id"] is None:
+        params = {"multipart": "true", "filename": os.path.basename(path), "type": item_type, "title": title}
+        if item_id is None:
+            add_url = user_url + ("/" + folder if folder else "") + "/addItem"
+            progress["item_id"] = with_retries(lambda: request_json(add_url, params, token, idempotent=False), retries)["id"]
+        else:
+            update_item(user_url, item_id, params, token, retries)
+            progress["item_id"] = item_id
+        save_progress(progress_path, progress)
+    else:
+        print("\t\tContinuing the upload of " + os.path.basename(path) + " (" + str(len(progress["parts"])) + " parts already uploaded)")
+    item_url = user_url + "/items/" + progress["item_id"]
+
+    # Send the parts that are missing (part numbers start at 1)
+    parts = max(1, -(-file_id["size"] // chunk_bytes))
+    with open(path, "rb") as f:
+        for part in range(1, parts + 1):
+            if part in progress["parts"]:
+                continue
+            f.seek((part - 1) * chunk_bytes)
+            data = f.read(chunk_bytes)
+            with_retries(lambda: request_json(item_url + "/addPart", {"partNum": part}, token, files={"file": (os.path.basename(path), data)}), retries)
+            progress["parts"].append(part)
+            save_progress(progress_path, progress)
+            print("\t\tUploaded part {} of {}".format(part, parts))
+
+    # Put the parts together
+    with_retries(lambda: request_json(item_url + "/commit", {"type": item_type, "title": title}, token), retries)
+    wait_for_job(item_url + "/status", {}, token, retries, job_timeout)
+    os.remove(progress_path)
+    return progress["item_id"]
+
+
+# Name of the service in its url: every non-word character becomes an underscore, like the sharing draft does
+# (e.g. "Kawartha Conservation PWQMN Data" >> "Kawartha_Conservation_PWQMN_Data"); the item keeps the name as its title
+def service_url_name(service_name):
+    return re.sub(r"\W", "_", service_name)
+
+
+# Publish a .sd item as a hosted feature layer and wait until it is done
+# Returns the item id of the feature layer
+def publish_item(user_url, item_id, service_name, token, overwrite=False, retries=DEFAULT_RETRIES, job_timeout=DEFAULT_JOB_TIMEOUT):
+    params = {"itemID": item_id, "filetype": "serviceDefinition", "overwrite": "true" if overwrite else "false",
+              "publishParameters": json.dumps({"name": service_url_name(service_name)})}
+    result = with_retries(lambda: request_json(user_url + "/publish", params, token, idempotent=False), retries)
+    service = result["services"][0]
+    if "error" in service or not service.get("serviceItemId"):
+        raise RuntimeError("Publishing " + service_name + " failed: " + str(service.get("error")))
+    wait_for_job(user_url + "/items/" + service["serviceItemId"] + "/status", {"jobId": service.get("jobId"), "jobType": "publish"}, token, retries, job_timeout)
+    return service["serviceItemId"]
+
+
+# Share an item with everyone, the organization and/or groups (by id)
+def share_item(user_url, item_id, token, everyone=False, org=False, groups=None, retries=DEFAULT_RETRIES):
+    params = {"items": item_id, "everyone": "true" if everyone else "false", "org": "true" if org or everyone else "false",
+              "groups": ",".join(groups or [])}
+    with_retries(lambda: request_json(user_url + "/shareItems", params, token), retries)
+
+
+# Check the status of a job until it is completed
+# Raises a RuntimeError if it failed, or if it is not completed after 'timeout' seconds (e.g. a job that stays
+# "processing", or a status that is not known)
+def wait_for_job(status_url, params, token, retries=DEFAULT_RETRIES, timeout=DEFAULT_JOB_TIMEOUT, interval=STATUS_INTERVAL):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = with_retries(lambda: request_json(status_url, params, token), retries)
+        if status.get("status") == "completed":
+            return status
+        if status.get("status") == "failed":
+            raise RuntimeError(status_url + ": " + str(status.get("statusMessage")))
+        if time.monotonic() + interval > deadline:
+            raise RuntimeError(status_url + ": the job is still '" + str(status.get("status")) + "' after " + str(timeout) + " s")
+        time.sleep(interval)
+
+
+# Item id of the user's item with this title and type (None if there is none)
+def find_item(rest_url, token, title, item_type, username, retries=DEFAULT_RETRIES):
+    query = 'title:"' + title + '" AND type:"' + item_type + '" AND owner:' + username
+    results = with_retries(lambda: request_json(rest_url + "/search", {"q": query, "num": 100}, token), retries)["results"]
+    matches = [item["id"] for item in results if item.get("title") == title and item.get("type") == item_type]
+    return matches[0] if matches else None
+
+
+# Id of the user's folder with this name ("" = the root folder)
+#   create >> create the folder if it does not exist yet (otherwise a missing folder raises a RuntimeError)
+# Documentation: https://developers.arcgis.com/rest/users-groups-and-items/create-folder/
+def folder_id(user_url, token, folder, retries=DEFAULT_RETRIES, create=False):
+    if not folder:
+        return None
+    folders = with_retries(lambda: request_json(user_url, {}, token), retries).get("folders", [])
+    ids = [entry["id"] for entry in folders if entry.get("title") == folder]
+    if ids:
+        return ids[0]
+    if not create:
+        raise RuntimeError("The folder '" + folder + "' was not found in ArcGIS Online")
+    print("\t\tCreating the folder '" + folder + "'")
+    return with_retries(lambda: request_json(user_url + "/createFolder", {"title": folder}, token, idempotent=False), retries)["folder"]["id"]
+
+
+# Ids of the user's groups with these names
+def group_ids(user, groups):
+    if not groups:
+        return []
+    names = [groups] if isinstance(groups, str) else list(groups)
+    ids = {group.get("title"): group.get("id") for group in user.get("groups", [])}
+    missing = [name for name in names if name not in ids]
+    if missing:
+        raise RuntimeError("Groups not found in ArcGIS Online: " + ", ".join(missing))
+    return [ids[name] for name in names]
+
+
+def load_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return {}
+    with open(progress_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Write the progress to a temporary file first, so a crash can't leave a half-written progress file
+def save_progress(progress_path, progress):
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f, indent=2)
+    os.replace(tmp_path, progress_path)
+
+
+#############################################
+#####            ATTACHMENTS            #####
+#############################################
+
+# Upload photos as attachments of the features of a layer (the layer must have attachments enabled)
+#   layer_url   >> e.g. "https://services.arcgis.com/.../FeatureServer/0"
+#   attachments >> {object id: path of the photo}
+# The photos are sent by several threads; the shared session (portal.py) lets at most max_in_flight of their requests
+# run at the same time and makes the others wait. An attachment is not sent again after an answer that may come
+# after it was added (it would be added twice).
+# Returns {object id: attachment id}
+# Documentation: https://developers.arcgis.com/rest/services-reference/enterprise/add-attachment/
+def add_attachments(layer_url, attachments, token=None, retries=DEFAULT_RETRIES):
+    def add_attachment(object_id, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        url = layer_url.rstrip("/") + "/" + str(object_id) + "/addAttachment"
+        result = with_retries(lambda: request_json(url, {}, token, files={"attachment": (os.path.basename(path), data)}, idempotent=False), retries)
+        if not result.get("addAttachmentResult", {}).get("success"):
+            raise RuntimeError(url + ": " + str(result.get("addAttachmentResult", {}).get("error")))
+        return result["addAttachmentResult"]["objectId"]
+
+    if not attachments:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(attachments), MAX_ATTACHMENT_WORKERS)) as pool:
+        futures = {object_id: pool.submit(add_attachment, object_id, path) for object_id, path in attachments.items()}
+        return {object_id: future.result() for object_id, future in futures.items()}
@@ -0,0 +1,75 @@
+# Shared set-up for the tests
+#   The helper modules are imported the same way the scripts at the top of the repository import them:
+#       from deliverables.ingest import ...
+#   The deliverable scripts (pwqmn.py, ...) can't be imported without ArcGIS Pro, because they open the .aprx file
+#   when they are loaded - load_functions() reads only the functions and inputs a test needs from them,
+#   and run_script() runs a copy of a script with other inputs (e.g. output_format = "gpkg", which does not need arcpy).
+# Run the tests from the top of the repository with:  python -m pytest tests
+
+import ast, os, subprocess, sys
+import pytest
+from openpyxl import Workbook
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+# The functions 'function_names' and the plain-value inputs 'setting_names' of a script (e.g. "deliverables/pwqmn.py"),
+# without running the rest of the script. 'namespace' holds the modules the functions use, e.g. {"pd": pandas}.
+# Returns a dictionary {name: function or value}
+def load_functions(script, function_names, setting_names=(), namespace=None):
+    with open(os.path.join(ROOT, script), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    namespace = dict(namespace or {})
+    nodes = []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in function_names:
+            nodes.append(node)
+        elif isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id in setting_names for target in node.targets):
+            nodes.append(node)
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), script, "exec"), namespace)
+    missing = [name for name in list(function_names) + list(setting_names) if name not in namespace]
+    if missing:
+        raise LookupError(script + " has no " + ", ".join(missing))
+    return namespace
+
+
+# Run a copy of a script (e.g. "deliverables/pwqmn.py") with some of its inputs changed, in a new Python process
+#   settings >> {input name: value}, e.g. {"output_format": "gpkg"} - every input must be in the script
+# The copy is written to 'folder' and runs from there; the helper modules are found in the script's own folder
+# Returns the output of the script (raises CalledProcessError if it fails)
+def run_script(script, settings, folder):
+    with open(os.path.join(ROOT, script), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    with open(os.path.join(ROOT, script), encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) and node.targets[0].id in settings:
+            name = node.targets[0].id
+            lines[node.lineno - 1:node.end_lineno] = [name + " = " + repr(settings[name])] + [""] * (node.end_lineno - node.lineno)
+    missing = set(settings) - {node.targets[0].id for node in tree.body if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)}
+    if missing:
+        raise LookupError(script + " has no " + ", ".join(sorted(missing)))
+    copy = os.path.join(folder, os.path.basename(script))
+    with open(copy, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, os.path.dirname(script)), ROOT]))
+    return subprocess.run([sys.executable, copy], cwd=folder, env=env, capture_output=True, text=True, check=True).stdout
+
+
+# Write a .xlsx workbook: sheets >> {sheet name: list of rows (the first row is the header)}
+def write_workbook(path, sheets):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for sheet_name, rows in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        for row in rows:
+            ws.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    return lambda name, sheets: write_workbook(tmp_path / name, sheets)
@@ -0,0 +1,105 @@
+# A small stand-in for an ArcGIS Online feature service, for the tests of deliverables/delta.py
+# It answers the requests delta.py sends (service and layer descriptions, query with paging, applyEdits)
+# and keeps the features in memory:
+#   with MockFeatureServer(layers=["Stations"], tables=["Data"]) as server:
+#       publish_changes(server.url, ...)
+#       server.features("Data"), server.edits
+# Only the Python standard library is used (http.server).
+
+import json, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockFeatureServer:
+    def __init__(self, layers=(), tables=(), max_record_count=2, oid_field="OBJECTID"):
+        self.max_record_count = max_record_count
+        self.oid_field = oid_field
+        self.layers = [{"id": number, "name": name, "table": number >= len(layers), "features": {}}
+                       for number, name in enumerate(list(layers) + list(tables))]
+        self.next_oid = 1
+        self.edits = []     # (layer name, "adds"/"updates"/"deletes", number of features) of every applyEdits request
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = "http://127.0.0.1:{}/arcgis/rest/services/Test/FeatureServer".format(self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # The attributes (and geometry) of the features of a layer, in object id order
+    def features(self, name):
+        layer = self.layer(name)
+        return [layer["features"][oid] for oid in sorted(layer["features"])]
+
+    def layer(self, name):
+        return next(layer for layer in self.layers if layer["name"] == name)
+
+    # Answer one request: 'parts' is the path after FeatureServer, e.g. ["0", "query"]
+    def answer(self, parts, params):
+        if not parts:
+            return {"layers": [{"id": layer["id"], "name": layer["name"]} for layer in self.layers if not layer["table"]],
+                    "tables": [{"id": layer["id"], "name": layer["name"]} for layer in self.layers if layer["table"]]}
+        layer = self.layers[int(parts[0])]
+        if len(parts) == 1:
+            return {"id": layer["id"], "name": layer["name"], "objectIdField": self.oid_field, "maxRecordCount": self.max_record_count}
+        if parts[1] == "query":
+            features = [layer["features"][oid] for oid in sorted(layer["features"])]
+            offset, count = int(params.get("resultOffset", 0)), int(params.get("resultRecordCount", self.max_record_count))
+            return {"features": features[offset:offset + count], "exceededTransferLimit": offset + count < len(features)}
+        if parts[1] == "applyEdits":
+            return self.apply_edits(layer, params)
+        return {"error": {"code": 400, "message": "Unknown request " + "/".join(parts)}}
+
+    def apply_edits(self, layer, params):
+        result = {}
+        if params.get("deletes"):
+            oids = [int(oid) for oid in params["deletes"].split(",")]
+            self.edits.append((layer["name"], "deletes", len(oids)))
+            result["deleteResults"] = [{"objectId": oid, "success": layer["features"].pop(oid, None) is not None} for oid in oids]
+        if "updates" in params:
+            features = json.loads(params["updates"])
+            self.edits.append((layer["name"], "updates", len(features)))
+            result["updateResults"] = []
+            for feature in features:
+                oid = feature["attributes"][self.oid_field]
+                success = oid in layer["features"]
+                if success:
+                    layer["features"][oid] = feature
+                result["updateResults"].append({"objectId": oid, "success": success})
+        if "adds" in params:
+            features = json.loads(params["adds"])
+            self.edits.append((layer["name"], "adds", len(features)))
+            result["addResults"] = []
+            for feature in features:
+                oid, self.next_oid = self.next_oid, self.next_oid + 1
+                feature["attributes"][self.oid_field] = oid
+                layer["features"][oid] = feature
+                result["addResults"].append({"objectId": oid, "success": True})
+        return result
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                params = dict(urllib.parse.parse_qsl(body))
+                path = urllib.parse.urlsplit(self.path).path
+                parts = path.split("/FeatureServer", 1)[1].strip("/")
+                with mock.lock:
+                    answer = mock.answer(parts.split("/") if parts else [], params)
+                data = json.dumps(answer).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,149 @@
+# A small stand-in for the ArcGIS Online sharing API, for the tests of deliverables/uploads.py
+# It answers the requests of upload_service_definition (self, search, folders, addItem/update, addPart, commit,
+# publish, status, shareItems, createFolder) and of add_attachments (<layer>/<object id>/addAttachment),
+# keeps the uploaded parts and attachments in memory and can inject failures:
+#   with MockPortal() as portal:
+#       portal.fail("/addPart", status=503)       # the next addPart request answers "503 Service Unavailable"
+#       portal.fail("/addPart", error=400)        # the next addPart request answers {"error": {"code": 400}}
+#       upload_service_definition(portal.url, ...)
+#       portal.item_data(item_id), portal.calls, portal.attachments
+# Every answer can be held back for 'delay' seconds; 'peak' is the most requests that were answered at the same time.
+# Only the Python standard library is used (http.server).
+
+import json, re, threading, time, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockPortal:
+    def __init__(self, username="me", folders=None, groups=None):
+        self.username = username
+        self.folders = dict(folders or {})      # title >> id
+        self.groups = dict(groups or {})        # title >> id
+        self.items = {}                         # id >> {"title", "type", "parts": {part number: bytes}, "folder", "shared"} (+ "properties" once updated)
+        self.attachments = {}                   # (layer path, object id) >> [(file name, bytes)]
+        self.job_status = "completed"           # status answered by every /status request
+        self.calls = []                         # path of every request (after /sharing/rest)
+        self.failures = []                      # [path ending, HTTP status or None, ArcGIS error code or None]
+        self.delay = 0.0
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Make the next request whose path ends with 'path_ending' fail, with an HTTP status or an {"error": ...} answer
+    def fail(self, path_ending, status=None, error=None):
+        self.failures.append([path_ending, status, error])
+
+    # The file uploaded to an item (its parts put together in order)
+    def item_data(self, item_id):
+        parts = self.items[item_id]["parts"]
+        return b"".join(parts[number] for number in sorted(parts))
+
+    def count(self, path_ending):
+        return sum(1 for path in self.calls if path.endswith(path_ending))
+
+    # Answer one request - returns (HTTP status, JSON answer)
+    def answer(self, path, fields):
+        self.calls.append(path)
+        for failure in self.failures:
+            if path.endswith(failure[0]):
+                self.failures.remove(failure)
+                if failure[1]:
+                    return failure[1], None
+                return 200, {"error": {"code": failure[2], "message": "Injected failure", "details": []}}
+
+        match = re.match(r"(.*/FeatureServer/\d+)/(\d+)/addAttachment$", path)
+        if match:
+            attachments = self.attachments.setdefault((match.group(1), int(match.group(2))), [])
+            attachments.append((fields["attachment_name"], fields["attachment"]))
+            return 200, {"addAttachmentResult": {"objectId": len(attachments), "success": True}}
+
+        user_path = "/content/users/" + self.username
+        if path == "/community/self":
+            return 200, {"username": self.username, "groups": [{"id": id, "title": title} for title, id in self.groups.items()]}
+        if path == "/search":
+            return 200, {"results": [{"id": id, "title": item["title"], "type": item["type"]} for id, item in self.items.items()]}
+        if path == user_path:
+            return 200, {"folders": [{"id": id, "title": title} for title, id in self.folders.items()]}
+        if path == user_path + "/createFolder":
+            self.folders[fields["title"]] = "folder" + str(len(self.folders) + 1)
+            return 200, {"success": True, "folder": {"id": self.folders[fields["title"]], "title": fields["title"]}}
+        if path.endswith("/addItem"):
+            item_id = "item" + str(len(self.items) + 1)
+            folder = path[len(user_path):-len("/addItem")].strip("/") or None
+            self.items[item_id] = {"title": fields["title"], "type": fields["type"], "parts": {}, "folder": folder, "shared": None}
+            return 200, {"success": True, "id": item_id}
+        if path == user_path + "/publish":
+            item = self.items[fields["itemID"]]
+            service_id = "service" + str(len(self.items) + 1)
+            self.items[service_id] = {"title": item["title"], "type": "Feature Service", "parts": {}, "folder": item["folder"], "shared": None,
+                                      "name": json.loads(fields["publishParameters"])["name"]}
+            return 200, {"services": [{"serviceItemId": service_id, "jobId": "job1"}]}
+        if path == user_path + "/shareItems":
+            self.items[fields["items"]]["shared"] = {name: fields[name] for name in ("everyone", "org", "groups")}
+            return 200, {"results": [{"itemId": fields["items"], "success": True}]}
+        match = re.match(re.escape(user_path) + r"/items/([^/]+)/(\w+)$", path)
+        if match:
+            item_id, action = match.groups()
+            if action == "addPart":
+                self.items[item_id]["parts"][int(fields["partNum"])] = fields["file"]
+            elif action == "update":
+                self.items[item_id].setdefault("properties", {}).update(fields)
+                if fields.get("multipart") == "true":
+                    self.items[item_id]["parts"] = {}
+            elif action == "status":
+                return 200, {"status": self.job_status, "statusMessage": ""}
+            return 200, {"success": True, "id": item_id}
+        return 404, None
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = urllib.parse.urlsplit(self.path).path.split("/sharing/rest", 1)[-1]
+                with mock.lock:
+                    mock.in_flight += 1
+                    mock.peak = max(mock.peak, mock.in_flight)
+                time.sleep(mock.delay)
+                with mock.lock:
+                    mock.in_flight -= 1
+                    status, answer = mock.answer(path, read_fields(self.headers.get("Content-Type", ""), body))
+                data = json.dumps(answer).encode("utf-8") if answer is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+# Fields of a form or multipart/form-data request (file fields are kept as bytes)
+def read_fields(content_type, body):
+    if not content_type.startswith("multipart/form-data"):
+        return dict(urllib.parse.parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+    boundary = content_type.split("boundary=", 1)[1].encode("utf-8")
+    fields = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, data = part[2:].split(b"\r\n\r\n", 1)
+        data = data[:-2]
+        name = re.search(rb'name="([^"]*)"', head).group(1).decode("utf-8")
+        filename = re.search(rb'filename="([^"]*)"', head)
+        fields[name] = data if filename else data.decode("utf-8")
+        if filename:
+            fields[name + "_name"] = filename.group(1).decode("utf-8")
+    return fields
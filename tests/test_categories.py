@@ -0,0 +1,79 @@
+# Tests for deliverables/categories.py (category tables, categorize and the Arcade expressions)
+
+import numpy as np
+import pandas as pd
+import pytest
+from deliverables.categories import FBI_CATEGORIES, SENSITIVE_ORGANISMS_CATEGORIES, arcade_category_expression, categorize
+
+
+# Category an Arcade expression from arcade_category_expression returns for a value
+# (the expression only uses if/else, comparisons and &&, so it can be run as Python)
+def run_arcade(expression, value):
+    code = expression.replace("IsEmpty($feature.Score)", repr(value is None)).replace("$feature.Score", repr(value)).replace("&&", "and").replace("null", "None").replace("true", "True")
+    code = code.replace("} else if (", "\nelif ").replace("} else {", "\nelse:").replace("if (", "if ").replace(") {return ", ": return ").replace("}", "")
+    namespace = {}
+    exec("def category():\n" + "\n".join("    " + line for line in code.split("\n")), namespace)
+    return namespace["category"]()
+
+
+#############################################
+#####            CATEGORIZE             #####
+#############################################
+
+def test_fbi_categories():
+    values = [0, 0.5, 3.75, 3.76, 4.25, 5, 5.75, 6.5, 7.25, 10]
+    assert categorize(values, **FBI_CATEGORIES).tolist() == ["Excellent", "Excellent", "Excellent", "Very Good", "Very Good", "Good", "Fair", "Fairly Poor", "Poor", "Very Poor"]
+
+
+def test_fbi_values_outside_the_categories():
+    # Negative values, values above 10, text and empty values get the 'missing' value
+    values = pd.Series([-1, -0.01, 10.5, "N/A", None, "4.5"])
+    assert categorize(values, **FBI_CATEGORIES).tolist() == ["N/A", "N/A", "N/A", "N/A", "N/A", "Good"]
+
+
+def test_sensitive_organisms_categories():
+    values = [0, 5, 20.9, 21, 100, np.nan]
+    assert categorize(values, **SENSITIVE_ORGANISMS_CATEGORIES).tolist() == [None, "Below Average", "Average", "Above Average", "Above Average", None]
+
+
+def test_categorize_keeps_the_index():
+    values = pd.Series([4, 8], index=[10, 20])
+    assert categorize(values, **FBI_CATEGORIES).index.tolist() == [10, 20]
+
+
+def test_invalid_category_tables():
+    with pytest.raises(ValueError):
+        categorize([1], breakpoints=[1, 2], labels=["A"])
+    with pytest.raises(ValueError):
+        categorize([1], breakpoints=[2, 1], labels=["A", "B"])
+
+
+#############################################
+#####         ARCADE EXPRESSIONS        #####
+#############################################
+
+@pytest.mark.parametrize("category_table", [FBI_CATEGORIES, SENSITIVE_ORGANISMS_CATEGORIES])
+def test_arcade_expression_matches_categorize(category_table):
+    values = [None, -5, 0, 0.5, 3.75, 4, 5.75, 7.3, 10, 10.5, 20.9, 21, 100]
+    expression = arcade_category_expression("Score", **{**category_table, "missing": None})
+    expected = categorize(values, **{**category_table, "missing": None}).tolist()
+    assert [run_arcade(expression, value) for value in values] == expected
+
+
+def test_fbi_arcade_expression_checks_empty_values_first():
+    # Arcade reads an empty value as 0, which is 'Excellent', so empty values are checked before the limits
+    expression = arcade_category_expression("FamilyBioticIndex_Value", **{**FBI_CATEGORIES, "missing": None})
+    assert expression.startswith('if (IsEmpty($feature.FamilyBioticIndex_Value)) {return null} else '
+                                 'if ($feature.FamilyBioticIndex_Value >= 0 && $feature.FamilyBioticIndex_Value <= 3.75) {return "Excellent"} else '
+                                 'if ($feature.FamilyBioticIndex_Value > 3.75 && $feature.FamilyBioticIndex_Value <= 4.25)')
+    assert expression.endswith('else {return null}')
+    assert run_arcade(expression.replace("FamilyBioticIndex_Value", "Score"), 0) == "Excellent"
+    assert run_arcade(expression.replace("FamilyBioticIndex_Value", "Score"), None) is None
+
+
+def test_arcade_expression_checks_exact_values_first():
+    expression = arcade_category_expression("Sensitive_Organisms_", **SENSITIVE_ORGANISMS_CATEGORIES)
+    assert expression.startswith('if (IsEmpty($feature.Sensitive_Organisms_)) {return null} else if ($feature.Sensitive_Organisms_ == 20.9) {return "Average"} '
+                                 'else if ($feature.Sensitive_Organisms_ > 0 && $feature.Sensitive_Organisms_ <= 20.9)')
+    # The last category has no upper limit
+    assert '{return "Above Average"}' in expression and "inf" not in expression
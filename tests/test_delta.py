@@ -0,0 +1,110 @@
+# Tests for deliverables/delta.py, against a mock feature service (see mock_feature_server.py)
+
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from deliverables.delta import X, Y, diff_snapshot, publish_changes, service_values
+from mock_feature_server import MockFeatureServer
+
+WKID = 2958
+KEYS = {"Stations": ["Station"], "Data": ["Station", "Sample_Date", "Code"]}
+
+
+def stations():
+    return pd.DataFrame({"Station": [1, 2, 3], "Name": ["Mill Creek", "Pigeon River", "Scugog River"],
+                         X: [700000.0, 700001.5, 700002.25], Y: [4900000.0, 4900001.0, 4900002.0]})
+
+def data():
+    return pd.DataFrame({"Station": [1, 1, 2, 3],
+                         "Sample_Date": [datetime(2020, 1, 1), datetime(2020, 1, 1), datetime(2020, 2, 1), datetime(2020, 3, 1)],
+                         "Code": ["PPUT", "DO", "PPUT", "PPUT"],
+                         "Result": [0.02, np.nan, 0.05, 0.01]})
+
+def frames(stations_df, data_df):
+    return {"Stations": (stations_df, WKID), "Data": (data_df, None)}
+
+def published_rows(server, name):
+    return sorted((feature["attributes"]["Station"], feature["attributes"].get("Code"), feature["attributes"].get("Result"))
+                  for feature in server.features(name))
+
+
+@pytest.fixture
+def server():
+    with MockFeatureServer(layers=["Stations"], tables=["Data"]) as server:
+        yield server
+
+
+def test_first_publish_adds_every_row(server, tmp_path):
+    assert publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path), batch_size=2)
+    assert published_rows(server, "Data") == [(1, "DO", None), (1, "PPUT", 0.02), (2, "PPUT", 0.05), (3, "PPUT", 0.01)]
+    point = server.features("Stations")[1]["geometry"]
+    assert (point["x"], point["y"], point["spatialReference"]["wkid"]) == (700001.5, 4900001.0, WKID)
+    # Dates are sent as milliseconds since 1970
+    assert server.features("Data")[0]["attributes"]["Sample_Date"] == 1577836800000
+    assert sorted(os.listdir(tmp_path)) == ["Data.pkl", "Stations.pkl"]
+
+
+def test_rerun_without_changes_sends_no_edits(server, tmp_path):
+    publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path))
+    server.edits.clear()
+    assert publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path))
+    assert server.edits == []
+
+
+def test_published_service_is_read_when_there_is_no_snapshot(server, tmp_path):
+    publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path / "first"))
+    server.edits.clear()
+    # No snapshot in this folder: the rows (and the dates and coordinates) read back from the service match the data
+    assert publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path / "second"))
+    assert server.edits == []
+
+
+def test_edit_and_delete_round_trip(server, tmp_path):
+    publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path))
+    server.edits.clear()
+
+    changed = data()
+    changed.loc[0, "Result"] = 0.03                       # update
+    changed = changed[changed["Station"] != 3]            # delete
+    changed = pd.concat([changed, pd.DataFrame({"Station": [2], "Sample_Date": [datetime(2020, 4, 1)],
+                                                "Code": ["DO"], "Result": [8.5]})], ignore_index=True)   # add
+    moved = stations()
+    moved.loc[0, X] = 700010.0
+    assert publish_changes(server.url, frames(moved, changed), KEYS, str(tmp_path))
+
+    assert sorted(server.edits) == [("Data", "adds", 1), ("Data", "deletes", 1), ("Data", "updates", 1), ("Stations", "updates", 1)]
+    assert published_rows(server, "Data") == [(1, "DO", None), (1, "PPUT", 0.03), (2, "DO", 8.5), (2, "PPUT", 0.05)]
+    assert server.features("Stations")[0]["geometry"]["x"] == 700010.0
+
+    # The snapshot was updated with the new rows and object ids: nothing is sent the next time
+    server.edits.clear()
+    assert publish_changes(server.url, frames(moved, changed), KEYS, str(tmp_path))
+    assert server.edits == []
+    # ... and the next change only sends that change
+    changed.loc[3, "Result"] = 9.0
+    assert publish_changes(server.url, frames(moved, changed), KEYS, str(tmp_path))
+    assert server.edits == [("Data", "updates", 1)]
+
+
+def test_changed_fields_need_an_overwrite(server, tmp_path):
+    publish_changes(server.url, frames(stations(), data()), KEYS, str(tmp_path))
+    server.edits.clear()
+    assert not publish_changes(server.url, frames(stations().assign(Watercourse="x"), data()), KEYS, str(tmp_path))
+    assert server.edits == []
+
+
+def test_layer_missing_from_service_needs_an_overwrite(server, tmp_path):
+    assert not publish_changes(server.url, {"Summary": (data(), None)}, KEYS, str(tmp_path))
+    assert server.edits == []
+
+
+def test_duplicate_keys_are_matched_in_order():
+    old = service_values(pd.DataFrame({"Station": [1, 1], "Result": [1.0, 2.0]})).assign(__ObjectId=[10, 11])
+    new = service_values(pd.DataFrame({"Station": [1, 1, 1], "Result": [1.0, 2.5, 3.0]}))
+    adds, updates, deletes, unchanged = diff_snapshot(old, new, ["Station"])
+    assert adds["Result"].tolist() == [3.0]
+    assert list(zip(updates["__ObjectId"], updates["Result"])) == [(11, 2.5)]
+    assert deletes == []
+    assert unchanged["__ObjectId"].tolist() == [10]
@@ -0,0 +1,251 @@
+# Tests for deliverables/ingest.py (xlsx -> csv/parquet conversion and the manifest)
+
+import datetime, os
+import pandas as pd
+import pytest
+from deliverables.ingest import MANIFEST_NAME, ParquetSheetWriter, convert_workbooks, hash_workbook, load_manifest, projected_positions, read_intermediate, read_sheet, read_sheet_chunks, station_photos, stream_xlsx_sheets_to_csv, unique_stations, validate_field_name, xlsx_sheets_to_csv
+
+STATIONS = [["Station Code", "Name", "Value"],
+            ["S1", "Mill Creek", 1.5],
+            [None, None, None],
+            ["S2", "Pigeon River", 2],
+            ["S3", None, 3.25],
+            ["S4", "Scugog River", None],
+            [None, None, None]]
+
+
+#############################################
+#####         STREAMING WRITER          #####
+#############################################
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 3, 50000])
+def test_streaming_matches_pandas(workbook, tmp_path, chunk_rows):
+    path = workbook("stations.xlsx", {"Stations": STATIONS})
+    os.mkdir(tmp_path / "pandas")
+    os.mkdir(tmp_path / "streaming")
+    xlsx_sheets_to_csv(path, tmp_path / "pandas")
+    report = stream_xlsx_sheets_to_csv(path, tmp_path / "streaming", chunk_rows=chunk_rows)
+
+    expected = pd.read_csv(tmp_path / "pandas" / "Stations.csv")
+    streamed = pd.read_csv(tmp_path / "streaming" / "Stations.csv")
+    pd.testing.assert_frame_equal(streamed, expected)
+    # Like pandas: the blank row between two stations is kept, the blank row at the end is not,
+    # and the spaces are removed from the first field name
+    assert list(streamed.columns) == ["StationCode", "Name", "Value"]
+    assert [(entry["sheet"], entry["status"], entry["rows"]) for entry in report] == [("Stations", "converted", 5)]
+
+
+def test_streaming_names_header_like_pandas(workbook, tmp_path):
+    path = workbook("header.xlsx", {"Data": [["Site", None, "Value", "Value"], ["S1", "x", 1, 2]]})
+    stream_xlsx_sheets_to_csv(path, tmp_path)
+    assert list(pd.read_csv(tmp_path / "Data.csv").columns) == ["Site", "Unnamed: 1", "Value", "Value.1"]
+
+
+def test_streaming_only_converts_listed_sheets(workbook, tmp_path):
+    path = workbook("two.xlsx", {"Stations": STATIONS, "Other": [["A"], [1]]})
+    report = stream_xlsx_sheets_to_csv(path, tmp_path, sheet_names=["Stations"])
+    assert {entry["sheet"]: entry["status"] for entry in report} == {"Stations": "converted", "Other": "skipped"}
+    assert not os.path.exists(tmp_path / "Other.csv")
+
+
+def test_streaming_empty_sheet(workbook, tmp_path):
+    path = workbook("empty.xlsx", {"Empty": []})
+    report = stream_xlsx_sheets_to_csv(path, tmp_path)
+    assert report[0]["rows"] == 0
+    assert os.path.getsize(tmp_path / "Empty.csv") == 0
+
+
+def test_streaming_rejects_chunk_rows_below_one(workbook, tmp_path):
+    path = workbook("stations.xlsx", {"Stations": STATIONS})
+    with pytest.raises(ValueError):
+        stream_xlsx_sheets_to_csv(path, tmp_path, chunk_rows=0)
+
+
+#############################################
+#####         PARQUET INTERMEDIATE      #####
+#############################################
+
+# Write the DataFrames as the chunks of one sheet with ParquetSheetWriter and read the file back
+def write_parquet_chunks(path, chunks):
+    writer = ParquetSheetWriter(str(path))
+    try:
+        for chunk in chunks:
+            writer.write(pd.DataFrame(chunk))
+    finally:
+        writer.close()
+    return pd.read_parquet(path)
+
+
+def test_parquet_text_in_a_later_chunk_makes_the_column_text(tmp_path):
+    df = write_parquet_chunks(tmp_path / "results.parquet", [{"Site": ["S1", "S2"], "Result": [12, 0.5]},
+                                                             {"Site": ["S3", "S4"], "Result": [None, "<0.5"]}])
+    # The rows written before the text was found are rewritten as text
+    assert df["Result"].tolist()[:2] == ["12", "0.5"]
+    assert pd.isna(df["Result"][2]) and df["Result"][3] == "<0.5"
+
+
+def test_parquet_whole_numbers_allow_empty_cells_later(tmp_path):
+    df = write_parquet_chunks(tmp_path / "counts.parquet", [{"Count": [1, 2]}, {"Count": [None, 3]}])
+    assert df["Count"].dtype == "float64"
+    assert df["Count"].fillna(-1).tolist() == [1.0, 2.0, -1, 3.0]
+
+
+def test_parquet_empty_column_takes_the_type_of_its_first_values(tmp_path):
+    first = datetime.datetime(2023, 1, 1)
+    df = write_parquet_chunks(tmp_path / "late.parquet", [{"Value": [None, None], "Date": [first, None]},
+                                                          {"Value": [None, 2.5], "Date": [None, datetime.datetime(2023, 1, 3)]}])
+    assert df["Value"].dtype == "float64" and df["Value"][3] == 2.5
+    assert pd.api.types.is_datetime64_any_dtype(df["Date"])
+    assert df["Date"][0] == pd.Timestamp(first)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_parquet_sheet_keeps_the_column_types(workbook, tmp_path, streaming):
+    path = workbook("results.xlsx", {"Results": [["Site Code", "Date", "Value", "Result"],
+                                                 ["S1", datetime.datetime(2023, 5, 1), 1.5, "12"],
+                                                 ["S2", datetime.datetime(2023, 5, 2), 2, "<0.5"]]})
+    xlsx_sheets_to_csv(path, tmp_path, streaming=streaming, chunk_rows=1, file_format="parquet")
+    df = read_intermediate(str(tmp_path / "Results.parquet"))
+    assert list(df.columns) == ["SiteCode", "Date", "Value", "Result"]
+    assert pd.api.types.is_datetime64_any_dtype(df["Date"])
+    assert df["Value"].tolist() == [1.5, 2.0]
+    assert df["Result"].tolist() == ["12", "<0.5"]
+
+
+#############################################
+#####   PARALLEL CONVERSION / MANIFEST   #####
+#############################################
+
+def data_rows(path):
+    return pd.read_csv(path).values.tolist()
+
+def statuses(report):
+    return {(entry["workbook"], entry["sheet"]): entry["status"] for entry in report}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_last_workbook_wins(workbook, tmp_path, workers):
+    a = workbook("A.xlsx", {"Data": [["Site", "Value"], ["S1", "A1"]], "OnlyA": [["Site"], ["S1"]]})
+    b = workbook("B.xlsx", {"Data": [["Site", "Value"], ["S1", "B1"]]})
+    report = convert_workbooks([a, b], tmp_path, workers=workers)
+    assert data_rows(tmp_path / "Data.csv") == [["S1", "B1"]]
+    assert statuses(report) == {("A.xlsx", "Data"): "replaced", ("A.xlsx", "OnlyA"): "converted", ("B.xlsx", "Data"): "converted"}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_unchanged_sheets_are_not_converted_again(workbook, tmp_path):
+    a = workbook("A.xlsx", {"Data": [["Site", "Value"], ["S1", "A1"]]})
+    b = workbook("B.xlsx", {"Data": [["Site", "Value"], ["S1", "B1"]]})
+    manifest = load_manifest(str(tmp_path / MANIFEST_NAME))
+    convert_workbooks([a, b], tmp_path, workers=1, manifest=manifest)
+    report = convert_workbooks([a, b], tmp_path, workers=1, manifest=manifest)
+    assert statuses(report) == {("A.xlsx", "Data"): "replaced", ("B.xlsx", "Data"): "unchanged"}
+    assert report[-1]["hash"] == manifest["workbooks"]["B.xlsx"]["converted"]["Data"]
+
+
+# A.xlsx and B.xlsx both have a "Data" sheet and only A.xlsx is edited:
+# the file still has to hold the rows of B.xlsx, which comes last alphabetically
+def test_edit_in_earlier_workbook_keeps_last_workbook(workbook, tmp_path):
+    a = workbook("A.xlsx", {"Data": [["Site", "Value"], ["S1", "A1"]]})
+    b = workbook("B.xlsx", {"Data": [["Site", "Value"], ["S1", "B1"]]})
+    manifest = load_manifest(str(tmp_path / MANIFEST_NAME))
+    convert_workbooks([a, b], tmp_path, workers=1, manifest=manifest)
+
+    workbook("A.xlsx", {"Data": [["Site", "Value"], ["S1", "A2"]]})
+    report = convert_workbooks([a, b], tmp_path, workers=1, manifest=manifest)
+    assert data_rows(tmp_path / "Data.csv") == [["S1", "B1"]]
+    assert statuses(report) == {("A.xlsx", "Data"): "replaced", ("B.xlsx", "Data"): "converted"}
+    # The hash used for the table (last converted/unchanged entry of the sheet, see temperature.py) is the one of B.xlsx
+    sheet_hashes = {entry["sheet"]: entry["hash"] for entry in report if entry["status"] in ("converted", "unchanged")}
+    assert sheet_hashes["Data"] == hash_workbook(b)["sheets"]["Data"]
+
+
+def test_removed_last_workbook_converts_the_earlier_one(workbook, tmp_path):
+    a = workbook("A.xlsx", {"Data": [["Site", "Value"], ["S1", "A1"]]})
+    b = workbook("B.xlsx", {"Data": [["Site", "Value"], ["S1", "B1"]]})
+    manifest = load_manifest(str(tmp_path / MANIFEST_NAME))
+    convert_workbooks([a, b], tmp_path, workers=1, manifest=manifest)
+
+    report = convert_workbooks([a], tmp_path, workers=1, manifest=manifest)
+    assert statuses(report) == {("A.xlsx", "Data"): "converted"}
+    assert data_rows(tmp_path / "Data.csv") == [["S1", "A1"]]
+
+
+def test_unreadable_workbook_is_reported(workbook, tmp_path):
+    broken = tmp_path / "broken.xlsx"
+    broken.write_bytes(b"not a workbook")
+    b = workbook("B.xlsx", {"Data": [["Site", "Value"], ["S1", "B1"]]})
+    report = convert_workbooks([str(broken), b], tmp_path, workers=1)
+    assert statuses(report) == {("broken.xlsx", None): "error", ("B.xlsx", "Data"): "converted"}
+
+
+#############################################
+#####        SHEET TO DATAFRAME         #####
+#############################################
+
+def test_projected_positions():
+    names = ["Station Code", "Name", "Value", "Unnamed: 3"]
+    assert projected_positions(names) == [0, 1, 2, 3]
+    # In the order asked for, or in the order of the sheet for a function
+    assert projected_positions(names, ["Value", "Station Code"]) == [2, 0]
+    assert projected_positions(names, lambda name: not name.startswith("Unnamed")) == [0, 1, 2]
+    with pytest.raises(ValueError, match="Watershed"):
+        projected_positions(names, ["Name", "Watershed"])
+
+
+@pytest.mark.parametrize("chunk_rows, sizes", [(1, [1, 1, 1, 1]), (2, [2, 2]), (3, [3, 1]), (50000, [4])])
+def test_read_sheet_chunks(workbook, chunk_rows, sizes):
+    path = workbook("stations.xlsx", {"Other": [["x"], [1]], "Stations": [[None, None]] + STATIONS})
+    chunks = list(read_sheet_chunks(path, "Stations", columns=["Value", "Station Code"], chunk_rows=chunk_rows))
+    # The blank rows are skipped (the first non-blank row holds the field names), and only the listed columns are read
+    assert [len(chunk) for chunk in chunks] == sizes
+    assert all(list(chunk.columns) == ["Value", "Station Code"] for chunk in chunks)
+    assert pd.concat(chunks, ignore_index=True).fillna(-1).values.tolist() == [[1.5, "S1"], [2, "S2"], [3.25, "S3"], [-1, "S4"]]
+
+
+def test_read_sheet_chunks_of_a_sheet_without_rows(workbook):
+    path = workbook("empty.xlsx", {"Empty": [], "Header": [["Site", "Value"]]})
+    assert list(read_sheet_chunks(path, "Empty")) == []
+    chunks = list(read_sheet_chunks(path, "Header"))
+    assert len(chunks) == 1 and list(chunks[0].columns) == ["Site", "Value"] and len(chunks[0]) == 0
+    with pytest.raises(ValueError):
+        list(read_sheet_chunks(path, "Header", chunk_rows=0))
+
+
+def test_read_sheet_filters_every_chunk(workbook):
+    path = workbook("stations.xlsx", {"Stations": STATIONS})
+    df, rows_read = read_sheet(path, row_filter=lambda chunk: chunk[chunk["Value"].notna()], columns=lambda name: name != "Name", chunk_rows=1)
+    assert rows_read == 4
+    assert df.values.tolist() == [["S1", 1.5], ["S2", 2], ["S3", 3.25]]
+
+
+#############################################
+#####          STATION POINTS           #####
+#############################################
+
+def test_unique_stations():
+    measurements = pd.DataFrame({"Site_Code": ["S2", "S1", "S2", "S1", "S3"], "Watercourse": ["Pigeon", "Mill", "Pigeon (2)", "Mill", None],
+                                 "Easting": [2.0, 1.0, 2.5, 1.0, 3.0], "Result": [5, 6, 7, 8, 9]})
+    stations = unique_stations(measurements, "Site_Code", ["Watercourse", "Easting", "Site_Code"])
+    # The first row of each station, in the order of the table, with the key first and only the station fields
+    assert list(stations.columns) == ["Site_Code", "Watercourse", "Easting"]
+    assert stations.index.tolist() == [0, 1, 2]
+    assert stations.fillna("-").values.tolist() == [["S2", "Pigeon", 2.0], ["S1", "Mill", 1.0], ["S3", "-", 3.0]]
+
+
+#############################################
+#####   FIELD NAMES AND PHOTOS (GPKG)   #####
+#############################################
+
+@pytest.mark.parametrize("name, expected", [("Station #", "Station__"), ("Site Code", "Site_Code"), ("Family Biotic Index (Value)", "Family_Biotic_Index__Value_"),
+                                            ("Result_", "Result_"), ("2021 Mean", "_2021_Mean"), ("x" * 70, "x" * 64)])
+def test_validate_field_name(name, expected):
+    assert validate_field_name(name) == expected
+
+
+def test_station_photos():
+    stations = pd.DataFrame({"Site_Code": ["S1", "S2", "S3"]})
+    unmatched = station_photos(stations, "Site_Code", {"S1": "https://photos/s1.jpg", "S9": "https://photos/s9.jpg"})
+    assert stations["Photo"].tolist()[0] == "https://photos/s1.jpg"
+    assert stations["Photo"].isna().tolist() == [False, True, True]
+    assert unmatched == {"no_station": ["S9"], "no_photo": ["S2", "S3"]}
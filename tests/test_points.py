@@ -0,0 +1,170 @@
+# Tests for deliverables/points.py (points and tables written without arcpy) and the output_format = "gpkg" mode of the scripts
+
+import json, sqlite3, struct
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import run_script
+from deliverables.points import gpkg_layers, read_gpkg_table, write_gpkg_table, xy_to_points_file
+
+STATIONS = pd.DataFrame({"Site": ["S1", "S2", "S3"],
+                         "East": [700000.0, 700250.5, None],
+                         "North": [4900000.0, 4900100.0, 4900200.0],
+                         "Sampled": pd.to_datetime(["2023-06-01 09:30", "2023-06-02 14:00", None])})
+
+
+# x, y and srs_id of a GeoPackage point geometry (None for an empty geometry)
+def read_point(blob):
+    if blob is None:
+        return None
+    assert blob[:2] == b"GP"
+    srs_id = struct.unpack("<i", blob[4:8])[0]
+    byte_order, wkb_type, x, y = struct.unpack("<BIdd", blob[8:])
+    assert (byte_order, wkb_type) == (1, 1)
+    return x, y, srs_id
+
+
+#############################################
+#####            GEOPACKAGE             #####
+#############################################
+
+def test_geopackage_points(tmp_path):
+    path = str(tmp_path / "stations.gpkg")
+    xy_to_points_file(STATIONS, path, "East", "North", "NAD_1983_CSRS_UTM_Zone_17N", layer="Stations", drop_xy=True)
+
+    with sqlite3.connect(path) as db:
+        assert db.execute("PRAGMA application_id").fetchone()[0] == 1196444487
+        rows = db.execute("SELECT geom, Site, Sampled FROM Stations ORDER BY fid").fetchall()
+        columns = [row[1] for row in db.execute("PRAGMA table_info(Stations)")]
+        contents = db.execute("SELECT data_type, min_x, min_y, max_x, max_y, srs_id FROM gpkg_contents WHERE table_name = 'Stations'").fetchone()
+        geometry_column = db.execute("SELECT column_name, geometry_type_name, srs_id FROM gpkg_geometry_columns").fetchall()
+    assert [read_point(row[0]) for row in rows] == [(700000.0, 4900000.0, 2958), (700250.5, 4900100.0, 2958), None]
+    assert columns == ["fid", "geom", "Site", "Sampled"]
+    assert contents == ("features", 700000.0, 4900000.0, 700250.5, 4900100.0, 2958)
+    assert geometry_column == [("geom", "POINT", 2958)]
+    # Local dates are stored as they are, without a "Z" (UTC) suffix
+    assert [row[2] for row in rows] == ["2023-06-01T09:30:00", "2023-06-02T14:00:00", None]
+
+
+def test_geopackage_tables_are_kept_and_replaced(tmp_path):
+    path = str(tmp_path / "output.gpkg")
+    data = pd.DataFrame({"Site": ["S1", "S2"], "Result": [1.5, np.nan], "Count": pd.array([3, None], dtype="Int16"),
+                         "Passed": [True, False], "Sampled": pd.to_datetime(["2023-06-01", "2023-06-02"])})
+    xy_to_points_file(STATIONS, path, "East", "North", "NAD 1983 UTM Zone 17N", layer="Stations")
+    write_gpkg_table(data, path, "Data")
+    write_gpkg_table(data.iloc[:1], path, "Data")
+    assert sorted(gpkg_layers(path)) == ["Data", "Stations"]
+
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT data_type, srs_id FROM gpkg_contents WHERE table_name = 'Data'").fetchone() == ("attributes", None)
+        assert db.execute("SELECT srs_id FROM gpkg_contents WHERE table_name = 'Stations'").fetchone() == (26917,)
+    table = read_gpkg_table(path, "Data")
+    assert list(table.columns) == ["Site", "Result", "Count", "Passed", "Sampled"]
+    assert table.to_dict("records") == [{"Site": "S1", "Result": 1.5, "Count": 3, "Passed": 1, "Sampled": pd.Timestamp("2023-06-01")}]
+    assert len(read_gpkg_table(path, "Stations")) == 3
+
+
+def test_gpkg_layers_of_missing_file(tmp_path):
+    assert gpkg_layers(str(tmp_path / "missing.gpkg")) == []
+
+
+#############################################
+#####              GEOJSON              #####
+#############################################
+
+def test_geojson_dates(tmp_path):
+    path = str(tmp_path / "stations.geojson")
+    stations = STATIONS.assign(Logged=pd.to_datetime(["2023-06-01 09:30", "2023-01-15 12:00", None]).tz_localize("America/Toronto"))
+    xy_to_points_file(stations, path, "East", "North", "NAD_1983_CSRS_UTM_Zone_17N")
+    with open(path, encoding="utf-8") as f:
+        collection = json.load(f)
+
+    assert collection["crs"]["properties"]["name"] == "urn:ogc:def:crs:EPSG::2958"
+    features = collection["features"]
+    assert features[0]["geometry"] == {"type": "Point", "coordinates": [700000.0, 4900000.0]}
+    assert features[2]["geometry"] is None
+    # Naive dates are written without "Z"; dates with a time zone are converted to UTC first
+    assert [feature["properties"]["Sampled"] for feature in features] == ["2023-06-01T09:30:00", "2023-06-02T14:00:00", None]
+    assert [feature["properties"]["Logged"] for feature in features] == ["2023-06-01T13:30:00Z", "2023-01-15T17:00:00Z", None]
+
+
+def test_unknown_file_format_or_spatial_reference(tmp_path):
+    with pytest.raises(ValueError):
+        xy_to_points_file(STATIONS, str(tmp_path / "stations.shp"), "East", "North", "NAD 1983 UTM Zone 17N")
+    with pytest.raises(ValueError):
+        xy_to_points_file(STATIONS, str(tmp_path / "stations.gpkg"), "East", "North", "WGS 1984 Web Mercator")
+
+
+#############################################
+#####    SCRIPTS WITHOUT ARCPY (GPKG)   #####
+#############################################
+
+def test_pwqmn_writes_geopackage_without_arcpy(workbook, tmp_path):
+    header = ["Conservation_Authority", "Station #", "BOW_SITE_DESC", "SAMPLE_PT_DESC_1", "East", "North", "Sample_Date", "TEST_CODE", "DESCRIPTION", "Result", "UNITS"]
+    rows = [["KC", 1, "burnt river", "Bridge", 700001, 4900000, "2022-06-01", "PPUT", "Phosphorus", "0.04", "mg/L"],
+            ["KC", 1, "burnt river", "Bridge", 700001, 4900000, "2022-06-01", "CLIDUR", "Chloride", "<150", "mg/L"],
+            ["KC", 2, "gull river", "Dam", 700002, 4900000, "2022-07-01", "DO", "Oxygen", "7", "mg/L"],
+            ["KC", 2, "gull river", "Dam", 700002, 4900000, "2022-07-01", "ZZZ", "Other", "1", "x"],
+            ["KC", 3, "pigeon river", "Weir", 700003, 4900000, "2022-07-01", "ZZZ", "Other", "1", "x"]]
+    path = workbook("pwqmn.xlsx", {"Data": [header] + rows})
+    gpkg_path = str(tmp_path / "PWQMN.gpkg")
+    settings = {"input_PWQMN_table": path, "outdir": str(tmp_path), "output_format": "gpkg", "gpkg_path": gpkg_path}
+    run_script("deliverables/pwqmn.py", settings, tmp_path)
+
+    assert sorted(gpkg_layers(gpkg_path)) == ["PWQMN_Data", "PWQMN_Stations", "PWQMN_Summary_Month", "PWQMN_Summary_Year"]
+    data = read_gpkg_table(gpkg_path, "PWQMN_Data")
+    # Rows of the other parameters are dropped, phosphorus is converted to µg/L and censored results are left empty
+    assert data[["Station__", "TEST_CODE", "ThresholdPass"]].values.tolist() == [[1, "PPUT", "Fail"], [1, "CLIDUR", "N/A"], [2, "DO", "Pass"]]
+    assert data["Result_"].fillna(-1).tolist() == [40.0, -1, 7.0]
+    stations = read_gpkg_table(gpkg_path, "PWQMN_Stations")
+    # Station 3 only has a parameter that is not kept, but it still gets a point (like the whole Excel table before)
+    assert stations[["Station__", "BOW_SITE_DESC"]].values.tolist() == [[1, "Burnt River"], [2, "Gull River"], [3, "Pigeon River"]]
+    assert stations["Photo"].notna().all()
+
+    # Nothing has changed - the tables are reused
+    assert "reusing the existing tables" in run_script("deliverables/pwqmn.py", settings, tmp_path)
+
+
+def test_biomonitoring_writes_geopackage_without_arcpy(workbook, tmp_path):
+    header = ["Site Code", "Watercourse", "Site Type", "Habitat Type", "Easting", "Northing", "Family Biotic Index Value", "Sensitive Organisms (%)"]
+    rows = [["ASD01", "Mill Creek", "Reference", "Riffle", 700000, 4900000, "4.1", 35],
+            ["ASD01", "Mill Creek", "Reference", "Riffle", 700000, 4900000, "N/A", 40],
+            ["ZZZ99", "Gull River", "Test", "Pool", 700100, 4900100, "6", 12]]
+    path = workbook("biomonitoring.xlsx", {"Biomonitoring": [header] + rows})
+    gpkg_path = str(tmp_path / "Biomonitoring.gpkg")
+    settings = {"input_BM_table": path, "outdir": str(tmp_path), "output_format": "gpkg", "gpkg_path": gpkg_path}
+    output = run_script("deliverables/biomonitoring.py", settings, tmp_path)
+
+    assert sorted(gpkg_layers(gpkg_path)) == ["Biomonitoring_Data", "Biomonitoring_Stations"]
+    data = read_gpkg_table(gpkg_path, "Biomonitoring_Data")
+    # The sheet is written straight to the GeoPackage, with the field names cleaned and without an intermediate .csv file
+    # The Family Biotic Index field keeps its place in the table
+    assert list(data.columns) == ["Site_Code", "Watercourse", "Site_Type", "Habitat_Type", "Easting", "Northing", "FamilyBioticIndex_Value", "Sensitive_Organisms_"]
+    assert data["Sensitive_Organisms_"].tolist() == [35, 40, 12]
+    assert data["FamilyBioticIndex_Value"].fillna(-1).tolist() == [4.1, -1, 6.0]
+    assert not list(tmp_path.glob("*.csv"))
+    stations = read_gpkg_table(gpkg_path, "Biomonitoring_Stations")
+    assert stations[["Site_Code", "Watercourse", "Site_Type", "Habitat_Type"]].values.tolist() == [["ASD01", "Mill Creek", "Reference", "Riffle"],
+                                                                                                   ["ZZZ99", "Gull River", "Test", "Pool"]]
+    assert stations["Photo"].notna().tolist() == [True, False]
+    assert "Stations with no photo: ZZZ99" in output
+
+
+def test_temperature_writes_geopackage_without_arcpy(workbook, tmp_path):
+    (tmp_path / "xlsx").mkdir()
+    (tmp_path / "csv").mkdir()
+    workbook("xlsx/temperature.xlsx", {"Coldwater Streams - metadata": [["SiteCode", "Watercourse", "Easting", "Northing"], ["CW-01", "Mill Creek", 700000, 4900000], ["CW-02", "Pigeon River", 700100, 4900100]],
+                                       "ColdwaterStreams": [["SiteCode", "Row Labels", "Year", "Mean Temp"], ["cw01", "Jul", 2021, 15.2], ["CW-02", "Aug", 2021, 16.1]]})
+    gpkg_path = str(tmp_path / "Temperature.gpkg")
+    settings = {"input_Temp_Table": str(tmp_path / "xlsx"), "output_Temp_Table": str(tmp_path / "csv"), "outdir": str(tmp_path), "output_format": "gpkg", "gpkg_path": gpkg_path}
+    run_script("deliverables/temperature.py", settings, tmp_path)
+
+    assert sorted(gpkg_layers(gpkg_path)) == ["TemperatureMonitoringData", "TemperatureMonitoringPoints", "TemperatureMonitoringXYData"]
+    data = read_gpkg_table(gpkg_path, "TemperatureMonitoringData")
+    # The site codes were matched to the metadata codes, and the months became dates
+    assert data[["SiteCode", "Mean_Temp", "textDate"]].values.tolist() == [["CW-01", 15.2, "Jul 2021"], ["CW-02", 16.1, "Aug 2021"]]
+    assert data["Date"].tolist() == [pd.Timestamp("2021-07-01 12:00"), pd.Timestamp("2021-08-01 12:00")]
+    with sqlite3.connect(gpkg_path) as db:
+        points = [read_point(row[0]) for row in db.execute("SELECT geom FROM TemperatureMonitoringPoints ORDER BY fid")]
+    # Same spatial reference as the geodatabase output (coordsys, NAD 1983 CSRS UTM Zone 17N)
+    assert points == [(700000.0, 4900000.0, 2958), (700100.0, 4900100.0, 2958)]
@@ -0,0 +1,131 @@
+# Tests for deliverables/portal.py (kept-alive connections, token cache, requests in flight)
+
+import json, threading, time, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from deliverables.portal import PortalSession
+
+
+# Test server that keeps its connections open (HTTP/1.1) and remembers every request:
+#   drop >> number of requests to read and then close the connection without answering
+#           (the server has run them, but the client never gets the answer)
+class KeepAliveServer:
+    def __init__(self):
+        self.requests = []      # (client port, form fields) of every request
+        self.drop = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.delay = 0.0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = "http://127.0.0.1:{}/sharing/rest".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def connections(self):
+        return len({port for port, fields in self.requests})
+
+    def handler(self):
+        test_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+                fields = dict(urllib.parse.parse_qsl(body))
+                with test_server.lock:
+                    test_server.requests.append((self.client_address[1], fields))
+                    test_server.in_flight += 1
+                    test_server.peak = max(test_server.peak, test_server.in_flight)
+                    drop = test_server.drop > 0
+                    test_server.drop -= drop
+                time.sleep(test_server.delay)
+                with test_server.lock:
+                    test_server.in_flight -= 1
+                if drop:
+                    self.close_connection = True
+                    return
+                answer = {"error": {"code": 498, "message": "Invalid token"}} if fields.get("token") == "expired" else {"ok": True}
+                data = json.dumps(answer).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+@pytest.fixture
+def server():
+    server = KeepAliveServer()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def test_connections_are_reused(server):
+    session = PortalSession()
+    for _ in range(5):
+        assert session.request_json(server.url + "/self", {}) == {"ok": True}
+    assert len(server.requests) == 5
+    assert server.connections() == 1
+
+
+def test_idempotent_request_is_sent_again_on_a_new_connection(server):
+    session = PortalSession()
+    session.request_json(server.url + "/self", {})
+    server.drop = 1
+    assert session.request_json(server.url + "/search", {}) == {"ok": True}
+    assert len(server.requests) == 3
+    assert server.connections() == 2
+
+
+def test_request_that_must_not_run_twice_is_not_sent_again(server):
+    session = PortalSession()
+    session.request_json(server.url + "/self", {})
+    server.drop = 1
+    with pytest.raises(RuntimeError, match="not sent again"):
+        session.request_json(server.url + "/addItem", {"title": "Service"}, idempotent=False)
+    # The server ran addItem once, on a new connection (a kept-alive connection is never used for it)
+    assert [fields.get("title") for port, fields in server.requests].count("Service") == 1
+    assert server.requests[0][0] != server.requests[1][0]
+
+
+def test_token_is_cached_and_renewed(server):
+    tokens = iter(["expired", "fresh"])
+    signins = []
+    def token_provider():
+        signins.append(1)
+        return {"token": next(tokens), "expires": time.time() + 3600}
+    session = PortalSession(token_provider)
+    for _ in range(3):
+        session.request_json(server.url + "/self", {})
+    # The expired token was replaced once (after the 498 answer), then the cached token was used
+    assert [fields["token"] for port, fields in server.requests] == ["expired", "fresh", "fresh", "fresh"]
+    assert len(signins) == 2
+
+
+def test_token_is_renewed_before_it_expires(server):
+    signins = []
+    def token_provider():
+        signins.append(1)
+        return {"token": "t" + str(len(signins)), "expires": time.time() + 60}
+    session = PortalSession(token_provider, refresh_margin=300)
+    session.request_json(server.url + "/self", {})
+    session.request_json(server.url + "/self", {})
+    assert len(signins) == 2
+
+
+def test_requests_in_flight_are_limited(server):
+    server.delay = 0.05
+    session = PortalSession(max_in_flight=2)
+    threads = [threading.Thread(target=session.request_json, args=(server.url + "/self", {})) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.requests) == 6
+    assert server.peak == 2
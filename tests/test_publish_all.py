@@ -0,0 +1,84 @@
+# Tests for deliverables/publish_all.py (grouping the deliverables and running them, with a status per service)
+# The deliverables are small stand-in scripts written to tmp_path, with output_format = "gpkg" so no arcpy is needed
+
+import ast, importlib, os, threading, time, traceback
+import pytest
+from conftest import load_functions, run_script
+
+FUNCTIONS = ["readSetting", "groupDeliverables", "runDeliverables", "printPublishReport"]
+
+
+# Write a deliverable script with these settings; ProcessData appends the name of the deliverable to 'log'
+# (or raises 'error')
+def write_deliverable(folder, name, aprx_path, outdir, error=None):
+    lines = ["service_name = " + repr(name.title() + " Service"),
+             "aprx_path = " + repr(aprx_path),
+             "outdir = " + repr(outdir),
+             "output_format = 'gpkg'",
+             "gpkg_path = " + repr(os.path.join(outdir, name + ".gpkg")),
+             "",
+             "def ProcessData():",
+             "    with open(" + repr(os.path.join(str(folder), "log.txt")) + ", 'a') as f:",
+             "        f.write(" + repr(name + "\n") + ")"]
+    if error:
+        lines.append("    raise RuntimeError(" + repr(error) + ")")
+    (folder / (name + ".py")).write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def publish_all(folder):
+    # readSetting reads the scripts next to __file__
+    modules = {"ast": ast, "importlib": importlib, "os": os, "time": time, "traceback": traceback, "__file__": str(folder / "publish_all.py")}
+    return load_functions("deliverables/publish_all.py", FUNCTIONS, ["deliverables"], modules)
+
+
+#############################################
+#####             GROUPING              #####
+#############################################
+
+def test_deliverables_sharing_a_project_or_folder_are_grouped(tmp_path):
+    write_deliverable(tmp_path, "pwqmn", "C:/A/Project.aprx", "C:/A/Output")
+    write_deliverable(tmp_path, "biomonitoring", "C:/B/Project.aprx", "C:/B/Output")
+    write_deliverable(tmp_path, "temperature", "C:/C/Project.aprx", "C:/A/Output")
+    write_deliverable(tmp_path, "extra", "C:/B/Project.aprx", "C:/D/Output")
+    groupDeliverables = publish_all(tmp_path)["groupDeliverables"]
+    # temperature shares the output folder of pwqmn, extra shares the project of biomonitoring
+    assert groupDeliverables(["pwqmn", "biomonitoring", "temperature", "extra"]) == [["pwqmn", "temperature"], ["biomonitoring", "extra"]]
+    assert groupDeliverables(["pwqmn", "biomonitoring"]) == [["pwqmn"], ["biomonitoring"]]
+
+
+def test_group_that_links_two_groups_merges_them(tmp_path):
+    write_deliverable(tmp_path, "pwqmn", "C:/A/Project.aprx", "C:/A/Output")
+    write_deliverable(tmp_path, "biomonitoring", "C:/B/Project.aprx", "C:/B/Output")
+    write_deliverable(tmp_path, "temperature", "C:/A/Project.aprx", "C:/B/Output")
+    groupDeliverables = publish_all(tmp_path)["groupDeliverables"]
+    assert groupDeliverables(["pwqmn", "biomonitoring", "temperature"]) == [["pwqmn", "biomonitoring", "temperature"]]
+
+
+#############################################
+#####          RUN AND REPORT           #####
+#############################################
+
+def test_failed_deliverable_does_not_stop_its_group(tmp_path, monkeypatch):
+    write_deliverable(tmp_path, "pwqmn", "C:/A/Project.aprx", "C:/A/Output", error="Sheet not found")
+    write_deliverable(tmp_path, "temperature", "C:/A/Project.aprx", "C:/A/Output")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    results = publish_all(tmp_path)["runDeliverables"](["pwqmn", "temperature"], threading.Lock())
+
+    assert [(entry["deliverable"], entry["service"], entry["status"], entry["error"]) for entry in results] == [
+        ("pwqmn", "Pwqmn Service", "failed", "Sheet not found"),
+        ("temperature", "Temperature Service", "written", None)]
+    assert (tmp_path / "log.txt").read_text(encoding="utf-8") == "pwqmn\ntemperature\n"
+
+
+def test_publish_all_reports_every_service(tmp_path):
+    write_deliverable(tmp_path, "pwqmn", "C:/A/Project.aprx", str(tmp_path))
+    write_deliverable(tmp_path, "biomonitoring", "C:/B/Project.aprx", "C:/B/Output", error="No map found")
+    write_deliverable(tmp_path, "temperature", "C:/C/Project.aprx", "C:/C/Output")
+    output = run_script("deliverables/publish_all.py", {"deliverables": ["pwqmn", "biomonitoring", "temperature"], "max_concurrent_uploads": 2}, tmp_path)
+
+    report = output.split(">> Publishing report\n")[1].splitlines()
+    assert report[0].startswith("       pwqmn: written to " + os.path.join(str(tmp_path), "pwqmn.gpkg") + " in ")
+    assert report[1] == "       ERROR biomonitoring: Biomonitoring Service - No map found"
+    assert report[2].startswith("       temperature: written to ")
+    assert report[3].startswith("       Published 0 of 3 services in ")
+    assert sorted((tmp_path / "log.txt").read_text(encoding="utf-8").split()) == ["biomonitoring", "pwqmn", "temperature"]
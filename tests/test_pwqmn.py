@@ -0,0 +1,335 @@
+# Tests for the PWQMN data processing functions in deliverables/pwqmn.py
+# The functions are read from the script with load_functions (see conftest.py), with the script's own inputs
+
+import operator, os
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import load_functions
+from deliverables import delta, ingest
+from deliverables.ingest import read_sheet, unique_stations, validate_field_name
+
+MODULES = {"pd": pd, "np": np, "operator": operator, "read_sheet": read_sheet, "unique_stations": unique_stations, "validate_field_name": validate_field_name}
+
+
+def pwqmn(*function_names, **settings):
+    namespace = load_functions("deliverables/pwqmn.py", function_names, ["Parameters", "Thresholds", "UnitConversions"], MODULES)
+    namespace.update(settings)
+    return namespace
+
+
+# Values of some columns, row by row, with None for every empty value (NaN, NA, NaT)
+def rows(df, columns):
+    return df[columns].astype(object).where(df[columns].notna(), None).values.tolist()
+
+
+# PWQMN rows as they are read from the Excel file (the Result field is text)
+def sample_rows():
+    return pd.DataFrame({"Station__": [1, 1, 1, 1, 1, 2],
+                         "BOW_SITE_DESC": ["burnt river", "burnt river", "burnt river", "burnt river", "burnt river", "GULL RIVER"],
+                         "TEST_CODE": ["PPUT", "PPUT", "PPUT", "PPUT", "CONDAM", "PPUT"],
+                         "Sample_Date": ["2022-06-01", "2022-06-15", "2022-07-01", "2023-06-01", "2022-06-01", "not recorded"],
+                         "Result": ["20", "40", "<5", "10", "500", "-9999"]})
+
+
+#############################################
+#####        PARAMETERS/STATIONS        #####
+#############################################
+
+def test_select_parameters():
+    selectParameters = pwqmn("selectParameters")["selectParameters"]
+    df = pd.DataFrame({"TEST_CODE": ["PPUT", None, None, "ZZZ", "RSP ", "RSP"],
+                       "DESCRIPTION": ["Phosphorus", "NITRATE,FILTERED", "Ammonia", "Other", "Solids", "Solids"]})
+    # The Nitrate row with no TEST_CODE is kept as NNOTUR; "RSP" is not "RSP " (the code has a space)
+    assert selectParameters(df)["TEST_CODE"].to_dict() == {0: "PPUT", 1: "NNOTUR", 4: "RSP "}
+
+
+def test_read_sheet_keeps_stations_of_every_parameter(workbook):
+    header = ["Conservation_Authority", "Station #", "BOW_SITE_DESC", "SAMPLE_PT_DESC_1", "East", "North", "Watershed", "TEST_CODE", "DESCRIPTION", "Result"]
+    path = workbook("pwqmn.xlsx", {"Data": [header,
+                                             ["KC", 1, "burnt river", "Bridge", 1, 2, "W", "PPUT", "Phosphorus", "0.04"],
+                                             ["KC", 2, "gull river", "Dam", 3, 4, "W", "ZZZ", "Other", "1"],
+                                             ["KC", 1, "burnt river", "Bridge", 1, 2, "W", None, "Nitrate", "2"],
+                                             ["KC", 3, "pigeon river", "Weir", 5, 6, "W", "ZZZ", "Other", "1"],
+                                             ["KC", 2, "gull river", "Dam", 3, 4, "W", "DO", "Oxygen", "7"]]})
+    namespace = pwqmn("fieldName", "selectParameters", "selectStationsAndParameters", output_format="gpkg")
+    station_chunks = []
+    station_fields = ["BOW_SITE_DESC", "SAMPLE_PT_DESC_1", "East", "North"]
+    df, rows_read = read_sheet(path, row_filter=lambda chunk: namespace["selectStationsAndParameters"](chunk, station_chunks, station_fields),
+                               columns=lambda column: namespace["fieldName"](column) not in ["Conservation_Authority", "Watershed"], chunk_rows=2)
+
+    # The unused columns are never read, and only the rows of the parameters are kept
+    assert list(df.columns) == ["Station #", "BOW_SITE_DESC", "SAMPLE_PT_DESC_1", "East", "North", "TEST_CODE", "DESCRIPTION", "Result"]
+    assert rows_read == 5
+    assert df[["Station #", "TEST_CODE"]].values.tolist() == [[1, "PPUT"], [1, "NNOTUR"], [2, "DO"]]
+    # Every station is kept, including station 3 which only has another parameter
+    stations = unique_stations(pd.concat(station_chunks, ignore_index=True), "Station__", station_fields)
+    assert stations.values.tolist() == [[1, "burnt river", "Bridge", 1, 2], [2, "gull river", "Dam", 3, 4], [3, "pigeon river", "Weir", 5, 6]]
+
+
+#############################################
+#####          THRESHOLD PASS           #####
+#############################################
+
+def test_threshold_pass_with_the_script_thresholds():
+    calcThresholdPass = pwqmn("calcThresholdPass")["calcThresholdPass"]
+    codes = pd.Series(["PPUT", "PPUT", "CLIDUR", "CLIDUR", "DO", "DO", "RSP ", "NNOTUR", "CONDAM", "PPUT"])
+    results = pd.Series([30, 30.1, 120, 121, 6.5, 6, 29, 3.5, 500, np.nan])
+    passed = calcThresholdPass(codes, results)
+    assert passed.tolist() == ["Pass", "Fail", "Pass", "Fail", "Pass", "Fail", "Pass", "Fail", None, "N/A"]
+
+
+def test_threshold_pass_keeps_the_index():
+    calcThresholdPass = pwqmn("calcThresholdPass")["calcThresholdPass"]
+    codes = pd.Series(["DO", "PPUT"], index=[7, 3])
+    passed = calcThresholdPass(codes, pd.Series([7.0, 50.0], index=[7, 3]))
+    assert passed.to_dict() == {7: "Pass", 3: "Fail"}
+
+
+@pytest.mark.parametrize("comparator, expected", [("<", ["Pass", "Fail", "Fail"]), ("<=", ["Pass", "Pass", "Fail"]),
+                                                  (">", ["Fail", "Fail", "Pass"]), (">=", ["Fail", "Pass", "Pass"])])
+def test_threshold_comparators(comparator, expected):
+    namespace = pwqmn("calcThresholdPass", Thresholds={"X": (comparator, 10)})
+    assert namespace["calcThresholdPass"](pd.Series(["X", "X", "X"]), pd.Series([9, 10, 11])).tolist() == expected
+
+
+def test_threshold_unknown_comparator():
+    namespace = pwqmn("calcThresholdPass", Thresholds={"X": ("=", 10)})
+    with pytest.raises(ValueError):
+        namespace["calcThresholdPass"](pd.Series(["X"]), pd.Series([10]))
+
+
+#############################################
+#####         CENSORED RESULTS          #####
+#############################################
+
+def test_parse_censored_results():
+    parseCensoredResults = pwqmn("parseCensoredResults")["parseCensoredResults"]
+    results = pd.Series(["12", "<0.5", "> 2000", " 1.5e2 ", "-9999", ".25", "N/A", None, "<", "5 mg"])
+    parsed = parseCensoredResults(results)
+    assert parsed["Value"].fillna(-1).tolist() == [12.0, -1, -1, 150.0, -9999.0, 0.25, -1, -1, -1, -1]
+    assert parsed["Flag"].tolist() == [None, "<", ">", None, None, None, None, None, None, None]
+    assert parsed["Limit"].fillna(-1).tolist() == [-1, 0.5, 2000.0, -1, -1, -1, -1, -1, -1, -1]
+
+
+def test_parse_censored_numeric_results():
+    # Cells that Excel already stored as numbers are read the same way as text
+    parseCensoredResults = pwqmn("parseCensoredResults")["parseCensoredResults"]
+    parsed = parseCensoredResults(pd.Series([3, 0.5, np.nan], index=[4, 5, 6]))
+    assert parsed.index.tolist() == [4, 5, 6]
+    assert parsed["Value"].fillna(-1).tolist() == [3.0, 0.5, -1]
+
+
+@pytest.mark.parametrize("policy, expected", [("null", [12.0, -1, -1]), ("limit", [12.0, 0.5, 2000.0]),
+                                              ("half", [12.0, 0.25, 2000.0]), ("zero", [12.0, 0.0, 2000.0])])
+def test_censored_policies(policy, expected):
+    namespace = pwqmn("parseCensoredResults", "substituteCensored")
+    censored = namespace["parseCensoredResults"](pd.Series(["12", "<0.5", ">2000"]))
+    assert namespace["substituteCensored"](censored, policy).fillna(-1).tolist() == expected
+
+
+def test_unknown_censored_policy():
+    namespace = pwqmn("parseCensoredResults", "substituteCensored")
+    with pytest.raises(ValueError):
+        namespace["substituteCensored"](namespace["parseCensoredResults"](pd.Series(["<1"])), "drop")
+
+
+#############################################
+#####          UNIT CONVERSION          #####
+#############################################
+
+def test_normalize_units_with_the_script_conversions():
+    normalizeUnits = pwqmn("normalizeUnits")["normalizeUnits"]
+    df = pd.DataFrame({"TEST_CODE": ["PPUT", "PPUT", "PPUT", "PPUT", "CLIDUR"],
+                       "UNITS": ["MILLIGRAM PER LITER", "mg/L", "MICROGRAM PER LITER", "ppm", "mg/L"],
+                       "Result_": [0.03, 0.02, 25.0, 1.0, 100.0],
+                       "Detection_Limit": [np.nan, 0.002, np.nan, np.nan, np.nan]}, index=[10, 11, 12, 13, 14])
+    unknown = normalizeUnits(df)
+    assert df["Result_"].tolist() == pytest.approx([30.0, 20.0, 25.0, 1.0, 100.0])
+    assert df.loc[11, "Detection_Limit"] == pytest.approx(2.0)
+    assert df["UNITS"].tolist() == ["MICROGRAM PER LITER", "MICROGRAM PER LITER", "MICROGRAM PER LITER", "ppm", "mg/L"]
+    # Only PPUT has conversions: its rows in an unknown unit are reported, CLIDUR rows are not checked
+    assert unknown.to_dict() == {("PPUT", "ppm"): 1}
+
+
+def test_normalize_units_reports_empty_units():
+    namespace = pwqmn("normalizeUnits", UnitConversions=[("CLIDUR", "mg/L", "mg/L", 1)])
+    df = pd.DataFrame({"TEST_CODE": ["CLIDUR", "CLIDUR"], "UNITS": ["mg/L", None], "Result_": [5.0, 6.0], "Detection_Limit": [np.nan, np.nan]})
+    unknown = namespace["normalizeUnits"](df)
+    assert df["Result_"].tolist() == [5.0, 6.0]
+    assert len(unknown) == 1 and unknown.iloc[0] == 1
+
+
+def test_normalize_units_rejects_duplicate_conversions():
+    namespace = pwqmn("normalizeUnits", UnitConversions=[("PPUT", "mg/L", "MICROGRAM PER LITER", 1000), ("PPUT", "mg/L", "ng/L", 1000000)])
+    df = pd.DataFrame({"TEST_CODE": ["PPUT"], "UNITS": ["mg/L"], "Result_": [0.01], "Detection_Limit": [np.nan]})
+    with pytest.raises(ValueError):
+        namespace["normalizeUnits"](df)
+
+
+#############################################
+#####          DERIVED FIELDS           #####
+#############################################
+
+def test_derived_fields():
+    calcDerivedFields = pwqmn("calcDerivedFields", "parseCensoredResults", "substituteCensored", censored_policy="null")["calcDerivedFields"]
+    df = calcDerivedFields(sample_rows())
+    assert df["BOW_SITE_DESC"].tolist() == ["Burnt River"] * 5 + ["Gull River"]
+    assert rows(df, ["Year", "Month"]) == [[2022, 6], [2022, 6], [2022, 7], [2023, 6], [2022, 6], [None, None]]
+    assert str(df["Year"].dtype) == str(df["Month"].dtype) == "Int16"
+    # The censored result keeps its sign and limit, and -9999 becomes null
+    assert rows(df, ["Result_", "Result_Flag", "Detection_Limit"]) == [[20.0, None, None], [40.0, None, None], [None, "<", 5.0],
+                                                                        [10.0, None, None], [500.0, None, None], [None, None, None]]
+
+
+# The whole stage (Nitrate back-fill, derived fields, phosphorus in µg/L) gives the values of the geoprocessing sequence
+def test_derived_fields_match_the_geoprocessing_sequence():
+    namespace = pwqmn("selectParameters", "calcDerivedFields", "parseCensoredResults", "substituteCensored", "normalizeUnits", censored_policy="null")
+    df = pd.DataFrame({"BOW_SITE_DESC": ["burnt river"] * 5,
+                       "TEST_CODE": [None, "PPUT", "PPUT", "CLIDUR", "ZZZ"],
+                       "DESCRIPTION": ["Nitrate", "Phosphorus", "Phosphorus", "Chloride", "Other"],
+                       "Sample_Date": ["2022-06-01", "2022-06-01", "2022-12-31", "2023-01-01", "2023-01-01"],
+                       "Result": ["1.5", "0.04", "-9999", "<150", "1"],
+                       "UNITS": ["mg/L", "MILLIGRAM PER LITER", "mg/L", "mg/L", "x"]})
+    df = namespace["selectParameters"](df).copy()
+    namespace["calcDerivedFields"](df)
+    assert namespace["normalizeUnits"](df).empty
+
+    assert rows(df, ["TEST_CODE", "Year", "Month", "Result_", "UNITS"]) == [["NNOTUR", 2022, 6, 1.5, "mg/L"],
+                                                                           ["PPUT", 2022, 6, 40.0, "MICROGRAM PER LITER"],
+                                                                           ["PPUT", 2022, 12, None, "MICROGRAM PER LITER"],
+                                                                           ["CLIDUR", 2023, 1, None, "mg/L"]]
+
+
+#############################################
+#####          SUMMARY TABLES           #####
+#############################################
+
+def summarize(period_fields):
+    namespace = pwqmn("calcDerivedFields", "parseCensoredResults", "substituteCensored", "calcThresholdPass", "summarizeResults", censored_policy="null")
+    df = namespace["calcDerivedFields"](sample_rows())
+    df.loc[5, "Result_"] = 50.0
+    df["ThresholdPass"] = namespace["calcThresholdPass"](df["TEST_CODE"], df["Result_"])
+    return namespace["summarizeResults"](df, period_fields)
+
+
+def test_yearly_summary():
+    summary = summarize(["Year"])
+    assert list(summary.columns) == ["Station__", "BOW_SITE_DESC", "TEST_CODE", "Year", "Result_Mean", "Result_Min", "Result_Max", "Result_Count", "Exceedance_Percent"]
+    # Conductivity has no threshold, so no exceedance; the censored July result has no value and no pass/fail, so it is not counted
+    assert rows(summary, list(summary.columns)) == [[1, "Burnt River", "CONDAM", 2022, 500.0, 500.0, 500.0, 1, None],
+                                                    [1, "Burnt River", "PPUT", 2022, 30.0, 20.0, 40.0, 2, 50.0],
+                                                    [1, "Burnt River", "PPUT", 2023, 10.0, 10.0, 10.0, 1, 0.0],
+                                                    [2, "Gull River", "PPUT", None, 50.0, 50.0, 50.0, 1, 100.0]]
+
+
+def test_monthly_summary():
+    summary = summarize(["Year", "Month"])
+    assert rows(summary, ["Station__", "TEST_CODE", "Year", "Month", "Result_Mean", "Result_Count", "Exceedance_Percent"]) == [
+        [1, "CONDAM", 2022, 6, 500.0, 1, None],
+        [1, "PPUT", 2022, 6, 30.0, 2, 50.0],
+        [1, "PPUT", 2022, 7, None, 0, None],
+        [1, "PPUT", 2023, 6, 10.0, 1, 0.0],
+        [2, "PPUT", None, None, 50.0, 1, 100.0]]
+
+
+def test_summary_keeps_rows_without_a_date():
+    # The row whose Sample_Date can't be read is in a group with an empty Year, so no result is left out
+    for period_fields in (["Year"], ["Year", "Month"]):
+        assert summarize(period_fields)["Result_Count"].sum() == 5
+
+
+#############################################
+#####     STAGING AND UPLOAD CACHE      #####
+#############################################
+
+UPLOAD_FUNCTIONS = ["AGOLUpload", "removeMapLayers"]
+UPLOAD_SETTINGS = ["service_name", "mysummary", "mytags", "mydescription", "mycredits", "myuselimitations", "sharepublic", "shareorg", "sharegroup",
+                   "foldertype", "foldername", "publish_mode", "service_url", "DeltaKeys", "chunked_upload", "upload_chunk_mb", "max_portal_requests", "force_rebuild"]
+
+
+# The map of the project and the arcpy sharing tools, as far as AGOLUpload uses them
+# The contents of every layer/table are a string in 'contents' (hashed instead of the rows of the geodatabase table)
+class SharingMap:
+    def __init__(self, contents):
+        self.contents = contents
+        self.calls = []
+        self.upload_error = None
+        self.server = SimpleNamespace(StageService=self.stage, UploadServiceDefinition=self.upload)
+
+    def listLayers(self):
+        return [SimpleNamespace(name="PWQMN_Stations", dataSource="PWQMN_Stations")]
+
+    def listTables(self):
+        return [SimpleNamespace(name=name, dataSource=name) for name in self.contents if name != "PWQMN_Stations"]
+
+    def removeTable(self, table):
+        pass
+
+    def removeLayer(self, layer):
+        pass
+
+    def getWebLayerSharingDraft(self, server_type, service_type, service_name, layers):
+        return SimpleNamespace(exportToSDDraft=lambda path: open(path, "w").close())
+
+    def stage(self, sddraft, sd):
+        self.calls.append("stage")
+        with open(sd, "w") as f:
+            f.write(str(self.contents))
+
+    def upload(self, sd, *args):
+        self.calls.append("upload")
+        if self.upload_error:
+            raise self.upload_error
+
+
+def agol_upload(tmp_path, sharing_map, **settings):
+    namespace = load_functions("deliverables/pwqmn.py", UPLOAD_FUNCTIONS, UPLOAD_SETTINGS, {"os": os})
+    for name in ["MANIFEST_NAME", "combine_hashes", "load_manifest", "save_manifest", "service_is_current", "record_service"]:
+        namespace[name] = getattr(ingest, name)
+    namespace.update(snapshot_folder=delta.snapshot_folder, clear_snapshots=delta.clear_snapshots, delta_publish=delta.delta_publish,
+                     hash_table=lambda source: sharing_map.contents[source], configure_session=lambda *args, **kwargs: None, arcpy_token=None,
+                     m=sharing_map, arcpy=sharing_map, aprx=SimpleNamespace(save=lambda: None), outdir=str(tmp_path), service_name="PWQMN")
+    namespace.update(settings)
+    namespace["AGOLUpload"]()
+    calls = list(sharing_map.calls)
+    sharing_map.calls.clear()
+    return calls
+
+
+def test_unchanged_service_is_not_staged_or_uploaded_again(tmp_path):
+    sharing_map = SharingMap({"PWQMN_Stations": "12 stations", "PWQMN_Data": "2022 results"})
+    assert agol_upload(tmp_path, sharing_map) == ["stage", "upload"]
+    assert agol_upload(tmp_path, sharing_map) == []
+    # force_rebuild stages and uploads anyway
+    assert agol_upload(tmp_path, sharing_map, force_rebuild=True) == ["stage", "upload"]
+
+
+def test_changed_sharing_settings_reuse_the_staged_service(tmp_path):
+    sharing_map = SharingMap({"PWQMN_Stations": "12 stations", "PWQMN_Data": "2022 results"})
+    agol_upload(tmp_path, sharing_map)
+    assert agol_upload(tmp_path, sharing_map, sharepublic="PUBLIC") == ["upload"]
+    # The summary is part of the service definition, so the service is staged again
+    assert agol_upload(tmp_path, sharing_map, sharepublic="PUBLIC", mysummary="PWQMN results") == ["stage", "upload"]
+
+
+def test_changed_table_is_staged_again(tmp_path):
+    sharing_map = SharingMap({"PWQMN_Stations": "12 stations", "PWQMN_Data": "2022 results"})
+    agol_upload(tmp_path, sharing_map)
+    sharing_map.contents["PWQMN_Data"] = "2022 and 2023 results"
+    assert agol_upload(tmp_path, sharing_map) == ["stage", "upload"]
+
+
+def test_failed_upload_reuses_the_staged_service(tmp_path):
+    sharing_map = SharingMap({"PWQMN_Stations": "12 stations", "PWQMN_Data": "2022 results"})
+    sharing_map.upload_error = RuntimeError("connection lost")
+    with pytest.raises(RuntimeError):
+        agol_upload(tmp_path, sharing_map)
+    sharing_map.calls.clear()
+    sharing_map.upload_error = None
+    assert agol_upload(tmp_path, sharing_map) == ["upload"]
+
+    # The .sd file was deleted - it is staged again
+    os.remove(tmp_path / "PWQMN.sd")
+    assert agol_upload(tmp_path, sharing_map, sharepublic="PUBLIC") == ["stage", "upload"]
@@ -0,0 +1,69 @@
+# Tests for deliverables/sitecodes.py (matching the site codes of a data table to its metadata table)
+
+import pandas as pd
+import pytest
+from deliverables.sitecodes import fuzzy_match, ngrams, normalize_site_code, reconcile_dataframe_site_codes, reconcile_site_codes
+
+
+# {data code: (metadata code, match)} of a report, without the "no data" rows
+def matches(report):
+    rows = report[report["Match"] != "no data"]
+    return {row.SiteCode: (None if pd.isna(row.Matched_SiteCode) else row.Matched_SiteCode, row.Match) for row in rows.itertuples()}
+
+
+@pytest.mark.parametrize("code, key", [(" cw-01 ", "CW01"), ("CW_01", "CW01"), ("Mill Creek #2", "MILLCREEK2"), (None, ""), (float("nan"), ""), (12, "12")])
+def test_normalize_site_code(code, key):
+    assert normalize_site_code(code) == key
+
+
+def test_ngrams():
+    assert ngrams("CW01", 3) == {"CW0", "W01"}
+    assert ngrams("CW", 3) == {"CW"}
+    assert ngrams("", 3) == set()
+
+
+#############################################
+#####          MATCHING CODES           #####
+#############################################
+
+def test_exact_and_normalized_matches():
+    report = reconcile_site_codes(["CW-01", "cw01 ", "CW-02", "CW-01"], ["CW-01", "CW-02", "CW-03"])
+    assert matches(report) == {"CW-01": ("CW-01", "exact"), "cw01 ": ("CW-01", "normalized"), "CW-02": ("CW-02", "exact")}
+    # Metadata codes that are not in the data are listed too
+    assert report[report["Match"] == "no data"]["Matched_SiteCode"].tolist() == ["CW-03"]
+
+
+def test_ambiguous_and_unmatched_codes():
+    # "CW02" normalizes to the key of two metadata codes, so it is not matched to either of them
+    report = reconcile_site_codes(["CW02", "ZZ9", None, ""], ["CW-02", "cw 02"])
+    assert matches(report) == {"CW02": (None, "ambiguous"), "ZZ9": (None, "unmatched")}
+
+
+def test_fuzzy_matching_is_optional():
+    data, metadata = ["MILCREEK01"], ["MILLCREEK01", "PIGEON02"]
+    assert matches(reconcile_site_codes(data, metadata)) == {"MILCREEK01": (None, "unmatched")}
+    report = reconcile_site_codes(data, metadata, fuzzy=True)
+    assert matches(report) == {"MILCREEK01": ("MILLCREEK01", "fuzzy")}
+    assert report.loc[report["SiteCode"] == "MILCREEK01", "Similarity"].item() == pytest.approx(14 / 17)
+    # Below min_similarity the code stays unmatched
+    assert matches(reconcile_site_codes(data, metadata, fuzzy=True, min_similarity=0.9)) == {"MILCREEK01": (None, "unmatched")}
+
+
+def test_fuzzy_match_ties_are_not_matched():
+    code, similarity = fuzzy_match(["AB123"], ["AB1234", "AB1235"], 3, 0.5)["AB123"]
+    assert code is None and similarity == pytest.approx(6 / 7)
+
+
+#############################################
+#####        RECONCILING TABLES         #####
+#############################################
+
+def test_reconcile_dataframe_site_codes(tmp_path):
+    data = pd.DataFrame({"SiteCode": ["cw01", "CW-02", "cw01", "XX"], "Temp": [1, 2, 3, 4]})
+    metadata = pd.DataFrame({"SiteCode": ["CW-01", "CW-02"]})
+    report_path = str(tmp_path / "SiteCode_report.csv")
+    report = reconcile_dataframe_site_codes(data, "SiteCode", metadata, "SiteCode", report_path)
+
+    assert data["SiteCode"].tolist() == ["CW-01", "CW-02", "CW-01", "XX"]
+    saved = pd.read_csv(report_path)
+    assert saved["Match"].tolist() == report["Match"].tolist() == ["normalized", "exact", "unmatched"]
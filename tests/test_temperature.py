@@ -0,0 +1,122 @@
+# Tests for the temperature data processing functions in deliverables/temperature.py
+# The functions are read from the script with load_functions (see conftest.py), with the script's own inputs
+
+import subprocess
+import pandas as pd
+import pytest
+from conftest import load_functions, run_script
+
+SETTINGS = ["MONTHS", "logger_fields", "logger_interval_minutes", "degree_hour_base", "logger_chunk_rows"]
+
+# Raw logger readings: CW-01 has three readings on July 1 (one of them at 23:45), one on July 2 and one in August
+LOGGER_FILES = {"logger1.csv": ["SiteCode,DateTime,Temperature",
+                                "CW-01,2021-07-01 00:00,18",
+                                "CW-01,2021-07-01 00:15,22",
+                                "CW-01,2021-07-01 00:30,",
+                                "CW-01,2021-07-01 23:45,24",
+                                "CW-02 ,2021-07-01 12:00,15",
+                                " ,2021-07-01 12:15,15",
+                                "CW-01,not a date,20"],
+                "logger2.csv": ["SiteCode,DateTime,Temperature,Battery",
+                                "CW-01,2021-07-02 06:00,21,3.1",
+                                "CW-01,2021-08-01 00:00,10,3.0",
+                                ",2021-08-01 00:15,10,3.0"]}
+
+
+def temperature(*function_names):
+    return load_functions("deliverables/temperature.py", function_names, SETTINGS, {"pd": pd})
+
+
+@pytest.fixture
+def logger_paths(tmp_path):
+    paths = []
+    for filename, lines in LOGGER_FILES.items():
+        (tmp_path / filename).write_text("\n".join(lines) + "\n", encoding="utf-8")
+        paths.append(str(tmp_path / filename))
+    return paths
+
+
+#############################################
+#####           MONTHLY DATES           #####
+#############################################
+
+def test_month_dates():
+    calcMonthDates = temperature("calcMonthDates")["calcMonthDates"]
+    df = pd.DataFrame({"SiteCode": ["CW-01", "CW-01", "CW-02", "CW-02", "CW-03", "CW-03"],
+                       "Row_Labels": ["Jul", " Dec ", "July", "Aug", None, "Jan"],
+                       "Year": [2021, "2022", 2021, 2021.5, 2021, None],
+                       "Mean_Temp": [15.2, 2.5, 16.0, 17.0, 18.0, 1.0]}, index=[10, 11, 12, 13, 14, 15])
+    dates, rejects = calcMonthDates(df)
+
+    assert list(dates.columns) == ["SiteCode", "Mean_Temp", "Date", "textDate"]
+    assert dates["Date"].tolist() == [pd.Timestamp("2021-07-01 12:00"), pd.Timestamp("2022-12-01 12:00")]
+    assert dates["textDate"].tolist() == ["Jul 2021", "Dec 2022"]
+    # A month that is not in MONTHS, a year that is not a whole number and empty values are rejected with their original fields
+    assert rejects.index.tolist() == [12, 13, 14, 15]
+    assert list(rejects.columns) == ["SiteCode", "Row_Labels", "Year", "Mean_Temp"]
+
+
+def test_rejected_months_are_written_next_to_the_csv_files(workbook, tmp_path):
+    (tmp_path / "xlsx").mkdir()
+    (tmp_path / "csv").mkdir()
+    workbook("xlsx/temperature.xlsx", {"Coldwater Streams - metadata": [["SiteCode", "Easting", "Northing"], ["CW-01", 700000, 4900000]],
+                                       "ColdwaterStreams": [["SiteCode", "Row Labels", "Year", "Mean Temp"], ["CW-01", "Jul", 2021, 15.2], ["CW-01", "Grand Total", None, 15.9]]})
+    settings = {"input_Temp_Table": str(tmp_path / "xlsx"), "output_Temp_Table": str(tmp_path / "csv"), "outdir": str(tmp_path), "output_format": "gpkg",
+                "gpkg_path": str(tmp_path / "Temperature.gpkg")}
+    output = run_script("deliverables/temperature.py", settings, tmp_path)
+
+    assert "WARNING: 1 rows have a month or year that can't be read" in output
+    rejects = pd.read_csv(tmp_path / "csv" / "TemperatureMonitoringData_rejects.csv")
+    assert list(rejects.columns) == ["SiteCode", "Row_Labels", "Year", "Mean_Temp"]
+    assert rejects[["SiteCode", "Row_Labels", "Mean_Temp"]].values.tolist() == [["CW-01", "Grand Total", 15.9]]
+
+
+#############################################
+#####        RAW LOGGER READINGS        #####
+#############################################
+
+# chunk_rows=2 splits the readings of CW-01 on July 1 across three chunks
+@pytest.mark.parametrize("chunk_rows", [1, 2, 1000000])
+def test_logger_aggregation(logger_paths, chunk_rows):
+    aggregateLoggerFiles = temperature("aggregateLoggerFiles", "combineLoggerTotals", "finishLoggerTotals")["aggregateLoggerFiles"]
+    daily, monthly, skipped = aggregateLoggerFiles(logger_paths, chunk_rows=chunk_rows)
+
+    # No temperature, a blank site code, a time that can't be read and no site code
+    assert skipped == 4
+    assert daily[["SiteCode", "Date", "Min_Temp", "Max_Temp", "Readings"]].values.tolist() == [
+        ["CW-01", pd.Timestamp("2021-07-01"), 18.0, 24.0, 3],
+        ["CW-01", pd.Timestamp("2021-07-02"), 21.0, 21.0, 1],
+        ["CW-01", pd.Timestamp("2021-08-01"), 10.0, 10.0, 1],
+        ["CW-02", pd.Timestamp("2021-07-01"), 15.0, 15.0, 1]]
+    assert daily["Mean_Temp"].tolist() == pytest.approx([64 / 3, 21, 10, 15])
+    # 15 minutes above 20 °C: (22 - 20) + (24 - 20) degrees x 0.25 h on July 1, (21 - 20) x 0.25 h on July 2
+    assert daily["Degree_Hours"].tolist() == pytest.approx([1.5, 0.25, 0, 0])
+
+    assert monthly[["SiteCode", "Date", "textDate", "Min_Temp", "Max_Temp", "Readings"]].values.tolist() == [
+        ["CW-01", pd.Timestamp("2021-07-01 12:00"), "Jul 2021", 18.0, 24.0, 4],
+        ["CW-01", pd.Timestamp("2021-08-01 12:00"), "Aug 2021", 10.0, 10.0, 1],
+        ["CW-02", pd.Timestamp("2021-07-01 12:00"), "Jul 2021", 15.0, 15.0, 1]]
+    # The monthly mean is the mean of the readings, not of the daily means
+    assert monthly["Mean_Temp"].tolist() == pytest.approx([21.25, 10, 15])
+    assert monthly["Degree_Hours"].tolist() == pytest.approx([1.75, 0, 0])
+
+
+def test_logger_aggregation_without_readings(tmp_path):
+    aggregateLoggerFiles = temperature("aggregateLoggerFiles", "combineLoggerTotals", "finishLoggerTotals")["aggregateLoggerFiles"]
+    (tmp_path / "empty.csv").write_text("SiteCode,DateTime,Temperature\n", encoding="utf-8")
+    for paths in ([], [str(tmp_path / "empty.csv")]):
+        daily, monthly, skipped = aggregateLoggerFiles(paths)
+        assert len(daily) == len(monthly) == skipped == 0
+        assert list(monthly.columns) == ["SiteCode", "Date", "textDate", "Mean_Temp", "Min_Temp", "Max_Temp", "Readings", "Degree_Hours"]
+        assert monthly["Date"].dtype.kind == "M" and monthly["Mean_Temp"].dtype == float
+
+
+def test_empty_logger_folder_stops_the_script(workbook, tmp_path):
+    for folder in ("xlsx", "csv", "loggers"):
+        (tmp_path / folder).mkdir()
+    workbook("xlsx/temperature.xlsx", {"Coldwater Streams - metadata": [["SiteCode", "Easting", "Northing"], ["CW-01", 700000, 4900000]]})
+    settings = {"input_Temp_Table": str(tmp_path / "xlsx"), "output_Temp_Table": str(tmp_path / "csv"), "outdir": str(tmp_path), "output_format": "gpkg",
+                "gpkg_path": str(tmp_path / "Temperature.gpkg"), "input_logger_folder": str(tmp_path / "loggers")}
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_script("deliverables/temperature.py", settings, tmp_path)
+    assert "No logger .csv files found in " + str(tmp_path / "loggers") in error.value.stderr
@@ -0,0 +1,202 @@
+# Tests for deliverables/uploads.py, against a mock portal that can inject failures (see mock_portal.py)
+
+import json, os
+import pytest
+from deliverables import portal as portal_module, uploads
+from deliverables.portal import PortalSession, TransientError
+from deliverables.uploads import PROGRESS_SUFFIX, add_attachments, update_item, upload_service_definition, wait_for_job, with_retries
+from mock_portal import MockPortal
+
+CHUNK_MB = 0.25
+CHUNK_BYTES = int(CHUNK_MB * 1024 * 1024)
+
+
+@pytest.fixture(autouse=True)
+def short_delays(monkeypatch):
+    monkeypatch.setattr(uploads, "BASE_RETRY_DELAY", 0.001)
+
+
+@pytest.fixture
+def portal():
+    with MockPortal(folders={"Collab": "folder1"}, groups={"Team": "group1"}) as portal:
+        yield portal
+
+
+@pytest.fixture
+def sd_file(tmp_path):
+    path = tmp_path / "Service.sd"
+    path.write_bytes(os.urandom(CHUNK_BYTES * 2 + 1000))   # 3 parts
+    return str(path)
+
+
+def upload(portal, sd_file, **options):
+    return upload_service_definition(portal.url, sd_file, "Service", "token", chunk_mb=CHUNK_MB, retries=2, **options)
+
+def sd_item(portal):
+    return next(id for id, item in portal.items.items() if item["type"] == "Service Definition")
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+#############################################
+#####          RETRIES/BACKOFF          #####
+#############################################
+
+def test_with_retries_retries_transient_errors_only():
+    attempts = []
+    def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise TransientError("busy")
+        return "done"
+    assert with_retries(send, retries=2, base_delay=0) == "done"
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(TransientError):
+        with_retries(send, retries=1, base_delay=0)
+    assert len(attempts) == 2
+
+    def refused():
+        attempts.append(1)
+        raise RuntimeError("not allowed")
+    attempts.clear()
+    with pytest.raises(RuntimeError):
+        with_retries(refused, retries=3, base_delay=0)
+    assert len(attempts) == 1
+
+
+def test_upload_continues_after_503(portal, sd_file):
+    portal.fail("/addPart", status=503)
+    portal.fail("/commit", status=503)
+    portal.fail("/publish", status=503)
+    service_id = upload(portal, sd_file, folder="Collab", org=True, groups="Team")
+
+    assert portal.item_data(sd_item(portal)) == read_bytes(sd_file)
+    assert portal.count("/addPart") == 4        # 3 parts + the one that was sent again
+    assert portal.count("/addItem") == 1
+    assert portal.items[sd_item(portal)]["folder"] == "folder1"
+    assert portal.items[service_id]["shared"] == {"everyone": "false", "org": "true", "groups": "group1"}
+    assert not os.path.exists(sd_file + PROGRESS_SUFFIX)
+
+
+# The service name in the url has no spaces or other non-word characters, the item keeps the name as its title
+def test_published_service_name_is_sanitized(portal, sd_file):
+    service_id = upload_service_definition(portal.url, sd_file, "Kawartha Conservation (PWQMN) Data", "token", chunk_mb=CHUNK_MB, retries=2)
+    assert portal.items[service_id]["name"] == "Kawartha_Conservation__PWQMN__Data"
+    assert portal.items[service_id]["title"] == "Kawartha Conservation (PWQMN) Data"
+
+
+# A 502 answer to publish may come after the service was published - publish is not sent again
+def test_publish_is_not_sent_again_after_ambiguous_error(portal, sd_file):
+    portal.fail("/publish", status=502)
+    with pytest.raises(RuntimeError, match="502"):
+        upload(portal, sd_file)
+    assert portal.count("/publish") == 1
+
+
+#############################################
+#####          RESUMABLE UPLOAD         #####
+#############################################
+
+# The upload stops after part 1 (an error that is not retried), then the script is run again
+def test_resume_after_crash_between_parts(portal, sd_file):
+    sent = []
+    original = portal.answer
+    def answer(path, fields):
+        if path.endswith("/addPart"):
+            sent.append(int(fields["partNum"]))
+            if len(sent) == 2:
+                return 200, {"error": {"code": 400, "message": "Injected failure", "details": []}}
+        return original(path, fields)
+    portal.answer = answer
+
+    with pytest.raises(RuntimeError):
+        upload(portal, sd_file)
+    with open(sd_file + PROGRESS_SUFFIX, encoding="utf-8") as f:
+        progress = json.load(f)
+    assert progress["parts"] == [1]
+
+    upload(portal, sd_file)
+    assert sent == [1, 2, 2, 3]
+    assert portal.count("/addItem") == 1
+    assert portal.item_data(sd_item(portal)) == read_bytes(sd_file)
+    assert not os.path.exists(sd_file + PROGRESS_SUFFIX)
+
+
+def test_changed_sd_file_starts_over(portal, sd_file):
+    portal.fail("/addPart", error=400)
+    with pytest.raises(RuntimeError):
+        upload(portal, sd_file)
+    assert os.path.exists(sd_file + PROGRESS_SUFFIX)
+
+    # A new .sd file (e.g. staged again) - the parts of the old file must not be reused
+    with open(sd_file, "wb") as f:
+        f.write(os.urandom(CHUNK_BYTES + 10))
+    portal.calls.clear()
+    upload(portal, sd_file)
+    # The .sd item of the first try gets the new file from the first part on (none of its old parts are kept)
+    assert portal.count("/update") == 1
+    assert portal.count("/addPart") == 2
+    assert portal.item_data(sd_item(portal)) == read_bytes(sd_file)
+
+
+#############################################
+#####          FOLDERS AND JOBS         #####
+#############################################
+
+def test_new_folder_is_created(portal, sd_file):
+    upload(portal, sd_file, folder="Dashboards", create_folder=True)
+    assert portal.count("/createFolder") == 1
+    assert portal.items[sd_item(portal)]["folder"] == portal.folders["Dashboards"]
+
+
+def test_missing_existing_folder_is_an_error(portal, sd_file):
+    with pytest.raises(RuntimeError, match="Dashboards"):
+        upload(portal, sd_file, folder="Dashboards")
+    assert portal.count("/addItem") == 0
+
+
+def test_job_that_never_completes_times_out(portal):
+    portal.job_status = "processing"
+    with pytest.raises(RuntimeError, match="processing"):
+        wait_for_job(portal.url + "/sharing/rest/content/users/me/items/item1/status", {}, "token", timeout=0.2, interval=0.05)
+
+
+#############################################
+#####      ITEMS AND ATTACHMENTS        #####
+#############################################
+
+def test_update_item(portal, sd_file):
+    service_id = upload(portal, sd_file)
+    update_item(portal.url + "/sharing/rest/content/users/me", service_id, {"snippet": "PWQMN stations", "tags": "water,PWQMN"}, "token")
+    assert portal.items[service_id]["properties"] == {"snippet": "PWQMN stations", "tags": "water,PWQMN", "f": "json", "token": "token"}
+
+
+def test_attachments_are_sent_in_parallel_up_to_max_in_flight(portal, tmp_path, monkeypatch):
+    monkeypatch.setattr(portal_module, "session", PortalSession(max_in_flight=3))
+    photos = {}
+    for object_id in range(1, 9):
+        photos[object_id] = str(tmp_path / "photo{}.jpg".format(object_id))
+        with open(photos[object_id], "wb") as f:
+            f.write(b"jpeg" + bytes([object_id]))
+    portal.delay = 0.1
+    layer_url = portal.url + "/services/Stations/FeatureServer/0"
+    portal.fail("/5/addAttachment", status=503)
+
+    assert add_attachments(layer_url, photos, "token") == {object_id: 1 for object_id in photos}
+    # 8 photos, 3 at a time: more than one request was answered at the same time, never more than 3
+    assert portal.peak == 3
+    assert portal.attachments[("/services/Stations/FeatureServer/0", 5)] == [("photo5.jpg", b"jpeg\x05")]
+    assert portal.count("/addAttachment") == 9     # + photo 5, sent again after the 503
+
+
+def test_attachment_is_not_sent_again_after_ambiguous_error(portal, tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"jpeg")
+    portal.fail("/1/addAttachment", status=502)
+    with pytest.raises(RuntimeError, match="502"):
+        add_attachments(portal.url + "/services/Stations/FeatureServer/0", {1: str(path)}, "token")
+    assert portal.count("/addAttachment") == 1